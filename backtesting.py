@@ -0,0 +1,458 @@
+import logging
+import typing
+
+import numpy as np
+
+from models import *
+import indicators
+from strategies import (
+    TechnicalStrategy,
+    BreakoutStrategy,
+    FractalStrategy,
+    RuleStrategy,
+)
+from rules import Rule, ArraySource
+
+logger = logging.getLogger()
+
+# Rows of the candle array used by the backtester, see candles_to_array()
+TIMESTAMP, OPEN, HIGH, LOW, CLOSE, VOLUME = range(6)
+
+
+def candles_to_array(candles: typing.List[Candle]) -> np.ndarray:
+    """
+    Convert a list of Candle objects (e.g. the output of get_historical_candles()) to the array format
+    used by the backtester: one row per field (timestamp, open, high, low, close, volume), one column per candle.
+    :param candles:
+    :return: A float64 array of shape (6, number of candles)
+    """
+
+    data = np.empty((6, len(candles)), dtype=np.float64)
+
+    for i, candle in enumerate(candles):
+        data[:, i] = (
+            candle.timestamp,
+            candle.open,
+            candle.high,
+            candle.low,
+            candle.close,
+            candle.volume,
+        )
+
+    return data
+
+
+class Backtester:
+    def __init__(
+        self,
+        data: np.ndarray,
+        initial_balance: float = 10000,
+        fee_pct: float = 0.0,
+        allow_short: bool = True,
+    ):
+        """
+        Replay the signal logic of the strategies on historical candles.
+        The indicators are computed once over the whole history and cached, so that running many parameter
+        sets or many windows on the same Backtester only pays for the indicators it has not seen yet.
+        :param data: Candle array as returned by candles_to_array()
+        :param initial_balance: Quote asset balance at the start of each backtest
+        :param fee_pct: Fee paid on the entry and on the exit notional, in percent
+        :param allow_short: False to skip the short signals, like on Binance Spot
+        """
+
+        self.data = data
+        self.initial_balance = initial_balance
+        self.fee_pct = fee_pct
+        self.allow_short = allow_short
+
+        self._indicators: typing.Dict[typing.Tuple, typing.Any] = dict()
+
+        # Entry candidates per (strategy, parameters), kept sparse so that the windows of a walk-forward
+        # evaluation reuse them instead of recomputing the signals over the whole history
+        self._entries: typing.Dict[typing.Tuple, typing.Tuple] = dict()
+        self.max_cached_entries = 20000
+
+        self._signal_functions = {
+            TechnicalStrategy: self._technical_signals,
+            BreakoutStrategy: self._breakout_signals,
+            FractalStrategy: self._fractal_signals,
+            RuleStrategy: self._rule_signals,
+        }
+
+    def _ema(self, span: int) -> np.ndarray:
+        key = ("ema", span)
+
+        if key not in self._indicators:
+            self._indicators[key] = indicators.ema(self.data[CLOSE], span)
+
+        return self._indicators[key]
+
+    def _rsi(self, length: int) -> np.ndarray:
+        key = ("rsi", length)
+
+        if key not in self._indicators:
+            self._indicators[key] = indicators.rsi(self.data[CLOSE], length)
+
+        return self._indicators[key]
+
+    def _macd(
+        self, ema_fast: int, ema_slow: int, ema_signal: int
+    ) -> typing.Tuple[np.ndarray, np.ndarray]:
+        key = ("macd", ema_fast, ema_slow, ema_signal)
+
+        if key not in self._indicators:
+            macd_line = self._ema(ema_fast) - self._ema(ema_slow)
+            macd_signal = indicators.ema(macd_line, ema_signal)
+            self._indicators[key] = (macd_line, macd_signal)
+
+        return self._indicators[key]
+
+    def _rolling_mean(self, row: int, window: int) -> np.ndarray:
+        key = ("rolling_mean", row, window)
+
+        if key not in self._indicators:
+            self._indicators[key] = indicators.rolling_mean(self.data[row], window)
+
+        return self._indicators[key]
+
+    def indicator(self, name: str, params: typing.Tuple) -> typing.Any:
+        """
+        Cached indicator by the names of the rules, see rules.INDICATORS.
+        :param name:
+        :param params:
+        :return: An array with one value per candle, (line, signal) for the MACD
+        """
+
+        if name == "ema":
+            return self._ema(*params)
+        if name == "sma":
+            return self._rolling_mean(CLOSE, *params)
+        if name == "volume_mean":
+            return self._rolling_mean(VOLUME, *params)
+        if name == "rsi":
+            return self._rsi(*params)
+        if name == "macd":
+            return self._macd(*params)
+        raise ValueError(f"Unknown indicator {name}")
+
+    def _fractal_stops(self) -> typing.Tuple[np.ndarray, np.ndarray]:
+        """
+        Stop levels of the Fractals strategy: for each candle, the most recent confirmed bullish (long stop) and
+        bearish (short stop) fractal, with the same 0.02% buffer as FractalStrategy.fractal_bullish/bearish().
+        A fractal on candle j is only known once candle j + 1 has closed.
+        """
+
+        key = ("fractal_stops",)
+
+        if key not in self._indicators:
+            lows = self.data[LOW]
+            highs = self.data[HIGH]
+            is_bullish, is_bearish = indicators.fractals(highs, lows)
+
+            # Known from the next candle
+            bullish = np.full(lows.shape, np.nan)
+            bearish = np.full(highs.shape, np.nan)
+            bullish[1:][is_bullish[:-1]] = lows[:-1][is_bullish[:-1]] * (1 - 0.0002)
+            bearish[1:][is_bearish[:-1]] = highs[:-1][is_bearish[:-1]] * (1 + 0.0002)
+
+            self._indicators[key] = (
+                indicators.ffill(bullish),
+                indicators.ffill(bearish),
+            )
+
+        return self._indicators[key]
+
+    def _technical_signals(self, params: typing.Dict) -> typing.Tuple:
+        rsi = self._rsi(params["rsi_length"])
+        macd_line, macd_signal = self._macd(
+            params["ema_fast"], params["ema_slow"], params["ema_signal"]
+        )
+
+        with np.errstate(invalid="ignore"):
+            signals = np.where(
+                (rsi < 30) & (macd_line > macd_signal),
+                1,
+                np.where((rsi > 70) & (macd_line < macd_signal), -1, 0),
+            )
+
+        return signals, self._pct_exits(params), self._pct_sizing(params)
+
+    def _breakout_signals(self, params: typing.Dict) -> typing.Tuple:
+        """
+        The live strategy compares the first trade of the new candle with the high/low of the candle that just
+        closed. The backtest uses the open of the next candle for that price and the volume of the closed candle.
+        """
+
+        opens = self.data[OPEN]
+        highs = self.data[HIGH]
+        lows = self.data[LOW]
+        volumes = self.data[VOLUME]
+
+        signals = np.zeros(opens.shape[0], dtype=np.int64)
+        valid_volume = indicators.volume_filter(volumes[:-1], params["min_volume"])
+        signals[:-1] = np.where(
+            (opens[1:] > highs[:-1]) & valid_volume,
+            1,
+            np.where((opens[1:] < lows[:-1]) & valid_volume, -1, 0),
+        )
+
+        return signals, self._pct_exits(params), self._pct_sizing(params)
+
+    def _fractal_signals(self, params: typing.Dict) -> typing.Tuple:
+        rsi = self._rsi(params["rsi_length"])
+        ema_fast = self._ema(params["ema_fast"])
+        ema_slow = self._ema(params["ema_slow"])
+        ema_very_slow = self._ema(params["ema_very_slow"])
+        stops_long, stops_short = self._fractal_stops()
+
+        last_lows = self.data[LOW] * (1 - 0.0002)
+        last_highs = self.data[HIGH] * (1 + 0.0002)
+
+        with np.errstate(invalid="ignore"):
+            buy = (
+                (rsi > 45)
+                & (last_lows > ema_slow)
+                & (last_lows < ema_fast)
+                & (last_lows > ema_very_slow)
+                & ~np.isnan(stops_long)
+            )
+            sell = (
+                (rsi < 55)
+                & (last_highs < ema_slow)
+                & (last_highs > ema_fast)
+                & (last_highs < ema_very_slow)
+                & ~np.isnan(stops_short)
+            )
+
+        signals = np.where(buy, 1, np.where(sell, -1, 0))
+
+        def exits(i: int, side: int, entry_price: float):
+            stop_loss = stops_long[i] if side == 1 else stops_short[i]
+            take_profit = (entry_price - stop_loss) * 1.7 + entry_price
+            return stop_loss, take_profit
+
+        def sizing(balance: float, entry_price: float, stop_loss: float) -> float:
+            if entry_price == stop_loss:
+                return 0
+            return balance * params["risk_pct"] / 100 / abs(entry_price - stop_loss)
+
+        return signals, exits, sizing
+
+    def _rule_signals(self, params: typing.Dict) -> typing.Tuple:
+        """
+        The rules are compiled to array expressions on the cached indicators, the buy rule has priority over the
+        sell rule like in RuleStrategy._check_signal().
+        """
+
+        source = ArraySource(self)
+        n = self.data.shape[1]
+        buy = np.zeros(n, dtype=bool)
+        sell = np.zeros(n, dtype=bool)
+
+        if params.get("buy_rule"):
+            buy = source.run(Rule(params["buy_rule"], params))
+        if params.get("sell_rule"):
+            sell = source.run(Rule(params["sell_rule"], params))
+
+        signals = np.where(buy, 1, np.where(sell, -1, 0))
+
+        return signals, self._pct_exits(params), self._pct_sizing(params)
+
+    @staticmethod
+    def _pct_exits(params: typing.Dict) -> typing.Callable:
+        stop_loss_pct = params.get("stop_loss_pct", 1.0)
+        take_profit_pct = params.get("take_profit_pct", 2.0)
+
+        def exits(i: int, side: int, entry_price: float):
+            stop_loss = entry_price * (1 - side * stop_loss_pct / 100)
+            take_profit = entry_price * (1 + side * take_profit_pct / 100)
+            return stop_loss, take_profit
+
+        return exits
+
+    @staticmethod
+    def _pct_sizing(params: typing.Dict) -> typing.Callable:
+        def sizing(balance: float, entry_price: float, stop_loss: float) -> float:
+            return balance * params["balance_pct"] / 100 / entry_price
+
+        return sizing
+
+    def _find_exit(
+        self, start: int, end: int, side: int, stop_loss: float, take_profit: float
+    ) -> typing.Tuple[int, float]:
+        """
+        Find the first candle in [start, end) that touches the stop loss or the take profit.
+        The window grows geometrically so that short trades don't scan the whole history.
+        When both levels are touched by the same candle, the stop loss is assumed to come first.
+        :return: (index of the exit candle, exit price), index is -1 when the trade is still open at the end
+        """
+
+        highs = self.data[HIGH]
+        lows = self.data[LOW]
+        opens = self.data[OPEN]
+
+        size = 32
+        i = start
+
+        while i < end:
+            stop = min(i + size, end)
+
+            if side == 1:
+                sl_hit = lows[i:stop] <= stop_loss
+                tp_hit = highs[i:stop] >= take_profit
+            else:
+                sl_hit = highs[i:stop] >= stop_loss
+                tp_hit = lows[i:stop] <= take_profit
+
+            hits = np.flatnonzero(sl_hit | tp_hit)
+
+            if hits.shape[0] > 0:
+                j = i + hits[0]
+                level = stop_loss if sl_hit[hits[0]] else take_profit
+
+                # Gap through the level: the order is filled at the open price
+                if side == 1:
+                    exit_price = (
+                        min(level, opens[j])
+                        if sl_hit[hits[0]]
+                        else max(level, opens[j])
+                    )
+                else:
+                    exit_price = (
+                        max(level, opens[j])
+                        if sl_hit[hits[0]]
+                        else min(level, opens[j])
+                    )
+
+                return j, exit_price
+
+            i = stop
+            size *= 2
+
+        return -1, np.nan
+
+    def _get_entries(
+        self, strategy_type: typing.Type, params: typing.Dict
+    ) -> typing.Tuple:
+        """
+        Indexes and sides of the candles that have an entry signal over the whole history, with the exit and
+        sizing functions of the strategy.
+        """
+
+        key = (strategy_type, tuple(sorted(params.items())))
+
+        if key not in self._entries:
+            if strategy_type not in self._signal_functions:
+                raise ValueError(f"No backtest available for {strategy_type.__name__}")
+
+            signals, exits, sizing = self._signal_functions[strategy_type](params)
+
+            if not self.allow_short:
+                signals = np.where(signals == -1, 0, signals)
+
+            entries = np.flatnonzero(signals)
+
+            if len(self._entries) >= self.max_cached_entries:
+                del self._entries[next(iter(self._entries))]  # Drops the oldest
+
+            self._entries[key] = (entries, signals[entries], exits, sizing)
+
+        return self._entries[key]
+
+    def run(
+        self,
+        strategy_type: typing.Type,
+        params: typing.Dict,
+        start: int = 0,
+        end: typing.Optional[int] = None,
+    ) -> typing.Dict[str, float]:
+        """
+        Backtest one parameter set on the candles [start, end).
+        A signal computed at the close of candle i is entered at the open of candle i + 1, and a new position can
+        only be opened once the previous one is closed, like the ongoing_position flag of the live strategies.
+        :param strategy_type: TechnicalStrategy, BreakoutStrategy, FractalStrategy or RuleStrategy
+        :param params: Same keys as the other_params dictionary given to the strategy
+        :param start: Index of the first candle on which a signal can be taken
+        :param end: Index after the last candle of the window, None for the end of the data
+        :return: A dictionary of performance metrics
+        """
+
+        n = self.data.shape[1]
+        end = n if end is None else min(end, n)
+
+        entries, sides, exits, sizing = self._get_entries(strategy_type, params)
+
+        opens = self.data[OPEN]
+        closes = self.data[CLOSE]
+
+        balance = self.initial_balance
+        pnls = []
+        returns = []
+        equity = [balance]
+
+        first = np.searchsorted(entries, start, side="left")
+        last = np.searchsorted(entries, end - 1, side="left")
+        candidates = entries[first:last]
+        sides = sides[first:last]
+        c = 0
+
+        while c < candidates.shape[0]:
+            i = candidates[c]
+            side = int(sides[c])
+            entry_price = opens[i + 1]
+            stop_loss, take_profit = exits(i, side, entry_price)
+
+            # The stop loss has to be on the losing side of the entry, e.g. below the entry price for a long
+            if np.isnan(stop_loss) or (entry_price - stop_loss) * side <= 0:
+                c += 1
+                continue
+
+            quantity = sizing(balance, entry_price, stop_loss)
+
+            j, exit_price = self._find_exit(i + 1, end, side, stop_loss, take_profit)
+
+            if j == -1:  # Still open at the end of the window, closed at the last close
+                j = end - 1
+                exit_price = closes[j]
+
+            fees = (entry_price + exit_price) * quantity * self.fee_pct / 100
+            pnl = (exit_price - entry_price) * quantity * side - fees
+
+            pnls.append(pnl)
+            returns.append(pnl / balance)
+            balance += pnl
+            equity.append(balance)
+
+            # The next signal is checked at the close of the candle on which the position was exited
+            c = np.searchsorted(candidates, j, side="left")
+
+        return self._metrics(pnls, returns, equity)
+
+    def _metrics(
+        self,
+        pnls: typing.List[float],
+        returns: typing.List[float],
+        equity: typing.List[float],
+    ) -> typing.Dict[str, float]:
+        total_trades = len(pnls)
+        winning_trades = sum(1 for pnl in pnls if pnl > 0)
+
+        returns = np.array(returns)
+        equity = np.array(equity)
+
+        if total_trades > 1 and returns.std(ddof=1) != 0:
+            sharpe_ratio = returns.mean() / returns.std(ddof=1) * np.sqrt(252)
+        else:
+            sharpe_ratio = 0
+
+        peak = np.maximum.accumulate(equity)
+        max_drawdown = ((equity - peak) / peak).min()
+
+        return {
+            "total_trades": total_trades,
+            "win_rate": winning_trades / total_trades if total_trades > 0 else 0,
+            "pnl": equity[-1] - self.initial_balance,
+            "return_pct": (equity[-1] / self.initial_balance - 1) * 100,
+            "sharpe_ratio": sharpe_ratio,
+            "max_drawdown": max_drawdown,
+        }
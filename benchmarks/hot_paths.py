@@ -0,0 +1,477 @@
+"""
+Benchmark suite of the trading hot paths, offline on synthetic data. Each benchmark is run --repeat times and its
+fastest time per operation is compared with the baseline file, a benchmark slower than the baseline by more than
+--threshold is flagged as a regression and the exit status is 1. The fastest run is the one least disturbed by the
+rest of the machine, the median moves by more than 20% between identical runs. The speed of a shared or
+single-core machine still drifts from a session to the other, lower --threshold only on a quiet machine.
+Run from the repository root: python -m benchmarks.hot_paths [--save]
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import typing
+
+import numpy as np
+
+from models import *
+from database import WorkspaceData
+from candle_store import array_to_candles
+from replay import STRATEGIES
+from strategies import TechnicalStrategy
+from benchmarks.ingestion import make_client
+from benchmarks.synthetic import random_walk_candles
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# name -> (function(number of operations) -> elapsed seconds, default number of operations)
+BENCHMARKS: typing.Dict[str, typing.Tuple[typing.Callable[[int], float], int]] = dict()
+
+
+def benchmark(name: str, operations: int):
+    def register(function: typing.Callable[[int], float]):
+        BENCHMARKS[name] = (function, operations)
+        return function
+
+    return register
+
+
+def make_strategy(
+    client, strategy_class, params: typing.Dict, candles: int = 500, seed: int = 0
+):
+    strategy = strategy_class(
+        client, client.strategies[0].contract, "Benchmark", "1m", params
+    )
+    strategy.candles = array_to_candles(random_walk_candles(candles, seed=seed), "1m")
+    return strategy
+
+
+def _open_trades(client):
+    # One open trade per strategy, so that the bookTicker updates go through the PNL calculation
+    for strategy in client.strategies.values():
+        strategy.trades.append(
+            Trade(
+                {
+                    "time": 0,
+                    "entry_price": strategy.candles[-1].close,
+                    "contract": strategy.contract,
+                    "strategy": strategy.strat_name,
+                    "side": "long",
+                    "status": "open",
+                    "pnl": 0,
+                    "quantity": 0.1,
+                    "entry_id": 1,
+                }
+            )
+        )
+
+
+@benchmark("on_message.bookTicker", 100_000)
+def bench_on_message_book_ticker(n: int) -> float:
+    client = make_client(4, 3)
+    _open_trades(client)
+    symbols = sorted({s.contract.symbol for s in client.strategies.values()})
+    prices = 30000 + np.random.default_rng(0).normal(0, 10, n)
+
+    messages = [
+        json.dumps(
+            {
+                "e": "bookTicker",
+                "u": i,
+                "s": symbols[i % len(symbols)],
+                "b": f"{prices[i] - 0.05:.2f}",
+                "B": "1.000",
+                "a": f"{prices[i] + 0.05:.2f}",
+                "A": "1.000",
+                "T": i,
+                "E": i,
+            }
+        )
+        for i in range(n)
+    ]
+
+    on_message = client._on_message
+    start = time.perf_counter()
+    for msg in messages:
+        on_message(None, msg)
+    return time.perf_counter() - start
+
+
+@benchmark("on_message.aggTrade", 100_000)
+def bench_on_message_agg_trade(n: int) -> float:
+    client = make_client(4, 3)
+    symbols = sorted({s.contract.symbol for s in client.strategies.values()})
+    # All the trades in the last candle: the candle update and the TP/SL checks, without signal
+    last_candle = int(client.strategies[0].candles[-1].timestamp)
+    prices = 30000 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.0001, n)))
+
+    messages = [
+        json.dumps(
+            {
+                "e": "aggTrade",
+                "s": symbols[i % len(symbols)],
+                "p": f"{prices[i]:.2f}",
+                "q": "0.010",
+                "T": last_candle + i * 60_000 // n,
+            }
+        )
+        for i in range(n)
+    ]
+
+    on_message = client._on_message
+    start = time.perf_counter()
+    for msg in messages:
+        on_message(None, msg)
+    return time.perf_counter() - start
+
+
+def _bench_parse_trades(n: int, step_ms: int) -> float:
+    client = make_client(1, 1)
+    strategy = make_strategy(client, TechnicalStrategy, STRATEGIES["technical"][1])
+    last_candle = strategy.candles[-1].timestamp
+    timestamps = [last_candle + i * step_ms for i in range(1, n + 1)]
+    prices = 30000 + np.random.default_rng(0).normal(0, 10, n).round(2)
+
+    parse_trades = strategy.parse_trades
+    start = time.perf_counter()
+    for i in range(n):
+        parse_trades(prices[i], 0.01, timestamps[i])
+    return time.perf_counter() - start
+
+
+@benchmark("parse_trades.same_candle", 100_000)
+def bench_parse_trades_same_candle(n: int) -> float:
+    return _bench_parse_trades(n, 0)
+
+
+@benchmark("parse_trades.new_candle", 20_000)
+def bench_parse_trades_new_candle(n: int) -> float:
+    return _bench_parse_trades(n, 60_000)
+
+
+@benchmark("parse_trades.missing_candle", 10_000)
+def bench_parse_trades_missing_candle(n: int) -> float:
+    # Two candles without trade before each trade
+    return _bench_parse_trades(n, 3 * 60_000)
+
+
+def _bench_check_signal(name: str) -> typing.Callable[[int], float]:
+    strategy_class, params = STRATEGIES[name]
+
+    def bench(n: int) -> float:
+        client = make_client(1, 1)
+        strategy = make_strategy(client, strategy_class, params)
+        timestamp = strategy.candles[-1].timestamp
+        prices = 30000 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.002, n)))
+
+        # Each signal on a new candle, the indicators are updated like after a live candle close
+        elapsed = 0.0
+        for i in range(n):
+            timestamp += 60_000
+            strategy.parse_trades(prices[i], 1.0, timestamp)
+            start = time.perf_counter()
+            strategy._check_signal()
+            elapsed += time.perf_counter() - start
+        return elapsed
+
+    return bench
+
+
+for _name in STRATEGIES:
+    benchmark(f"check_signal.{_name}", 2_000)(_bench_check_signal(_name))
+
+
+@benchmark("construct.Candle.kline", 100_000)
+def bench_candle_kline(n: int) -> float:
+    # As in the REST responses
+    klines = [
+        [
+            1_600_000_000_000 + i * 60_000,
+            "30000.1",
+            "30010.5",
+            "29990.2",
+            "30005.0",
+            "12.345",
+        ]
+        for i in range(n)
+    ]
+    start = time.perf_counter()
+    for kline in klines:
+        Candle(kline, "1m", "binance_futures")
+    return time.perf_counter() - start
+
+
+@benchmark("construct.Candle.parse_trade", 100_000)
+def bench_candle_parse_trade(n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        Candle(
+            {
+                "ts": i,
+                "open": 30000.0,
+                "high": 30000.0,
+                "low": 30000.0,
+                "close": 30000.0,
+                "volume": 0.01,
+            },
+            "1m",
+            "parse_trade",
+        )
+    return time.perf_counter() - start
+
+
+@benchmark("construct.Trade", 100_000)
+def bench_trade(n: int) -> float:
+    contract = make_client(1, 1).strategies[0].contract
+    start = time.perf_counter()
+    for i in range(n):
+        Trade(
+            {
+                "time": i,
+                "entry_price": 30000.0,
+                "contract": contract,
+                "strategy": "Technical",
+                "side": "long",
+                "status": "open",
+                "pnl": 0,
+                "quantity": 0.1,
+                "entry_id": i,
+            }
+        )
+    return time.perf_counter() - start
+
+
+def _workspace(directory: str) -> WorkspaceData:
+    workspace = WorkspaceData(os.path.join(directory, "workspace.db"))
+    workspace.save("watchlist", _watchlist_rows(0))
+    workspace.save("strategies", _strategy_rows(0))
+    return workspace
+
+
+def _watchlist_rows(version: int) -> typing.List[typing.Tuple]:
+    return [(f"SYM{i + version}USDT", "Binance") for i in range(100)]
+
+
+def _strategy_rows(version: int) -> typing.List[typing.Tuple]:
+    return [
+        (
+            "Technical",
+            f"SYM{i}USDT_Binance",
+            "1m",
+            5.0 + (version if i == 0 else 0),
+            1.0,
+            1.0,
+            json.dumps(STRATEGIES["technical"][1]),
+            f"strategy-{i}",
+        )
+        for i in range(50)
+    ]
+
+
+@benchmark("WorkspaceData.save", 500)
+def bench_workspace_save(n: int) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        workspace = _workspace(directory)
+        # Each save changes one strategy row and one watchlist symbol, like an edit in the interface
+        versions = [(_strategy_rows(i % 2), _watchlist_rows(i % 2)) for i in range(2)]
+
+        start = time.perf_counter()
+        for i in range(n):
+            strategies, watchlist = versions[i % 2]
+            workspace.save("strategies", strategies)
+            workspace.save("watchlist", watchlist)
+        elapsed = time.perf_counter() - start
+
+        workspace.db.close()
+    return elapsed
+
+
+@benchmark("WorkspaceData.get", 2_000)
+def bench_workspace_get(n: int) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        workspace = _workspace(directory)
+
+        start = time.perf_counter()
+        for i in range(n):
+            workspace.get("strategies")
+            workspace.get("watchlist")
+        elapsed = time.perf_counter() - start
+
+        workspace.db.close()
+    return elapsed
+
+
+@benchmark("PerformanceDashboard.calculate_stats", 1)
+def bench_calculate_stats(n: int) -> float:
+    # The interface needs tkinter and matplotlib, ImportError skips the benchmark
+    from interface.performance_component import PerformanceDashboard
+
+    contract = make_client(1, 1).strategies[0].contract
+    pnls = np.random.default_rng(0).normal(0.5, 20, 100_000)
+    trades = [
+        Trade(
+            {
+                "time": 1_600_000_000_000 + i * 60_000,
+                "entry_price": 30000.0,
+                "contract": contract,
+                "strategy": "Technical",
+                "side": "long",
+                "status": "closed",
+                "pnl": float(pnl),
+                "quantity": 0.1,
+                "entry_id": i,
+            }
+        )
+        for i, pnl in enumerate(pnls)
+    ]
+
+    # Without the widgets, only the statistics of the trades
+    dashboard = PerformanceDashboard.__new__(PerformanceDashboard)
+
+    start = time.perf_counter()
+    for _ in range(n):
+        dashboard.trades_data = trades
+        dashboard.calculate_stats()
+    return time.perf_counter() - start
+
+
+def run_benchmarks(
+    names: typing.List[str], repeat: int, scale: float
+) -> typing.Dict[str, typing.Dict]:
+    """
+    :param names: Keys of BENCHMARKS
+    :param repeat: Runs of each benchmark, the fastest one is compared with the baseline. The runs of the
+    benchmarks are interleaved, a slow period of the machine doesn't fall on all the runs of the same benchmark
+    :param scale: Multiplies the default number of operations
+    :return: name -> {"ns_per_op", "min_ns_per_op", "operations"}, or {"skipped": reason}
+    """
+
+    results = dict()
+    operations = {name: max(int(BENCHMARKS[name][1] * scale), 1) for name in names}
+    runs = {name: [] for name in names}
+
+    for _ in range(repeat):
+        for name in names:
+            if name in results:
+                continue
+
+            try:
+                elapsed = BENCHMARKS[name][0](operations[name])
+            except ImportError as e:
+                results[name] = {"skipped": str(e)}
+                continue
+            runs[name].append(elapsed / operations[name] * 1e9)
+
+    for name in names:
+        if name in results:
+            print(f"{name:<40} skipped: {results[name]['skipped']}")
+            continue
+
+        results[name] = {
+            "ns_per_op": statistics.median(runs[name]),
+            "min_ns_per_op": min(runs[name]),
+            "operations": operations[name],
+        }
+        print(
+            f"{name:<40} {results[name]['min_ns_per_op']:>14,.0f} ns/op  "
+            f"(median {results[name]['ns_per_op']:,.0f}, {operations[name]} ops x {repeat})"
+        )
+
+    return results
+
+
+def compare(
+    results: typing.Dict[str, typing.Dict],
+    baseline: typing.Dict[str, typing.Dict],
+    threshold: float,
+) -> typing.List[str]:
+    """
+    :param results: See run_benchmarks()
+    :param baseline: The results of a previous run
+    :param threshold: e.g. 0.5 flags the benchmarks more than 50% slower than the baseline
+    :return: The names of the regressed benchmarks
+    """
+
+    regressions = []
+
+    for name, result in results.items():
+        old = baseline.get(name, {}).get("min_ns_per_op")
+        new = result.get("min_ns_per_op")
+        if old is None or new is None:
+            continue
+
+        change = new / old - 1
+        if change > threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "faster"
+        else:
+            flag = ""
+        print(
+            f"{name:<40} {old:>14,.0f} -> {new:>14,.0f} ns/op  {change:+7.1%}  {flag}"
+        )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--filter", default="", help="Only the benchmarks containing this text"
+    )
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="Multiplies the number of operations"
+    )
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--threshold", type=float, default=0.5, help="Slowdown flagged as a regression"
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Write the results as the new baseline"
+    )
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)  # The synthetic trade times are in the past
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    results = run_benchmarks(names, args.repeat, args.scale)
+
+    regressions = []
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"\nCompared with {args.baseline} ({baseline['date']}):")
+        regressions = compare(results, baseline["results"], args.threshold)
+
+    if args.save:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(
+                {
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": sys.version.split()[0],
+                    "numpy": np.__version__,
+                    "machine": platform.platform(),
+                    "processor": platform.processor(),
+                    "results": results,
+                },
+                baseline_file,
+                indent=2,
+            )
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Throughput of the aggTrade ingestion, trade by trade versus micro-batched (see ingestion.TickBatcher).
+Run from the repository root: python -m benchmarks.ingestion
+"""
+
+import argparse
+import json
+import logging
+import time
+import typing
+
+import numpy as np
+
+from connectors.binance import BinanceClient
+from models import *
+from strategies import TechnicalStrategy
+from benchmarks.synthetic import random_walk_candles
+
+
+def make_client(symbols: int, strategies_per_symbol: int) -> BinanceClient:
+    # No network: only the attributes used by the websocket dispatch are set
+    client = BinanceClient.__new__(BinanceClient)
+    client.futures = True
+    client.platform = "binance_futures"
+    client.prices = dict()
+    client.logs = []
+    client.strategies = dict()
+    client._tick_batcher = None
+    client._recorder = None
+    client._received_ns = 0
+    client._received_perf_ns = 0
+    client._exchange_latency = dict()
+    client.time_offset = 0
+    client.evaluator = None
+    # Nothing written to the trade journal nor the candle store
+    client.persistent = False
+
+    params = {
+        "rsi_length": 14,
+        "ema_fast": 12,
+        "ema_slow": 26,
+        "ema_signal": 9,
+        "balance_pct": 5,
+    }
+
+    for s in range(symbols):
+        contract = Contract(
+            {
+                "symbol": f"SYM{s}USDT",
+                "baseAsset": f"SYM{s}",
+                "quoteAsset": "USDT",
+                "pricePrecision": 2,
+                "quantityPrecision": 3,
+            },
+            "binance_futures",
+        )
+        data = random_walk_candles(200, seed=s)
+
+        for m in range(strategies_per_symbol):
+            strategy = TechnicalStrategy(client, contract, "Binance", "1h", params)
+            strategy.candles = [
+                Candle(list(data[:, i]), "1h", "binance_futures") for i in range(200)
+            ]
+            client.strategies[len(client.strategies)] = strategy
+
+    return client
+
+
+def make_messages(client: BinanceClient, n: int) -> list:
+    symbols = sorted({s.contract.symbol for s in client.strategies.values()})
+    start = int(client.strategies[0].candles[-1].timestamp) + 1
+    rng = np.random.default_rng(0)
+    prices = 30000 * np.exp(np.cumsum(rng.normal(0, 0.0001, n)))
+
+    return [
+        json.dumps(
+            {
+                "e": "aggTrade",
+                "s": symbols[i % len(symbols)],
+                "p": f"{prices[i]:.2f}",
+                "q": "0.010",
+                "T": start + i,
+            }
+        )
+        for i in range(n)
+    ]
+
+
+def run(
+    messages: list, client: BinanceClient, window_ms: float, max_batch: int
+) -> typing.Tuple[float, str]:
+    if window_ms > 0:
+        client.set_tick_batching(window_ms, max_batch)
+
+    start = time.perf_counter()
+    for msg in messages:
+        client._on_message(None, msg)
+
+    batches = ""
+
+    if client._tick_batcher is not None:
+        client._tick_batcher.stop()  # Waits for the buffered trades
+        batcher = client._tick_batcher
+        client._tick_batcher = None
+        batches = (
+            f" ({batcher.batches_dispatched} batches, "
+            f"{batcher.trades_dispatched / max(batcher.batches_dispatched, 1):.1f} trades per batch)"
+        )
+
+    return time.perf_counter() - start, batches
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trades", type=int, default=200000)
+    parser.add_argument("--symbols", type=int, default=4)
+    parser.add_argument("--strategies", type=int, default=3, help="Per symbol")
+    parser.add_argument("--max-batch", type=int, default=100)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)  # The synthetic trade times are in the past
+
+    for window_ms in (0, 5, 20, 50):
+        client = make_client(args.symbols, args.strategies)
+        messages = make_messages(client, args.trades)
+        elapsed, batches = run(messages, client, window_ms, args.max_batch)
+        label = "trade by trade" if window_ms == 0 else f"{window_ms} ms window"
+        print(f"{label}: {args.trades / elapsed:,.0f} trades/s{batches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""
+Saturation curve of the market data dispatch: synthetic aggTrade/bookTicker streams are offered at increasing rates
+to BinanceClient._on_message, through a ReplayClient, and the throughput and the latency from the arrival of each
+message to the end of its dispatch are measured at each rate, until the dispatch cannot keep up.
+A rate is saturated when the backlog grows: the dispatch achieves less than the offered rate, or the lag keeps
+rising over the stream. A large lag that drains, after a burst or a stall, is not saturation.
+Run from the repository root: python -m benchmarks.load --symbols 10 --strategies 3
+"""
+
+import argparse
+import json
+import logging
+import time
+import typing
+
+import numpy as np
+
+from candle_store import INTERVAL_MS
+from replay import STRATEGIES, ReplayClient, ReplayEngine, make_contract
+from benchmarks.synthetic import random_walk_candles
+
+START_MS = 1_600_000_000_000
+
+# Length of the periods of the arrival process, each one normal, burst or stalled
+SLOT_S = 0.1
+
+
+def generate_stream(
+    symbols: typing.List[str],
+    rate: float,
+    duration_s: float,
+    book_ratio: float = 0.5,
+    burst_prob: float = 0.05,
+    burst_factor: float = 10,
+    stall_prob: float = 0.01,
+    late_prob: float = 0.01,
+    late_ms: float = 500,
+    time_scale: float = 1,
+    volatility: float = 0.0001,
+    seed: int = 0,
+) -> typing.Tuple[np.ndarray, typing.List[str]]:
+    """
+    Messages in the Binance Futures format, with the irregularities of a live feed:
+    - the symbols are not equally busy, the first ones get most of the messages (Zipf weights)
+    - the prices follow a random walk per symbol, the bookTickers surround the last trade price
+    - bursts: periods of SLOT_S where the rate is burst_factor times higher
+    - stalls: periods where nothing is delivered, their messages arrive together at the end of the period
+      with their original event time (a gap in the feed followed by a catch-up burst)
+    - out of order: late_prob of the trades have an event time up to late_ms older than the previous trades
+    The mean rate over the whole stream is the requested rate.
+    :param symbols:
+    :param rate: Mean messages per second
+    :param duration_s:
+    :param book_ratio: Share of bookTicker messages
+    :param burst_prob: Share of the periods in burst
+    :param burst_factor:
+    :param stall_prob: Share of the periods stalled
+    :param late_prob:
+    :param late_ms:
+    :param time_scale: Exchange time elapsed per second of stream, > 1 closes the candles more often
+    :param volatility: Standard deviation of the trade to trade returns
+    :param seed:
+    :return: (arrival time of each message in seconds since the start, raw messages), sorted by arrival time
+    """
+
+    rng = np.random.default_rng(seed)
+
+    slots = max(int(np.ceil(duration_s / SLOT_S)), 1)
+    intensity = np.where(rng.random(slots) < burst_prob, burst_factor, 1.0)
+    intensity *= slots / intensity.sum()
+
+    # Poisson arrivals in each period
+    counts = rng.poisson(intensity * rate * SLOT_S)
+    slot_of = np.repeat(np.arange(slots), counts)
+    event_s = (slot_of + rng.random(len(slot_of))) * SLOT_S
+    event_s.sort()
+
+    arrival_s = event_s.copy()
+    stalled = rng.random(slots) < stall_prob
+    in_stall = stalled[slot_of]
+    arrival_s[in_stall] = (slot_of[in_stall] + 1) * SLOT_S
+
+    n = len(event_s)
+    weights = 1 / np.arange(1, len(symbols) + 1)
+    symbol_of = rng.choice(len(symbols), n, p=weights / weights.sum())
+    is_book = rng.random(n) < book_ratio
+    returns = rng.normal(0, volatility, n)
+    quantities = rng.gamma(2.0, 0.01, n)
+    late = (rng.random(n) < late_prob) * rng.random(n) * late_ms
+
+    event_ms = START_MS + event_s * 1000 * time_scale
+    prices = [30000.0] * len(symbols)
+    messages = []
+
+    for i in range(n):
+        s = symbol_of[i]
+        symbol = symbols[s]
+        ts = int(event_ms[i])
+
+        if is_book[i]:
+            msg = {
+                "e": "bookTicker",
+                "u": i,
+                "s": symbol,
+                "b": f"{prices[s] - 0.05:.2f}",
+                "B": "1.000",
+                "a": f"{prices[s] + 0.05:.2f}",
+                "A": "1.000",
+                "T": ts,
+                "E": ts,
+            }
+        else:
+            prices[s] *= 1 + returns[i]
+            msg = {
+                "e": "aggTrade",
+                "E": ts,
+                "a": i,
+                "s": symbol,
+                "p": f"{prices[s]:.2f}",
+                "q": f"{quantities[i]:.3f}",
+                "T": ts - int(late[i]),
+                "m": bool(returns[i] < 0),
+            }
+        messages.append(json.dumps(msg))
+
+    order = np.argsort(arrival_s, kind="stable")
+    return arrival_s[order], [messages[i] for i in order]
+
+
+def make_client(
+    symbols: typing.List[str], strategies: int, strategy: str, timeframe: str
+) -> ReplayClient:
+    """
+    :param symbols:
+    :param strategies: Per symbol
+    :param strategy: Key of replay.STRATEGIES
+    :param timeframe:
+    :return: A client whose strategies have 200 candles ending at the start of the stream
+    """
+
+    client = ReplayClient({symbol: make_contract(symbol) for symbol in symbols})
+    engine = ReplayEngine(client)
+    strategy_class, params = STRATEGIES[strategy]
+    interval_ms = INTERVAL_MS[timeframe]
+
+    for s, symbol in enumerate(symbols):
+        history = random_walk_candles(200, interval_ms, seed=s)
+        history[0] += START_MS - interval_ms - history[0, -1]
+        for _ in range(strategies):
+            engine.add_strategy(strategy_class, symbol, timeframe, params, history)
+
+    return client
+
+
+def drive(
+    client: ReplayClient, arrival_s: np.ndarray, messages: typing.List[str]
+) -> typing.Dict:
+    """
+    Deliver each message to _on_message at its arrival time, one at a time like the websocket thread: a message
+    arriving while the previous ones are still being dispatched waits, and its wait counts in its latency.
+    :param client:
+    :param arrival_s: See generate_stream()
+    :param messages:
+    :return: The achieved throughput, the latency percentiles, the lag at the end of the stream and its growth
+    """
+
+    on_message = client._on_message
+    perf_counter = time.perf_counter
+    latencies = []
+    service = []
+
+    start = perf_counter()
+    for i in range(len(messages)):
+        due = start + arrival_s[i]
+        now = perf_counter()
+        if now < due:
+            if due - now > 0.002:
+                time.sleep(due - now - 0.001)
+            while perf_counter() < due:
+                pass
+            now = due
+
+        on_message(None, messages[i])
+        end = perf_counter()
+        latencies.append(end - due)
+        service.append(end - now)
+    elapsed = perf_counter() - start
+
+    latencies = np.array(latencies) * 1000
+    service = np.array(service) * 1e6
+    duration_s = arrival_s[-1] if len(arrival_s) else 0
+
+    return {
+        "messages": len(messages),
+        "offered_per_s": len(messages) / duration_s if duration_s > 0 else 0,
+        "achieved_per_s": len(messages) / elapsed if elapsed > 0 else 0,
+        "latency_p50_ms": float(np.percentile(latencies, 50)),
+        "latency_p99_ms": float(np.percentile(latencies, 99)),
+        "latency_p999_ms": float(np.percentile(latencies, 99.9)),
+        "latency_max_ms": float(latencies.max()),
+        "service_p50_us": float(np.percentile(service, 50)),
+        "service_p99_us": float(np.percentile(service, 99)),
+        # Behind the stream at its end: the backlog did not drain
+        "final_lag_ms": float(latencies[-1]),
+        "lag_growth_ms_per_s": lag_growth(arrival_s, latencies),
+    }
+
+
+def lag_growth(arrival_s: np.ndarray, latencies_ms: np.ndarray) -> float:
+    """
+    Slope of the lag over the stream, fitted on the worst lag of each SLOT_S period: the backlog grows when the
+    dispatch is slower than the arrivals, the lag of a burst or a stall goes back down once it is drained.
+    :param arrival_s: See generate_stream()
+    :param latencies_ms: Of each message
+    :return: Milliseconds of lag gained per second of stream
+    """
+
+    slot_of = (arrival_s / SLOT_S).astype(int)
+    slots, first = np.unique(slot_of, return_index=True)
+    if len(slots) < 2:
+        return 0.0
+
+    worst = np.maximum.reduceat(latencies_ms, first)
+    return float(np.polyfit(slots * SLOT_S, worst, 1)[0])
+
+
+def saturation_curve(
+    symbols: int,
+    strategies: int,
+    strategy: str,
+    timeframe: str,
+    rates: typing.List[float],
+    duration_s: float,
+    rate_tolerance: float,
+    max_lag_growth: float,
+    stream_params: typing.Dict,
+) -> typing.List[typing.Dict]:
+    """
+    :param symbols: Number of symbols
+    :param strategies: Per symbol
+    :param strategy: Key of replay.STRATEGIES
+    :param timeframe:
+    :param rates: Offered messages per second, in increasing order
+    :param duration_s: Of the stream at each rate
+    :param rate_tolerance: A rate is saturated when the achieved rate is lower than the offered one by more
+    than this share...
+    :param max_lag_growth: ...or when the lag grows faster than this, in ms per second of stream.
+    The curve stops at the first saturated rate
+    :param stream_params: Other parameters of generate_stream()
+    :return: The result of drive() at each rate, with the rate and a "saturated" flag
+    """
+
+    symbol_names = [f"SYM{s}USDT" for s in range(symbols)]
+    curve = []
+
+    print(
+        f"{'offered/s':>10} {'achieved/s':>11} {'p50 ms':>9} {'p99 ms':>9} {'p999 ms':>9} {'max ms':>9} "
+        f"{'lag ms':>9} {'lag ms/s':>9} {'svc p50 us':>11} {'svc p99 us':>11}"
+    )
+
+    for rate in rates:
+        arrival_s, messages = generate_stream(
+            symbol_names, rate, duration_s, **stream_params
+        )
+        client = make_client(symbol_names, strategies, strategy, timeframe)
+
+        result = drive(client, arrival_s, messages)
+        result["rate"] = rate
+        result["saturated"] = bool(
+            result["achieved_per_s"] < result["offered_per_s"] * (1 - rate_tolerance)
+            or result["lag_growth_ms_per_s"] > max_lag_growth
+        )
+        curve.append(result)
+
+        print(
+            f"{rate:>10,.0f} {result['achieved_per_s']:>11,.0f} {result['latency_p50_ms']:>9.3f} "
+            f"{result['latency_p99_ms']:>9.3f} {result['latency_p999_ms']:>9.3f} {result['latency_max_ms']:>9.1f} "
+            f"{result['final_lag_ms']:>9.1f} {result['lag_growth_ms_per_s']:>9.1f} "
+            f"{result['service_p50_us']:>11.1f} {result['service_p99_us']:>11.1f}"
+            + ("  SATURATED" if result["saturated"] else "")
+        )
+
+        if result["saturated"]:
+            break
+
+    return curve
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--symbols", type=int, default=10)
+    parser.add_argument("--strategies", type=int, default=3, help="Per symbol")
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="technical")
+    parser.add_argument("--timeframe", default="1m")
+    parser.add_argument(
+        "--rates",
+        default="1000,2000,5000,10000,20000,50000,100000,200000",
+        help="Offered messages per second, comma separated",
+    )
+    parser.add_argument("--duration", type=float, default=5, help="Seconds per rate")
+    parser.add_argument(
+        "--rate-tolerance",
+        type=float,
+        default=0.02,
+        help="Saturated below (1 - tolerance) times the offered rate",
+    )
+    parser.add_argument(
+        "--max-lag-growth",
+        type=float,
+        default=10,
+        help="Saturated when the lag grows faster, in ms per second of stream",
+    )
+    parser.add_argument("--book-ratio", type=float, default=0.5)
+    parser.add_argument("--burst-prob", type=float, default=0.05)
+    parser.add_argument("--burst-factor", type=float, default=10)
+    parser.add_argument("--stall-prob", type=float, default=0.01)
+    parser.add_argument("--late-prob", type=float, default=0.01)
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=1,
+        help="Exchange seconds per second of stream, e.g. 60 closes a 1m candle every second",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the curve to this JSON file")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)  # The late trades are logged
+
+    curve = saturation_curve(
+        args.symbols,
+        args.strategies,
+        args.strategy,
+        args.timeframe,
+        [float(rate) for rate in args.rates.split(",")],
+        args.duration,
+        args.rate_tolerance,
+        args.max_lag_growth,
+        {
+            "book_ratio": args.book_ratio,
+            "burst_prob": args.burst_prob,
+            "burst_factor": args.burst_factor,
+            "stall_prob": args.stall_prob,
+            "late_prob": args.late_prob,
+            "time_scale": args.time_scale,
+            "seed": args.seed,
+        },
+    )
+
+    sustained = [r["rate"] for r in curve if not r["saturated"]]
+    if sustained:
+        print(f"Highest sustained rate: {max(sustained):,.0f} messages/s")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(vars(args) | {"curve": curve}, output_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import typing
+
+import numpy as np
+
+
+def random_walk_candles(
+    n: int,
+    timeframe_ms: int = 60000,
+    start_price: float = 30000,
+    volatility: float = 0.002,
+    seed: typing.Optional[int] = 0,
+) -> np.ndarray:
+    """
+    Synthetic candles in the format of backtesting.candles_to_array(), built from a geometric random walk.
+    :param n: Number of candles
+    :param timeframe_ms: Candle duration in milliseconds
+    :param start_price:
+    :param volatility: Standard deviation of the close to close returns
+    :param seed:
+    :return: A float64 array of shape (6, n)
+    """
+
+    rng = np.random.default_rng(seed)
+
+    closes = start_price * np.exp(np.cumsum(rng.normal(0, volatility, n)))
+    opens = np.concatenate(([start_price], closes[:-1]))
+    spread = np.abs(rng.normal(0, volatility / 2, n)) * closes
+
+    data = np.empty((6, n), dtype=np.float64)
+    data[0] = np.arange(n, dtype=np.float64) * timeframe_ms + 1_600_000_000_000
+    data[1] = opens
+    data[2] = np.maximum(opens, closes) + spread
+    data[3] = np.minimum(opens, closes) - spread
+    data[4] = closes
+    data[5] = rng.gamma(2.0, 50.0, n)
+
+    return data
@@ -0,0 +1,101 @@
+"""
+Signal evaluations per second at candle close, in the main process versus in worker processes
+(see workers.StrategyWorkerPool). Run from the repository root: python -m benchmarks.workers
+"""
+
+import argparse
+import logging
+import os
+import time
+
+from models import *
+from workers import StrategyWorkerPool
+from benchmarks.ingestion import make_client
+
+
+def make_strategies(symbols: int, strategies_per_symbol: int):
+    client = make_client(symbols, strategies_per_symbol)
+    for strategy in client.strategies.values():
+        strategy._open_position = lambda signal_result: None  # No exchange
+    return client
+
+
+def next_candle(client):
+    # Same new candle on every series, so that each round is one boundary
+    for strategy in client.strategies.values():
+        last = strategy.candles[-1]
+        strategy.candles.append(
+            Candle(
+                {
+                    "ts": last.timestamp + strategy.tf_equiv,
+                    "open": last.close,
+                    "high": last.close,
+                    "low": last.close,
+                    "close": last.close,
+                    "volume": 0,
+                },
+                strategy.tf,
+                "parse_trade",
+            )
+        )
+
+
+def run_in_process(client, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        next_candle(client)
+        for strategy in client.strategies.values():
+            strategy.check_trade("new_candle")
+    return time.perf_counter() - start
+
+
+def run_workers(client, rounds: int, workers: int) -> float:
+    pool = StrategyWorkerPool(client.strategies, workers)
+
+    # Replicas created and modules imported before timing
+    next_candle(client)
+    for strategy in client.strategies.values():
+        pool.submit(strategy)
+    while pool.results < len(client.strategies):
+        time.sleep(0.01)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        next_candle(client)
+        for strategy in client.strategies.values():
+            pool.submit(strategy)
+
+    expected = len(client.strategies) * (rounds + 1)
+    while pool.results < expected:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    pool.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, default=16)
+    parser.add_argument("--strategies", type=int, default=2, help="Per symbol")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+", default=None)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    evaluations = args.symbols * args.strategies * args.rounds
+    workers = args.workers or sorted({1, 2, os.cpu_count() or 1})
+
+    client = make_strategies(args.symbols, args.strategies)
+    elapsed = run_in_process(client, args.rounds)
+    print(f"main process: {evaluations / elapsed:,.0f} evaluations/s")
+
+    for n in workers:
+        client = make_strategies(args.symbols, args.strategies)
+        elapsed = run_workers(client, args.rounds, n)
+        print(f"{n} worker(s): {evaluations / elapsed:,.0f} evaluations/s")
+
+
+if __name__ == "__main__":
+    main()
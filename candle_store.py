@@ -0,0 +1,257 @@
+import logging
+import typing
+import sqlite3
+import threading
+
+import numpy as np
+
+from models import *
+from database import get_database
+from scheduler import scheduler
+
+logger = logging.getLogger()
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "3m": 180_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "30m": 1_800_000,
+    "1h": 3_600_000,
+    "2h": 7_200_000,
+    "4h": 14_400_000,
+    "6h": 21_600_000,
+    "8h": 28_800_000,
+    "12h": 43_200_000,
+    "1d": 86_400_000,
+    "3d": 259_200_000,
+    "1w": 604_800_000,
+    "1M": 2_592_000_000,  # Only used to group the candles in chunks, the months don't need to be exact
+}
+
+# Candles per row of the table, the size of a page of klines on Binance
+CHUNK_SIZE = 1000
+
+
+def candles_to_rows(candles: typing.List[Candle]) -> np.ndarray:
+    """
+    :param candles:
+    :return: A float64 array of shape (number of candles, 6), one row per candle, like the stored chunks
+    """
+
+    return np.array(
+        [[c.timestamp, c.open, c.high, c.low, c.close, c.volume] for c in candles],
+        dtype=np.float64,
+    ).reshape(-1, 6)
+
+
+def array_to_candles(data: np.ndarray, timeframe: str) -> typing.List[Candle]:
+    """
+    Inverse of backtesting.candles_to_array().
+    :param data: A float64 array of shape (6, number of candles)
+    :param timeframe:
+    :return:
+    """
+
+    return [
+        Candle(
+            {
+                "ts": int(ts),
+                "open": float(o),
+                "high": float(h),
+                "low": float(l),
+                "close": float(c),
+                "volume": float(v),
+            },
+            timeframe,
+            "parse_trade",
+        )
+        for ts, o, h, l, c, v in data.T
+    ]
+
+
+class CandleStore:
+    def __init__(self, path: str = "database.db", flush_interval_s: float = 60):
+        """
+        Candles kept between runs, so that a strategy start only downloads the candles since the last run.
+        The candles of a (platform, symbol, interval) are grouped by CHUNK_SIZE consecutive periods, each group
+        stored as one float64 blob keyed by the open time of its first period: reading 100k candles is then about
+        a hundred rows turned into an array with np.frombuffer(), instead of 100k rows converted one by one.
+        The primary key is the index, the table is WITHOUT ROWID so that a range read is a single scan of it.
+        The candles closed by the live strategies are collected in memory and written every flush_interval_s.
+        :param path: SQLite database, the one of the workspace by default
+        :param flush_interval_s:
+        """
+
+        self.path = path
+        self.flush_interval_s = flush_interval_s
+
+        self._table_created = False
+        self._lock = threading.Lock()
+        self._pending: typing.Dict[
+            typing.Tuple[str, str, str], typing.Dict[int, Candle]
+        ] = dict()
+        self._job = None
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = get_database(self.path).connection()
+        if not self._table_created:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS candles (platform TEXT, symbol TEXT, interval TEXT, open_time INTEGER, "
+                    "data BLOB, PRIMARY KEY (platform, symbol, interval, open_time)) WITHOUT ROWID"
+                )
+            self._table_created = True
+        return conn
+
+    @staticmethod
+    def _chunk_span(interval: str) -> int:
+        return INTERVAL_MS[interval] * CHUNK_SIZE
+
+    def insert(self, platform: str, symbol: str, interval: str, data: np.ndarray):
+        """
+        Add or replace candles, e.g. a page of klines. The candles already stored with the same open time are
+        replaced, so an unfinished candle is corrected by the next insert of its open time.
+        :param platform: e.g. binance_futures or binance_futures_testnet, see BinanceClient.candle_source
+        :param symbol:
+        :param interval:
+        :param data: A float64 array of shape (6, number of candles), see backtesting.candles_to_array()
+        :return:
+        """
+
+        if data.shape[1] == 0:
+            return
+
+        rows = np.ascontiguousarray(data.T, dtype=np.float64)
+        span = self._chunk_span(interval)
+        chunk_starts = rows[:, 0].astype(np.int64) // span * span
+
+        with self._connection() as conn:
+            for chunk_start in np.unique(chunk_starts):
+                new = rows[chunk_starts == chunk_start]
+                key = (platform, symbol, interval, int(chunk_start))
+
+                stored = conn.execute(
+                    "SELECT data FROM candles WHERE platform = ? AND symbol = ? AND interval = ? AND open_time = ?",
+                    key,
+                ).fetchone()
+
+                if stored is not None:
+                    old = np.frombuffer(stored[0], dtype=np.float64).reshape(-1, 6)
+                    old = old[~np.isin(old[:, 0], new[:, 0])]
+                    new = np.concatenate((old, new))
+
+                new = new[np.argsort(new[:, 0], kind="stable")]
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO candles (platform, symbol, interval, open_time, data) VALUES (?, ?, ?, ?, ?)",
+                    key + (new.tobytes(),),
+                )
+
+    def read(
+        self,
+        platform: str,
+        symbol: str,
+        interval: str,
+        start_ms: typing.Optional[int] = None,
+        end_ms: typing.Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        :param platform:
+        :param symbol:
+        :param interval:
+        :param start_ms: Open time of the first candle, included
+        :param end_ms: Open time of the last candle, excluded
+        :return: A float64 array of shape (6, number of candles) sorted by open time, see backtesting.candles_to_array()
+        """
+
+        span = self._chunk_span(interval)
+        sql = "SELECT data FROM candles WHERE platform = ? AND symbol = ? AND interval = ?"
+        values: typing.List = [platform, symbol, interval]
+
+        if start_ms is not None:
+            sql += " AND open_time >= ?"
+            values.append(start_ms // span * span)
+        if end_ms is not None:
+            sql += " AND open_time < ?"
+            values.append(end_ms)
+        sql += " ORDER BY open_time"
+
+        blobs = [row[0] for row in self._connection().execute(sql, values)]
+
+        if len(blobs) == 0:
+            return np.empty((6, 0), dtype=np.float64)
+
+        rows = np.frombuffer(b"".join(blobs), dtype=np.float64).reshape(-1, 6)
+
+        mask = np.ones(len(rows), dtype=bool)
+        if start_ms is not None:
+            mask &= rows[:, 0] >= start_ms
+        if end_ms is not None:
+            mask &= rows[:, 0] < end_ms
+
+        return np.ascontiguousarray(rows[mask].T)
+
+    def last_open_time(
+        self, platform: str, symbol: str, interval: str
+    ) -> typing.Optional[int]:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT data FROM candles WHERE platform = ? AND symbol = ? AND interval = ? "
+                "ORDER BY open_time DESC LIMIT 1",
+                (platform, symbol, interval),
+            )
+            .fetchone()
+        )
+
+        if row is None:
+            return None
+
+        return int(np.frombuffer(row[0], dtype=np.float64)[-6])
+
+    def record_closed(
+        self, platform: str, symbol: str, interval: str, candles: typing.List[Candle]
+    ):
+        """
+        Queue candles closed by a live strategy, written at the next flush(). Never touches the disk, it is
+        called from the websocket thread. The strategies on the same series record the same candles only once.
+        :param platform:
+        :param symbol:
+        :param interval:
+        :param candles:
+        :return:
+        """
+
+        with self._lock:
+            pending = self._pending.setdefault((platform, symbol, interval), dict())
+            for candle in candles:
+                pending[candle.timestamp] = candle
+
+    def start(self):
+        if self._job is None:
+            self._job = scheduler.call_every(self.flush_interval_s, self.flush)
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = dict()
+
+        for (platform, symbol, interval), candles in pending.items():
+            data = candles_to_rows(
+                sorted(candles.values(), key=lambda c: c.timestamp)
+            ).T
+            try:
+                self.insert(platform, symbol, interval, data)
+            except sqlite3.Error as e:
+                logger.error(
+                    "Error while storing the %s %s candles: %s", symbol, interval, e
+                )
+
+
+candle_store = CandleStore()
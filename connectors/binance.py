@@ -11,10 +11,21 @@ import hashlib
 
 import websocket
 import json
+import sqlite3
 
 import threading
 
 from models import *
+from ingestion import TickBatcher
+from scheduler import scheduler
+from rate_limit import RequestWeightLimiter
+from retention import retention, LOGS_POLICY
+from journal import journal
+from latency import latencies, LatencyHistogram
+from recorder import TickRecorder
+from candle_store import candle_store, candles_to_rows, array_to_candles, INTERVAL_MS
+from evaluator import CandleCloseEvaluator
+from workers import StrategyWorkerPool
 from strategies import (
     Strategy,
     TechnicalStrategy,
@@ -23,12 +34,34 @@ from strategies import (
     DummyStrategy,
 )
 
-
 logger = logging.getLogger()
 
+# Seconds to connect and to wait for each part of a REST response, a request never blocks its thread for longer
+REQUEST_TIMEOUT = 10
+
 
 class BinanceClient:
-    def __init__(self, public_key: str, secret_key: str, testnet: bool, futures: bool):
+    # Journal the trades and store the closed candles, False for the clients that don't trade on the exchange
+    persistent = True
+
+    def __init__(
+        self,
+        public_key: str,
+        secret_key: str,
+        testnet: bool,
+        futures: bool,
+        base_url: typing.Optional[str] = None,
+        wss_url: typing.Optional[str] = None,
+    ):
+        """
+        :param public_key:
+        :param secret_key:
+        :param testnet:
+        :param futures:
+        :param base_url: Replaces the REST URL chosen by testnet, e.g. the one of mock_exchange.py for offline tests
+        :param wss_url: Replaces the websocket URL chosen by testnet
+        With either of them the client is not persistent: nothing is journaled, stored or snapshotted
+        """
 
         self.futures = futures
 
@@ -49,11 +82,31 @@ class BinanceClient:
                 self._base_url = "https://api.binance.com"
                 self._wss_url = "wss://stream.binance.com:9443/ws"
 
+        # Key of the market data in the candle store, the klines of the testnet differ from the real ones
+        self.candle_source = self.platform + ("_testnet" if testnet else "")
+
+        if base_url is not None or wss_url is not None:
+            # A mock or another exchange: its candles, trades and snapshots must not mix with the real ones
+            self.persistent = False
+            if base_url is not None:
+                self._base_url = base_url.rstrip("/")
+                self.candle_source = f"{self.platform}_{self._base_url}"
+            if wss_url is not None:
+                self._wss_url = wss_url
+
         self._public_key = public_key
         self._secret_key = secret_key
 
         self._headers = {"X-MBX-APIKEY": self._public_key}
 
+        # 80% of the IP request weight limit per minute (2400 on Futures, 6000 on Spot)
+        self._limiter = RequestWeightLimiter(1900 if self.futures else 4800)
+
+        # Exchange clock minus local clock, in milliseconds
+        self.time_offset = 0
+        self.sync_time()
+        scheduler.call_every(600, self.sync_time, blocking=True)
+
         self.contracts = self.get_contracts()
         self.balances = self.get_balances()
 
@@ -65,7 +118,13 @@ class BinanceClient:
             ],
         ] = dict()
 
+        # Evaluates together the strategies whose candles close at the same time
+        self.evaluator: typing.Optional[
+            typing.Union[CandleCloseEvaluator, StrategyWorkerPool]
+        ] = CandleCloseEvaluator(self.strategies)
+
         self.logs = []
+        retention.register("binance_logs", self, "logs", LOGS_POLICY)
 
         self._ws_id = 1
         self.ws: websocket.WebSocketApp
@@ -73,6 +132,14 @@ class BinanceClient:
         self.ws_connected = False
         self.ws_subscriptions = {"bookTicker": [], "aggTrade": []}
 
+        self._tick_batcher: typing.Optional[TickBatcher] = None
+        # time_ns() at the reception of the message being dispatched, and the histograms per symbol, see latency.py
+        self._received_ns = 0
+        # perf_counter_ns() at the same time, for the stages measured inside the program
+        self._received_perf_ns = 0
+        self._exchange_latency: typing.Dict[str, LatencyHistogram] = dict()
+        self._recorder: typing.Optional[TickRecorder] = None
+
         t = threading.Thread(target=self._start_ws)
         t.start()
 
@@ -92,6 +159,43 @@ class BinanceClient:
 
         return None, None
 
+    def server_time(self) -> int:
+        """
+        Current time of the exchange in milliseconds, to align the candle boundaries with the exchange.
+        :return:
+        """
+
+        return int(time.time() * 1000) + self.time_offset
+
+    def sync_time(self):
+        """
+        Measure the offset between the exchange clock and the local clock, assuming the server time is
+        taken halfway through the request.
+        :return:
+        """
+
+        endpoint = "/fapi/v1/time" if self.futures else "/api/v3/time"
+
+        sent = time.time() * 1000
+        response = self._make_request("GET", endpoint, dict())
+        received = time.time() * 1000
+
+        if response is not None:
+            self.time_offset = int(response["serverTime"] - (sent + received) / 2)
+            logger.info("Binance clock offset: %s ms", self.time_offset)
+
+    def _correct_time(self, trade_time: int):
+        """
+        A trade can't be received before it happened: a trade time ahead of the exchange clock estimate
+        means the local clock drifted since the last sync_time().
+        :param trade_time: Exchange timestamp of the trade
+        :return:
+        """
+
+        offset = trade_time - int(time.time() * 1000)
+        if offset > self.time_offset:
+            self.time_offset = offset
+
     def validate_keys(self) -> bool:
         data = {"timestamp": int(time.time() * 1000)}
         data["signature"] = self._generate_signature(data)
@@ -132,19 +236,29 @@ class BinanceClient:
             self._secret_key.encode(), urlencode(data).encode(), hashlib.sha256
         ).hexdigest()
 
-    def _make_request(self, method: str, endpoint: str, data: typing.Dict):
+    def _make_request(
+        self, method: str, endpoint: str, data: typing.Dict, weight: int = 1
+    ):
         """
         Wrapper that normalizes the requests to the REST API and error handling.
+        Waits when the request weight used in the last minute is close to the limit, so it can be called from
+        several threads at once.
         :param method: GET, POST, DELETE
         :param endpoint: Includes the /api/v1 part
         :param data: Parameters of the request
+        :param weight: Request weight of the endpoint
         :return:
         """
 
+        self._limiter.acquire(weight)
+
         if method == "GET":
             try:
                 response = requests.get(
-                    self._base_url + endpoint, params=data, headers=self._headers
+                    self._base_url + endpoint,
+                    params=data,
+                    headers=self._headers,
+                    timeout=REQUEST_TIMEOUT,
                 )
             except (
                 Exception
@@ -160,7 +274,10 @@ class BinanceClient:
         elif method == "POST":
             try:
                 response = requests.post(
-                    self._base_url + endpoint, params=data, headers=self._headers
+                    self._base_url + endpoint,
+                    params=data,
+                    headers=self._headers,
+                    timeout=REQUEST_TIMEOUT,
                 )
             except Exception as e:
                 logger.error(
@@ -174,7 +291,10 @@ class BinanceClient:
         elif method == "DELETE":
             try:
                 response = requests.delete(
-                    self._base_url + endpoint, params=data, headers=self._headers
+                    self._base_url + endpoint,
+                    params=data,
+                    headers=self._headers,
+                    timeout=REQUEST_TIMEOUT,
                 )
             except Exception as e:
                 logger.error(
@@ -187,6 +307,10 @@ class BinanceClient:
         else:
             raise ValueError()
 
+        used_weight = response.headers.get("X-MBX-USED-WEIGHT-1M")
+        if used_weight is not None:
+            self._limiter.sync(int(used_weight))
+
         if (
             response.status_code == 200
         ):  # 200 is the response code of successful requests
@@ -225,12 +349,13 @@ class BinanceClient:
         )  # Sort keys of the dictionary alphabetically
 
     def get_historical_candles(
-        self, contract: Contract, interval: str
+        self, contract: Contract, interval: str, start_time: typing.Optional[int] = None
     ) -> typing.List[Candle]:
         """
         Get a list of the most recent candlesticks for a given symbol/contract and interval.
         :param contract:
         :param interval: 1m, 3m, 5m, 15m, 30m, 1h, 2h, 4h, 6h, 8h, 12h, 1d, 3d, 1w, 1M
+        :param start_time: Timestamp in milliseconds of the first candle, None for the most recent ones
         :return:
         """
 
@@ -238,11 +363,13 @@ class BinanceClient:
         data["symbol"] = contract.symbol
         data["interval"] = interval
         data["limit"] = 1000  # The maximum number of candles is 1000 on Binance Spot
+        if start_time is not None:
+            data["startTime"] = start_time
 
         if self.futures:
-            raw_candles = self._make_request("GET", "/fapi/v1/klines", data)
+            raw_candles = self._make_request("GET", "/fapi/v1/klines", data, weight=5)
         else:
-            raw_candles = self._make_request("GET", "/api/v3/klines", data)
+            raw_candles = self._make_request("GET", "/api/v3/klines", data, weight=2)
 
         candles = []
 
@@ -250,8 +377,78 @@ class BinanceClient:
             for c in raw_candles:
                 candles.append(Candle(c, interval, self.platform))
 
+            if self.persistent:
+                try:
+                    candle_store.insert(
+                        self.candle_source,
+                        contract.symbol,
+                        interval,
+                        candles_to_rows(candles).T,
+                    )
+                except sqlite3.Error as e:
+                    logger.error(
+                        "Error while storing the %s candles: %s", contract.symbol, e
+                    )
+
         return candles
 
+    def load_candles(
+        self, contract: Contract, interval: str, count: int = 1000
+    ) -> typing.List[Candle]:
+        """
+        Most recent candles of a symbol, read from the candle store, only the candles since the last stored one
+        are downloaded.
+        :param contract:
+        :param interval:
+        :param count: Number of candle periods to load, up to now
+        :return:
+        """
+
+        start_ms = self.server_time() - count * INTERVAL_MS[interval]
+
+        try:
+            candles = array_to_candles(
+                candle_store.read(
+                    self.candle_source, contract.symbol, interval, start_ms=start_ms
+                ),
+                interval,
+            )
+        except sqlite3.Error as e:
+            logger.error("Error while reading the %s candles: %s", contract.symbol, e)
+            candles = []
+
+        return self.backfill_candles(contract, interval, candles)
+
+    def backfill_candles(
+        self, contract: Contract, interval: str, candles: typing.List[Candle]
+    ) -> typing.List[Candle]:
+        """
+        Complete candles restored from a snapshot with the ones since the snapshot, in one request when the gap
+        is shorter than 1000 candles. The last restored candle, unfinished when the snapshot was taken, is
+        downloaded again.
+        :param contract:
+        :param interval:
+        :param candles: The restored candles
+        :return: The completed candles, or the most recent candles if the gap is too long
+        """
+
+        if len(candles) == 0:
+            return self.get_historical_candles(contract, interval)
+
+        last_ts = candles[-1].timestamp
+        missing = (self.server_time() - last_ts) // INTERVAL_MS[interval] + 1
+
+        if missing >= 1000:
+            return self.get_historical_candles(contract, interval)
+
+        recent = self.get_historical_candles(contract, interval, start_time=last_ts)
+
+        if len(recent) == 0:
+            return candles
+
+        first_ts = recent[0].timestamp
+        return [c for c in candles if c.timestamp < first_ts] + recent
+
     def get_bid_ask(self, contract: Contract) -> typing.Dict[str, float]:
         """
         Get a snapshot of the current bid, ask, last price, and volume for a symbol/contract,
@@ -305,6 +502,23 @@ class BinanceClient:
 
         return balances
 
+    def get_positions(self) -> typing.Optional[typing.Dict[str, float]]:
+        """
+        Futures only. Net position of each symbol of the account, negative for a short position.
+        :return: None if the request failed
+        """
+
+        data = dict()
+        data["timestamp"] = int(time.time() * 1000)
+        data["signature"] = self._generate_signature(data)
+
+        positions = self._make_request("GET", "/fapi/v2/positionRisk", data, weight=5)
+
+        if positions is None:
+            return None
+
+        return {p["symbol"]: float(p["positionAmt"]) for p in positions}
+
     def place_order(
         self,
         contract: Contract,
@@ -313,6 +527,7 @@ class BinanceClient:
         side: str,
         price=None,
         tif=None,
+        reduce_only: bool = False,
     ) -> OrderStatus:
         """
         Place an order. Based on the order_type, the price and tif arguments are not required
@@ -322,6 +537,7 @@ class BinanceClient:
         :param side:
         :param price:
         :param tif:
+        :param reduce_only: Futures only, the order is rejected if it would open or increase a position
         :return:
         """
 
@@ -345,6 +561,9 @@ class BinanceClient:
         if tif is not None:
             data["timeInForce"] = tif
 
+        if reduce_only and self.futures:
+            data["reduceOnly"] = "true"
+
         data["timestamp"] = int(time.time() * 1000)
         data["signature"] = self._generate_signature(data)
 
@@ -515,6 +734,10 @@ class BinanceClient:
         :return:
         """
 
+        # The wall clock, to compare with the exchange event times, and the monotonic clock of the other stages
+        self._received_ns = time.time_ns()
+        self._received_perf_ns = time.perf_counter_ns()
+
         data = json.loads(msg)
 
         if "u" in data and "A" in data:
@@ -524,56 +747,154 @@ class BinanceClient:
             # See the data structure difference here: https://binance-docs.github.io/apidocs/spot/en/#individual-symbol-book-ticker-streams
 
         if "e" in data:
+            if self._recorder is not None and data["e"] in ["bookTicker", "aggTrade"]:
+                self._recorder.record(msg)
+
+            if "E" in data and "s" in data:
+                self._record_exchange_latency(data["s"], data["E"])
+
             if data["e"] == "bookTicker":
+                self._on_book_ticker(data)
 
-                symbol = data["s"]
+            elif data["e"] == "aggTrade":
+                self._on_agg_trade(data)
 
-                if symbol not in self.prices:
-                    self.prices[symbol] = {
-                        "bid": float(data["b"]),
-                        "ask": float(data["a"]),
-                    }
-                else:
-                    self.prices[symbol]["bid"] = float(data["b"])
-                    self.prices[symbol]["ask"] = float(data["a"])
+    def _record_exchange_latency(self, symbol: str, event_time: int):
+        histogram = self._exchange_latency.get(symbol)
+        if histogram is None:
+            histogram = latencies.histogram("exchange_to_receive", symbol)
+            self._exchange_latency[symbol] = histogram
 
-                # PNL Calculation
+        histogram.record(
+            self._received_ns + (self.time_offset - event_time) * 1_000_000
+        )
 
-                try:
-                    for b_index, strat in self.strategies.items():
-                        if strat.contract.symbol == symbol:
-                            for trade in strat.trades:
-                                if (
-                                    trade.status == "open"
-                                    and trade.entry_price is not None
-                                ):
-                                    if trade.side == "long":
-                                        trade.pnl = (
-                                            self.prices[symbol]["bid"]
-                                            - trade.entry_price
-                                        ) * trade.quantity
-                                    elif trade.side == "short":
-                                        trade.pnl = (
-                                            trade.entry_price
-                                            - self.prices[symbol]["ask"]
-                                        ) * trade.quantity
-                except (
-                    RuntimeError
-                ) as e:  # Handles the case  the dictionary is modified while loop through it
-                    logger.error(
-                        "Error while looping through the Binance strategies: %s", e
+    def _on_book_ticker(self, data: typing.Dict):
+        symbol = data["s"]
+
+        if symbol not in self.prices:
+            self.prices[symbol] = {
+                "bid": float(data["b"]),
+                "ask": float(data["a"]),
+            }
+        else:
+            self.prices[symbol]["bid"] = float(data["b"])
+            self.prices[symbol]["ask"] = float(data["a"])
+
+        # PNL Calculation
+
+        try:
+            for b_index, strat in self.strategies.items():
+                if strat.contract.symbol == symbol:
+                    for trade in strat.trades:
+                        if trade.status == "open" and trade.entry_price is not None:
+                            if trade.side == "long":
+                                trade.pnl = (
+                                    self.prices[symbol]["bid"] - trade.entry_price
+                                ) * trade.quantity
+                            elif trade.side == "short":
+                                trade.pnl = (
+                                    trade.entry_price - self.prices[symbol]["ask"]
+                                ) * trade.quantity
+                            if self.persistent:
+                                journal.record("pnl", strat, trade)
+        except (
+            RuntimeError
+        ) as e:  # Handles the case  the dictionary is modified while loop through it
+            logger.error("Error while looping through the Binance strategies: %s", e)
+
+    def _on_agg_trade(self, data: typing.Dict):
+        symbol = data["s"]
+
+        self._correct_time(data["T"])
+
+        if self._tick_batcher is not None:
+            self._tick_batcher.add(
+                symbol, float(data["p"]), float(data["q"]), data["T"]
+            )
+        else:
+            received_ns = self._received_perf_ns
+            for key, strat in self.strategies.items():
+                if strat.contract.symbol == symbol:
+                    dispatched_ns = time.perf_counter_ns()
+                    strat.latency["receive_to_dispatch"].record(
+                        dispatched_ns - received_ns
+                    )
+                    res = strat.parse_trades(
+                        float(data["p"]), float(data["q"]), data["T"]
+                    )  # Updates candlesticks
+                    strat.latency["dispatch_to_candle"].record(
+                        time.perf_counter_ns() - dispatched_ns
                     )
+                    strat.on_tick(res)
+
+    def set_tick_batching(self, window_ms: float, max_batch: int = 100):
+        """
+        Trade latency against throughput for the aggTrade updates, see ingestion.TickBatcher.
+        :param window_ms: Maximum time a trade waits before being processed. 0 processes every trade as soon as
+        it is received (lowest latency), 5-50 ms batches the trades of busy symbols (highest throughput).
+        :param max_batch: A batch is processed as soon as it reaches this number of trades
+        :return:
+        """
+
+        if self._tick_batcher is not None:
+            self._tick_batcher.stop()
+            self._tick_batcher = None
 
-            if data["e"] == "aggTrade":
+        if window_ms > 0:
+            self._tick_batcher = TickBatcher(self._on_trade_batch, window_ms, max_batch)
+            self._tick_batcher.start()
 
-                symbol = data["s"]
+    def set_tick_recording(self, directory: typing.Optional[str]):
+        """
+        Record the raw aggTrade and bookTicker messages to compressed hourly files, see recorder.TickRecorder.
+        :param directory: Where the files are written, None to stop recording
+        :return:
+        """
 
-                for key, strat in self.strategies.items():
-                    if strat.contract.symbol == symbol:
-                        res = strat.parse_trades(
-                            float(data["p"]), float(data["q"]), data["T"]
-                        )  # Updates candlesticks
-                        strat.check_trade(res)
+        if self._recorder is not None:
+            self._recorder.stop()
+            self._recorder = None
+
+        if directory is not None:
+            self._recorder = TickRecorder(directory)
+            self._recorder.start()
+
+    def set_strategy_workers(self, workers: int):
+        """
+        Evaluate the signals of the strategies in worker processes (see workers.StrategyWorkerPool), or in the
+        main process when workers is 0.
+        :param workers: Number of worker processes, up to the number of cores
+        :return:
+        """
+
+        if isinstance(self.evaluator, StrategyWorkerPool):
+            self.evaluator.stop()
+
+        if workers > 0:
+            self.evaluator = StrategyWorkerPool(self.strategies, workers)
+        else:
+            self.evaluator = CandleCloseEvaluator(self.strategies)
+
+    def _on_trade_batch(
+        self,
+        symbol: str,
+        prices: typing.List[float],
+        sizes: typing.List[float],
+        timestamps: typing.List[int],
+    ):
+        try:
+            for key, strat in self.strategies.items():
+                if strat.contract.symbol == symbol:
+                    # The reception of the trades of a batch is not kept, only its candle update is timed
+                    dispatched_ns = time.perf_counter_ns()
+                    res = strat.parse_trades_batch(prices, sizes, timestamps)
+                    strat.latency["dispatch_to_candle"].record(
+                        time.perf_counter_ns() - dispatched_ns
+                    )
+                    strat.on_tick(res)
+        except RuntimeError as e:  # The dictionary is modified while looping through it
+            logger.error("Error while looping through the Binance strategies: %s", e)
 
     def subscribe_channel(
         self, contracts: typing.List[Contract], channel: str, reconnection=False
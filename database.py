@@ -1,46 +1,240 @@
+import logging
 import sqlite3
 import typing
+import json
+import threading
+import contextlib
+
+logger = logging.getLogger()
+
+# Applied to every new connection
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",  # The readers don't block the writer and the writer doesn't block the readers
+    "PRAGMA synchronous=NORMAL",  # Enough with WAL, a power loss can only lose the last transactions
+    "PRAGMA busy_timeout=5000",  # Milliseconds a writer waits for another one instead of failing
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",  # In KiB
+]
+
+
+class Database:
+    def __init__(self, path: str):
+        """
+        Connections to a SQLite file, one per thread since a sqlite3 connection can't be used by several threads
+        at the same time, all in WAL mode so that saving from one thread never blocks reading from another.
+        The statements are compiled once per connection and then reused from the statement cache of sqlite3,
+        as long as the values are passed as ? parameters instead of being formatted into the SQL.
+        Use get_database() rather than this class, so that the whole application shares the connections.
+        :param path:
+        """
+
+        self.path = path
+        self._local = threading.local()
+        self._connections: typing.List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, cached_statements=256, check_same_thread=False
+            )
+            # Makes the data retrieved from the database accessible by their column name
+            conn.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self) -> typing.Iterator[sqlite3.Connection]:
+        """
+        with database.transaction() as conn: ... commits at the end of the block, or rolls back on an exception.
+        :return:
+        """
+
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+_databases: typing.Dict[str, Database] = dict()
+_databases_lock = threading.Lock()
+
+
+def get_database(path: str = "database.db") -> Database:
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = Database(path)
+        return _databases[path]
+
+
+# Columns identifying a row of each table, for the upserts and the deletes
+TABLE_KEYS = {
+    "watchlist": ("symbol", "exchange"),
+    "strategies": ("strategy_id",),
+}
 
 
 class WorkspaceData:
-    def __init__(self):
-        self.conn = sqlite3.connect("database.db")
-        self.conn.row_factory = (
-            sqlite3.Row
-        )  # Makes the data retrieved from the database accessible by their column name
-        self.cursor = self.conn.cursor()
-
-        self.cursor.execute(
-            "CREATE TABLE IF NOT EXISTS watchlist (symbol TEXT, exchange TEXT)"
+    def __init__(self, path: str = "database.db"):
+        self.db = get_database(path)
+
+        with self.db.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS watchlist (symbol TEXT, exchange TEXT)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS strategies (strategy_type TEXT, contract TEXT,"
+                "timeframe TEXT, balance_pct REAL, take_profit REAL, stop_loss REAL, extra_params TEXT,"
+                "strategy_id TEXT)"
+            )
+            self._migrate(conn)
+
+    @staticmethod
+    def _migrate(conn: sqlite3.Connection):
+        """
+        Add the keys to the tables created by the previous versions, which were rewritten entirely at each save.
+        :param conn:
+        :return:
+        """
+
+        columns = [row["name"] for row in conn.execute("PRAGMA table_info(strategies)")]
+        if "strategy_id" not in columns:
+            conn.execute("ALTER TABLE strategies ADD COLUMN strategy_id TEXT")
+        conn.execute(
+            "UPDATE strategies SET strategy_id = CAST(rowid AS TEXT) WHERE strategy_id IS NULL"
         )
-        self.cursor.execute(
-            "CREATE TABLE IF NOT EXISTS strategies (strategy_type TEXT, contract TEXT,"
-            "timeframe TEXT, balance_pct REAL, take_profit REAL, stop_loss REAL, extra_params TEXT)"
+
+        conn.execute(
+            "DELETE FROM watchlist WHERE rowid NOT IN "
+            "(SELECT MIN(rowid) FROM watchlist GROUP BY symbol, exchange)"
         )
 
-        self.conn.commit()  # Saves the changes
+        for table, key in TABLE_KEYS.items():
+            conn.execute(
+                f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_key ON {table} ({', '.join(key)})"
+            )
+
+    @staticmethod
+    def _check_table(table: str):
+        if table not in TABLE_KEYS:
+            raise ValueError(f"Unknown table {table}")
+
+    def add_watchlist_symbol(self, symbol: str, exchange: str):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO watchlist (symbol, exchange) VALUES (?, ?) "
+                "ON CONFLICT (symbol, exchange) DO NOTHING",
+                (symbol, exchange),
+            )
+
+    def remove_watchlist_symbol(self, symbol: str, exchange: str):
+        with self.db.transaction() as conn:
+            conn.execute(
+                "DELETE FROM watchlist WHERE symbol = ? AND exchange = ?",
+                (symbol, exchange),
+            )
+
+    def save_strategy(
+        self,
+        strategy_id: str,
+        strategy_type: str,
+        contract: str,
+        timeframe: str,
+        extra_params: typing.Dict,
+    ):
+        """
+        Insert or update one strategy row.
+        :param strategy_id: Key of the row, kept by the interface across sessions
+        :param strategy_type: e.g. Technical
+        :param contract: e.g. BTCUSDT_Binance
+        :param timeframe:
+        :param extra_params: The parameters of the strategy, stored as JSON
+        :return:
+        """
+
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO strategies (strategy_id, strategy_type, contract, timeframe, balance_pct, take_profit, "
+                "stop_loss, extra_params) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (strategy_id) DO UPDATE SET strategy_type = excluded.strategy_type, "
+                "contract = excluded.contract, timeframe = excluded.timeframe, balance_pct = excluded.balance_pct, "
+                "take_profit = excluded.take_profit, stop_loss = excluded.stop_loss, "
+                "extra_params = excluded.extra_params",
+                (
+                    strategy_id,
+                    strategy_type,
+                    contract,
+                    timeframe,
+                    extra_params.get("balance_pct"),
+                    extra_params.get("take_profit_pct"),
+                    extra_params.get("stop_loss_pct"),
+                    json.dumps(extra_params),
+                ),
+            )
+
+    def delete_strategy(self, strategy_id: str):
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM strategies WHERE strategy_id = ?", (strategy_id,))
 
     def save(self, table: str, data: typing.List[typing.Tuple]):
         """
-        Erase the previous table content and record new data to it.
+        Make the table content equal to data. Only the rows that changed are written: the new or modified rows
+        are upserted by key, and the rows whose key is not in data are deleted.
         :param table: The table name
         :param data: A list of tuples, the tuples elements must be ordered like the table columns
         :return:
         """
 
-        self.cursor.execute(f"DELETE FROM {table}")
+        self._check_table(table)
+
+        with self.db.transaction() as conn:
+            cursor = conn.execute(f"SELECT * FROM {table}")
+            columns = [description[0] for description in cursor.description]
+            key_indexes = [columns.index(column) for column in TABLE_KEYS[table]]
 
-        table_data = self.cursor.execute(f"SELECT * FROM {table}")
+            existing = {
+                tuple(row[i] for i in key_indexes): tuple(row) for row in cursor
+            }
+            new_keys = set()
+            changed = []
 
-        columns = [
-            description[0] for description in table_data.description
-        ]  # Lists the columns of the table
+            for row in data:
+                key = tuple(row[i] for i in key_indexes)
+                new_keys.add(key)
+                if existing.get(key) != tuple(row):
+                    changed.append(row)
 
-        # Creates the SQL insert statement dynamically
-        sql_statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+            updates = ", ".join(
+                f"{column} = excluded.{column}"
+                for column in columns
+                if column not in TABLE_KEYS[table]
+            )
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))}) "
+                f"ON CONFLICT ({', '.join(TABLE_KEYS[table])}) "
+                + (f"DO UPDATE SET {updates}" if updates else "DO NOTHING"),
+                changed,
+            )
 
-        self.cursor.executemany(sql_statement, data)
-        self.conn.commit()
+            conditions = " AND ".join(f"{column} = ?" for column in TABLE_KEYS[table])
+            conn.executemany(
+                f"DELETE FROM {table} WHERE {conditions}",
+                [key for key in existing if key not in new_keys],
+            )
 
     def get(self, table: str) -> typing.List[sqlite3.Row]:
         """
@@ -49,7 +243,6 @@ class WorkspaceData:
         :return: A list of sqlite3.Rows accessible like Python dictionaries.
         """
 
-        self.cursor.execute(f"SELECT * FROM {table}")
-        data = self.cursor.fetchall()
+        self._check_table(table)
 
-        return data
+        return self.db.connection().execute(f"SELECT * FROM {table}").fetchall()
@@ -0,0 +1,203 @@
+import logging
+import typing
+import time
+import threading
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import indicators
+from indicators import indicator_cache
+from scheduler import scheduler
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+
+class CandleCloseEvaluator:
+    def __init__(
+        self,
+        strategies: typing.Dict[int, "Strategy"],
+        max_wait_ms: float = 50,
+        max_workers: int = 8,
+    ):
+        """
+        Barrier for the strategies whose candle closes at the same boundary: instead of checking their signals one
+        by one as their candles close, the strategies are gathered until all the ones expected at the boundary
+        have closed their candle (or max_wait_ms after the first one), then:
+        - their indicators are computed together, one 2-D call per indicator and parameter set,
+        - their signals are evaluated from the indicator cache,
+        - their orders are submitted concurrently.
+        :param strategies: The active strategies of the client, a strategy is expected at every boundary that is
+        a multiple of its timeframe
+        :param max_wait_ms: Maximum time the first strategy of a boundary waits for the others
+        :param max_workers: Number of orders submitted at the same time
+        """
+
+        self.strategies = strategies
+        self.max_wait_ms = max_wait_ms
+        self.max_workers = max_workers
+
+        self.batches = 0
+        self.last_batch: typing.Dict[str, float] = dict()
+
+        # boundary -> (time.monotonic() of the first close, strategies)
+        self._pending: typing.Dict[int, typing.Tuple[float, typing.List]] = dict()
+        self._jobs = dict()
+        self._lock = threading.Lock()
+        self._executor: typing.Optional[ThreadPoolExecutor] = None
+
+    def submit(self, strategy: "Strategy"):
+        """
+        Called instead of strategy.check_trade("new_candle") when a candle of the strategy closes.
+        :param strategy:
+        :return:
+        """
+
+        boundary = strategy.candles[-1].timestamp
+
+        with self._lock:
+            first_close, batch = self._pending.setdefault(
+                boundary, (time.monotonic(), [])
+            )
+            if all(s is not strategy for s in batch):
+                batch.append(strategy)
+
+            complete = all(
+                any(s is expected for s in batch)
+                for expected in self._expected(boundary)
+            )
+
+            if complete:
+                del self._pending[boundary]
+                job = self._jobs.pop(boundary, None)
+                if job is not None:
+                    job.cancel()
+            elif boundary not in self._jobs:
+                self._jobs[boundary] = scheduler.call_later(
+                    self.max_wait_ms / 1000,
+                    self._flush,
+                    boundary,
+                    name=f"candle close batch {boundary}",
+                )
+
+        if complete:
+            self._evaluate(batch, first_close)
+
+    def remove(self, strategy: "Strategy"):
+        """
+        Forget a strategy that is stopped while its candle close is pending.
+        :param strategy:
+        :return:
+        """
+
+        with self._lock:
+            for _, batch in self._pending.values():
+                batch[:] = [s for s in batch if s is not strategy]
+
+    def _expected(self, boundary: int) -> typing.List["Strategy"]:
+        try:
+            return [s for s in self.strategies.values() if boundary % s.tf_equiv == 0]
+        except RuntimeError:  # The dictionary is modified while looping through it
+            return []
+
+    def _flush(self, boundary: int):
+        with self._lock:
+            self._jobs.pop(boundary, None)
+            pending = self._pending.pop(boundary, None)
+
+        if pending is not None:
+            first_close, batch = pending
+            self._evaluate(batch, first_close)
+
+    def _evaluate(self, batch: typing.List["Strategy"], first_close: float):
+        start = time.monotonic()
+
+        batch = [s for s in batch if not s.ongoing_position]
+        self._compute_indicators(batch)
+
+        signals = []
+        for strategy in batch:
+            try:
+                signal_result = strategy._check_signal()
+                strategy.record_signal()
+            except Exception as e:
+                # One strategy must not prevent the others from trading
+                logger.error(
+                    "Error while checking the signal of %s %s: %s",
+                    strategy.strat_name,
+                    strategy.contract.symbol,
+                    e,
+                )
+                continue
+            if signal_result in [-1, 1]:
+                signals.append((strategy, signal_result))
+
+        if signals:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix="orders"
+                )
+            for strategy, signal_result in signals:
+                self._executor.submit(self._open_position, strategy, signal_result)
+
+        self.batches += 1
+        self.last_batch = {
+            "strategies": len(batch),
+            "orders": len(signals),
+            "wait_ms": (start - first_close) * 1000,
+            "evaluation_ms": (time.monotonic() - start) * 1000,
+        }
+
+    @staticmethod
+    def _open_position(strategy: "Strategy", signal_result: int):
+        try:
+            strategy._open_position(signal_result)
+        except Exception as e:
+            logger.error(
+                "Error while opening a position for %s %s: %s",
+                strategy.strat_name,
+                strategy.contract.symbol,
+                e,
+            )
+
+    @staticmethod
+    def _compute_indicators(batch: typing.List["Strategy"]):
+        """
+        Seed the indicator cache for the whole batch. The series are grouped by indicator and number of candles
+        (the EMAs depend on the first candle of the series), each group is computed in one call.
+        :param batch:
+        :return:
+        """
+
+        groups = collections.defaultdict(dict)
+
+        for strategy in batch:
+            for name, params in strategy.indicator_specs():
+                key = (name, params, len(strategy.candles))
+                groups[key].setdefault(strategy.series_id, strategy)
+
+        for (name, params, _), series in groups.items():
+            if len(series) < 2:
+                continue  # Computed on demand by the strategy, as without batch
+
+            strategies = list(series.values())
+            closes = np.array(
+                [[candle.close for candle in s.candles] for s in strategies]
+            )
+            values = indicators.last_closed(name, closes, *params)
+            if isinstance(values, tuple):
+                values = list(zip(*values))
+
+            for strategy, value in zip(strategies, values):
+                indicator_cache.put(
+                    strategy.series_id,
+                    name,
+                    params,
+                    strategy.candles[-2].timestamp,
+                    value,
+                )
@@ -0,0 +1,292 @@
+import logging
+import typing
+import collections
+import threading
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# The indicators take NumPy arrays of shape (n,) or (rows, n), one row per symbol and one column per candle, the
+# oldest first. A 2-D call evaluates the same indicator for several symbols at once; their rows must cover the
+# same number of candles since the EMAs depend on the first value of the series.
+# The results match the pandas versions previously used (ewm with adjust=True) to floating point precision.
+
+
+def _ewm(values: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    Exponentially weighted mean along the last axis, same as pandas ewm(alpha=alpha, adjust=True).mean()
+    for values without NaN: y[t] = sum(w^(t-i) * x[i]) / sum(w^(t-i)) with w = 1 - alpha.
+    The recursion is solved by blocks of candles with cumulative sums of the values rescaled by w^-k. The
+    rescaling doesn't cost precision since each sum is dominated by its last terms, the block length only
+    keeps w^-k far from the float overflow: one block covers 1000 candles for any span above 3.
+    :param values:
+    :param alpha: Smoothing factor, 0 < alpha <= 1
+    :return:
+    """
+
+    values = np.asarray(values, dtype=float)
+    w = 1 - alpha
+
+    if w <= 0:
+        return values.copy()
+
+    n = values.shape[-1]
+    block = max(int(300 / -np.log(w)), 1)  # w^-block < e^300
+
+    out = np.empty_like(values)
+    num = np.zeros(values.shape[:-1])
+    den = 0.0
+
+    for start in range(0, n, block):
+        chunk = values[..., start : start + block]
+        k = np.arange(chunk.shape[-1])
+        decay = w**k
+        carry = w * decay  # Weight of the sums of the previous blocks
+
+        block_num = num[..., None] * carry + np.cumsum(chunk / decay, axis=-1) * decay
+        block_den = den * carry + np.cumsum(1 / decay) * decay
+
+        out[..., start : start + block] = block_num / block_den
+        num = block_num[..., -1]
+        den = block_den[-1]
+
+    return out
+
+
+def ema(closes: np.ndarray, span: int) -> np.ndarray:
+    return _ewm(closes, 2 / (span + 1))
+
+
+def rsi(closes: np.ndarray, length: int) -> np.ndarray:
+    """
+    RSI with Wilder's smoothing, aligned with the closes (NaN until length price changes are known).
+    :param closes:
+    :param length:
+    :return:
+    """
+
+    closes = np.asarray(closes, dtype=float)
+    delta = np.diff(closes, axis=-1)
+
+    avg_gain = _ewm(np.clip(delta, 0, None), 1 / length)
+    avg_loss = _ewm(np.abs(np.clip(delta, None, 0)), 1 / length)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = np.round(100 - 100 / (1 + avg_gain / avg_loss), 2)
+
+    out = np.full(closes.shape, np.nan)
+    out[..., length:] = values[..., length - 1 :]
+    return out
+
+
+def macd(
+    closes: np.ndarray, ema_fast: int, ema_slow: int, ema_signal: int
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    macd_line = ema(closes, ema_fast) - ema(closes, ema_slow)
+    macd_signal = ema(macd_line, ema_signal)
+    return macd_line, macd_signal
+
+
+def fractals(
+    highs: np.ndarray, lows: np.ndarray
+) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Fractals as in FractalStrategy: candle j is a bearish fractal when its high is above the highs of candles
+    j - 2, j - 1 and j + 1, a bullish fractal when its low is below their lows.
+    A fractal is only known once candle j + 1 has closed.
+    :param highs:
+    :param lows:
+    :return: (bullish, bearish) boolean arrays, False where the neighbours are missing
+    """
+
+    highs = np.asarray(highs, dtype=float)
+    lows = np.asarray(lows, dtype=float)
+
+    bullish = np.zeros(lows.shape, dtype=bool)
+    bearish = np.zeros(highs.shape, dtype=bool)
+
+    if highs.shape[-1] >= 4:
+        j = slice(2, -1)
+        bullish[..., j] = (
+            (lows[..., 2:-1] < lows[..., :-3])
+            & (lows[..., 2:-1] < lows[..., 1:-2])
+            & (lows[..., 2:-1] < lows[..., 3:])
+        )
+        bearish[..., j] = (
+            (highs[..., 2:-1] > highs[..., :-3])
+            & (highs[..., 2:-1] > highs[..., 1:-2])
+            & (highs[..., 2:-1] > highs[..., 3:])
+        )
+
+    return bullish, bearish
+
+
+def ffill(values: np.ndarray) -> np.ndarray:
+    """
+    Replace the NaN values with the last valid value before them along the last axis, same as pandas ffill().
+    :param values:
+    :return:
+    """
+
+    values = np.asarray(values, dtype=float)
+    positions = np.where(np.isnan(values), 0, np.arange(values.shape[-1]))
+    np.maximum.accumulate(positions, axis=-1, out=positions)
+    return np.take_along_axis(values, positions, axis=-1)
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Mean of the last window values along the last axis, NaN for the first window - 1 values.
+    :param values:
+    :param window:
+    :return:
+    """
+
+    values = np.asarray(values, dtype=float)
+    cumsum = np.cumsum(values, axis=-1)
+
+    out = np.full(values.shape, np.nan)
+    out[..., window - 1 :] = cumsum[..., window - 1 :]
+    out[..., window:] -= cumsum[..., :-window]
+    out[..., window - 1 :] /= window
+    return out
+
+
+def volume_filter(
+    volumes: np.ndarray, min_volume: float, window: int = 1
+) -> np.ndarray:
+    """
+    True where the average volume of the last window candles is above min_volume. With window=1, the filter
+    of BreakoutStrategy.
+    :param volumes:
+    :param min_volume:
+    :param window:
+    :return:
+    """
+
+    if window == 1:
+        return np.asarray(volumes) > min_volume
+
+    with np.errstate(invalid="ignore"):
+        return rolling_mean(volumes, window) > min_volume
+
+
+def last_closed(name: str, closes: np.ndarray, *params) -> typing.Any:
+    """
+    Value of an indicator for the last closed candle, the last candle of the series being still open.
+    :param name: "ema", "rsi" or "macd"
+    :param closes: (n,) or (rows, n), one value per row for the latter
+    :param params: The parameters of the indicator function, e.g. 14 for the RSI
+    :return: A float, or a (macd line, signal) tuple for "macd"
+    """
+
+    if name == "macd":
+        macd_line, macd_signal = macd(closes, *params)
+        return macd_line[..., -2][()], macd_signal[..., -2][()]
+
+    return INDICATORS[name](closes, *params)[..., -2][()]  # [()]: scalar for 1-D closes
+
+
+INDICATORS = {"ema": ema, "rsi": rsi}
+
+
+class IndicatorCache:
+    def __init__(self, maxsize: int = 4096):
+        """
+        Process-wide cache of indicator values, so that each distinct indicator is computed once per candle
+        whatever the number of strategies and signal functions asking for it.
+        Keys are (series id, indicator name, parameters, timestamp of the last closed candle).
+        :param maxsize: Maximum number of values kept, the least recently used are evicted first
+        """
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._values: typing.OrderedDict[typing.Tuple, typing.Any] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        series_id: typing.Tuple,
+        name: str,
+        params: typing.Tuple,
+        last_closed_ts: int,
+        compute: typing.Callable[[], typing.Any],
+    ) -> typing.Any:
+        """
+        Return the cached value, or compute and cache it.
+        :param series_id: Identifies the candle series, e.g. (exchange, symbol, timeframe)
+        :param name: e.g. "rsi", "ema", "macd"
+        :param params: The indicator parameters, e.g. (14,)
+        :param last_closed_ts: Timestamp of the last closed candle the value is computed for
+        :param compute: Called without argument on a cache miss
+        :return:
+        """
+
+        key = (series_id, name, params, last_closed_ts)
+
+        with self._lock:
+            if key in self._values:
+                self._values.move_to_end(key)
+                self.hits += 1
+                return self._values[key]
+
+        # Computed outside the lock, two threads may compute the same value once but never block each other
+        value = compute()
+
+        with self._lock:
+            self.misses += 1
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+        return value
+
+    def put(
+        self,
+        series_id: typing.Tuple,
+        name: str,
+        params: typing.Tuple,
+        last_closed_ts: int,
+        value: typing.Any,
+    ):
+        """
+        Store a value computed ahead of the strategies asking for it, e.g. by a batch over several symbols.
+        """
+
+        key = (series_id, name, params, last_closed_ts)
+
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def invalidate(
+        self, series_id: typing.Tuple, before_ts: typing.Optional[int] = None
+    ):
+        """
+        Drop the values of a series when a candle closes.
+        :param series_id:
+        :param before_ts: Only drop the values computed for a last closed candle older than this timestamp,
+        so that the strategies sharing the series keep the values already computed for the new candle.
+        None drops everything.
+        :return:
+        """
+
+        with self._lock:
+            stale = [
+                key
+                for key in self._values
+                if key[0] == series_id and (before_ts is None or key[3] < before_ts)
+            ]
+            for key in stale:
+                del self._values[key]
+
+
+indicator_cache = IndicatorCache()
@@ -0,0 +1,117 @@
+import logging
+import typing
+import threading
+import time
+
+logger = logging.getLogger()
+
+
+class TickBatcher:
+    def __init__(
+        self,
+        on_batch: typing.Callable[
+            [str, typing.List[float], typing.List[float], typing.List[int]], None
+        ],
+        window_ms: float = 10,
+        max_batch: int = 100,
+    ):
+        """
+        Gather the trades of each symbol and hand them over in batches, so that the candles and the TP/SL
+        triggers are updated once per batch instead of once per trade.
+        A batch is flushed when its first trade is window_ms old or when it reaches max_batch trades: a small
+        window favors latency, a large one throughput.
+        The batches are dispatched by a single background thread, the websocket thread only appends to a list.
+        :param on_batch: Called with (symbol, prices, sizes, timestamps) from the dispatch thread
+        :param window_ms: Maximum time a trade waits in the buffer, in milliseconds
+        :param max_batch: A batch is flushed as soon as it holds this number of trades
+        """
+
+        self.on_batch = on_batch
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+
+        self.batches_dispatched = 0
+        self.trades_dispatched = 0
+
+        # symbol -> (time of the first trade in the buffer, prices, sizes, timestamps)
+        self._buffers: typing.Dict[str, typing.Tuple[float, list, list, list]] = dict()
+        self._full: typing.Set[str] = set()
+
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread: typing.Optional[threading.Thread] = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the dispatch thread after flushing the trades still buffered.
+        :return:
+        """
+
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def add(self, symbol: str, price: float, size: float, timestamp: int):
+        with self._condition:
+            buffer = self._buffers.get(symbol)
+
+            if buffer is None:
+                buffer = (time.monotonic(), [], [], [])
+                self._buffers[symbol] = buffer
+                self._condition.notify()
+
+            buffer[1].append(price)
+            buffer[2].append(size)
+            buffer[3].append(timestamp)
+
+            if len(buffer[1]) >= self.max_batch:
+                self._full.add(symbol)
+                self._condition.notify()
+
+    def _due(self, now: float) -> typing.List[typing.Tuple[str, typing.Tuple]]:
+        window = self.window_ms / 1000
+        due = [
+            symbol
+            for symbol, buffer in self._buffers.items()
+            if symbol in self._full or now - buffer[0] >= window or not self._running
+        ]
+        self._full.clear()
+        return [(symbol, self._buffers.pop(symbol)) for symbol in due]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                now = time.monotonic()
+                due = self._due(now)
+
+                if not due:
+                    if not self._running:
+                        break
+
+                    if self._buffers:
+                        oldest = min(buffer[0] for buffer in self._buffers.values())
+                        timeout = max(oldest + self.window_ms / 1000 - now, 0)
+                    else:
+                        timeout = None
+                    self._condition.wait(timeout)
+                    continue
+
+            for symbol, (_, prices, sizes, timestamps) in due:
+                try:
+                    self.on_batch(symbol, prices, sizes, timestamps)
+                except Exception as e:
+                    # The dispatch thread must survive a failing strategy
+                    logger.error(
+                        "Error while processing a batch of %s trades: %s", symbol, e
+                    )
+
+                self.batches_dispatched += 1
+                self.trades_dispatched += len(prices)
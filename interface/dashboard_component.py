@@ -1,8 +1,10 @@
 import tkinter as tk
+import typing
 
 from models import *
 
 from connectors.binance import BinanceClient
+from scheduler import scheduler
 
 from interface.styling import *
 
@@ -14,7 +16,14 @@ class RealTimeDashboard(tk.Frame):
         self.configure(bg=BG_COLOR)
         self.create_widgets()
         self.update_interval = 10000  # Update every 10 seconds
-        self.update_dashboard()
+        # The REST calls run on a worker thread of the scheduler, the labels are updated on the Tk thread
+        self._update_job = scheduler.call_every(
+            self.update_interval / 1000, self.update_dashboard, delay=0, blocking=True
+        )
+
+    def destroy(self):
+        self._update_job.cancel()
+        super().destroy()
 
     def create_widgets(self):
         self.balance_label = tk.Label(
@@ -52,14 +61,18 @@ class RealTimeDashboard(tk.Frame):
             usdt_balance = balances.get(
                 "USDT", Balance({"free": 0, "locked": 0}, "binance_spot")
             ).free
-        self.balance_value.config(text=f"{usdt_balance:.2f} USDT")
 
         # Update market data information
+        prices = dict()
         contract = self.client.contracts.get("BTCUSDT")
         if contract:
             prices = self.client.get_bid_ask(contract)
+
+        self.after(0, self._show_dashboard, usdt_balance, prices)
+
+    def _show_dashboard(self, usdt_balance: float, prices: typing.Dict[str, float]):
+        self.balance_value.config(text=f"{usdt_balance:.2f} USDT")
+        if prices:
             self.market_data_value.config(
                 text=f"Bid: {prices['bid']:.1f} | Ask: {prices['ask']:.1f}"
             )
-
-        self.after(self.update_interval, self.update_dashboard)
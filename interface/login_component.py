@@ -1,7 +1,9 @@
 import tkinter as tk
 from tkinter import messagebox
 from connectors.binance import BinanceClient
+from paper_trading import PaperTradingClient
 import json
+import os
 from cryptography.fernet import Fernet
 
 KEY_FILE = "keyfile.key"
@@ -38,6 +40,12 @@ class LoginFrame(tk.Frame):
         )
         self.futures_check.pack(pady=10)
 
+        self.paper_var = tk.BooleanVar(value=False)
+        self.paper_check = tk.Checkbutton(
+            self, text="Paper Trading", variable=self.paper_var
+        )
+        self.paper_check.pack(pady=10)
+
         self.remember_var = tk.BooleanVar()
         self.remember_check = tk.Checkbutton(
             self, text="Remember Me", variable=self.remember_var
@@ -67,6 +75,7 @@ class LoginFrame(tk.Frame):
             self.secret_key_entry.insert(0, credentials["secret_key"])
             self.testnet_var.set(credentials.get("testnet", True))
             self.futures_var.set(credentials.get("futures", True))
+            self.paper_var.set(credentials.get("paper", False))
             self.remember_var.set(True)
         except Exception as e:
             print("No saved credentials found:", e)
@@ -77,6 +86,7 @@ class LoginFrame(tk.Frame):
             "secret_key": self.secret_key_entry.get(),
             "testnet": self.testnet_var.get(),
             "futures": self.futures_var.get(),
+            "paper": self.paper_var.get(),
         }
         data = json.dumps(credentials).encode()
 
@@ -97,7 +107,19 @@ class LoginFrame(tk.Frame):
         testnet = self.testnet_var.get()
         futures = self.futures_var.get()
 
-        binance_client = BinanceClient(api_key, secret_key, testnet, futures)
+        # Set to run against a local server, e.g. mock_exchange.py
+        base_url = os.environ.get("BINANCE_BASE_URL")
+        wss_url = os.environ.get("BINANCE_WSS_URL")
+
+        if self.paper_var.get():
+            # Market data only, the orders and the balances are simulated
+            binance_client = PaperTradingClient(
+                api_key, secret_key, testnet, futures, base_url, wss_url
+            )
+        else:
+            binance_client = BinanceClient(
+                api_key, secret_key, testnet, futures, base_url, wss_url
+            )
 
         if binance_client.validate_keys():
             if self.remember_var.get():
@@ -2,10 +2,17 @@ import tkinter as tk
 from tkinter.messagebox import askquestion
 import logging
 import json
-import threading
+import typing
 
 
+from models import *
 from connectors.binance import BinanceClient
+from scheduler import scheduler
+from retention import retention
+from snapshots import snapshots
+from journal import journal
+from candle_store import candle_store
+from latency import latencies
 
 from interface.styling import *
 from interface.logging_component import Logging
@@ -31,6 +38,8 @@ class Root(tk.Tk):
         self.configure(bg=BG_COLOR)
 
         self.binance = None
+        self._update_ui_job = None
+        self._fetching_prices = False
 
         self._set_scaling_factor(0.9)
 
@@ -48,7 +57,13 @@ class Root(tk.Tk):
         self.login_frame.pack_forget()
         self._initialize_main_interface()
         self._create_components()
-        self._update_ui()
+        self._update_ui_job = scheduler.call_every(
+            1.5, self._schedule_ui_update, delay=0
+        )
+        retention.start()
+        snapshots.start()
+        journal.start()
+        candle_store.start()
 
     def _initialize_main_interface(self):
         self.main_menu = tk.Menu(self)
@@ -63,6 +78,36 @@ class Root(tk.Tk):
             label="Load interface", command=self._load_workspace
         )
 
+        self.data_menu = tk.Menu(self.main_menu, tearoff=False)
+        self.main_menu.add_cascade(label="Data", menu=self.data_menu)
+        self._record_ticks = tk.BooleanVar(value=False)
+        self.data_menu.add_checkbutton(
+            label="Record ticks",
+            variable=self._record_ticks,
+            command=self._switch_tick_recording,
+        )
+
+        # Latency / throughput trade-off of the aggTrade updates, see BinanceClient.set_tick_batching()
+        self._tick_batching = tk.IntVar(value=0)
+        self.tick_batching_menu = tk.Menu(self.data_menu, tearoff=False)
+        self.data_menu.add_cascade(label="Tick batching", menu=self.tick_batching_menu)
+        for window_ms, label in [
+            (0, "Off (lowest latency)"),
+            (5, "5 ms"),
+            (20, "20 ms"),
+            (50, "50 ms (highest throughput)"),
+        ]:
+            self.tick_batching_menu.add_radiobutton(
+                label=label,
+                value=window_ms,
+                variable=self._tick_batching,
+                command=self._switch_tick_batching,
+            )
+
+        self.data_menu.add_command(
+            label="Latency report", command=self._show_latency_report
+        )
+
         self.paned_window = tk.PanedWindow(self, orient=tk.HORIZONTAL)
         self.paned_window.pack(fill=tk.BOTH, expand=1)
 
@@ -96,6 +141,32 @@ class Root(tk.Tk):
         self.left_pane.add(self.frames["strategy"])
         self.right_pane.add(self.frames["performance"])
 
+    def _switch_tick_recording(self):
+        if self._record_ticks.get():
+            self.binance.set_tick_recording("recordings")
+            self.logging_frame.add_log("Recording the ticks to the recordings folder")
+        else:
+            self.binance.set_tick_recording(None)
+            self.logging_frame.add_log("Tick recording stopped")
+
+    def _switch_tick_batching(self):
+        window_ms = self._tick_batching.get()
+        self.binance.set_tick_batching(window_ms)
+        if window_ms > 0:
+            self.logging_frame.add_log(f"Trades processed in batches of {window_ms} ms")
+        else:
+            self.logging_frame.add_log("Trades processed one by one")
+
+    def _show_latency_report(self):
+        for stage, histograms in latencies.summary("stage").items():
+            stats = histograms["all"]
+            if stats["count"] == 0:
+                continue
+            self.logging_frame.add_log(
+                f"{stage}: p50 {stats['p50_us']:.0f} us | p99 {stats['p99_us']:.0f} us | "
+                f"p999 {stats['p999_us']:.0f} us ({stats['count']} samples)"
+            )
+
     def _create_components(self):
         self._watchlist_frame = Watchlist(
             self.binance.contracts, self.binance, self.frames["watchlist"], bg=BG_COLOR
@@ -132,117 +203,127 @@ class Root(tk.Tk):
                     False  # Avoids the infinite reconnect loop in _start_ws()
                 )
                 self.binance.ws.close()
+                self.binance.set_tick_recording(None)  # Writes the ticks still buffered
+                self.binance.set_tick_batching(0)
+            if self._update_ui_job is not None:
+                self._update_ui_job.cancel()
+            retention.stop()
+            snapshots.stop()
+            snapshots.save_all()  # Resumed from there at the next start
+            journal.stop()  # Writes the events still queued
+            candle_store.stop()
+            candle_store.flush()
+            scheduler.stop()
             self.destroy()  # Destroys the UI and terminates the program as no other thread is running
 
+    def _schedule_ui_update(self):
+        # The widgets are only updated from the Tk thread
+        self.after(0, self._update_ui)
+
     def _update_ui(self):
-        def fetch_data():
-            if self.binance:
-                for log in self.binance.logs:
-                    if not log["displayed"]:
-                        self.logging_frame.add_log(log["log"])
-                        log["displayed"] = True
-
-                for client in [self.binance]:
-                    try:
-                        for b_index, strat in client.strategies.items():
-                            for log in strat.logs:
-                                if not log["displayed"]:
-                                    self.logging_frame.add_log(log["log"])
-                                    log["displayed"] = True
-
-                            for trade in strat.trades:
-                                if (
-                                    trade.time
-                                    not in self._trades_frame.body_widgets["symbol"]
-                                ):
-                                    self._trades_frame.add_trade(trade)
-
-                                precision = trade.contract.price_decimals
-                                pnl_str = "{0:.{prec}f}".format(
-                                    trade.pnl, prec=precision
-                                )
-                                self._trades_frame.body_widgets["pnl_var"][
-                                    trade.time
-                                ].set(pnl_str)
-                                self._trades_frame.body_widgets["status_var"][
-                                    trade.time
-                                ].set(trade.status.capitalize())
-                                self._trades_frame.body_widgets["quantity_var"][
-                                    trade.time
-                                ].set(trade.quantity)
-
-                    except RuntimeError as e:
-                        logger.error(
-                            "Error while looping through strategies dictionary: %s", e
-                        )
+        if self.binance:
+            for log in self.binance.logs:
+                if not log["displayed"]:
+                    self.logging_frame.add_log(log["log"])
+                    log["displayed"] = True
 
+            for client in [self.binance]:
                 try:
-                    for key, value in self._watchlist_frame.body_widgets[
-                        "Symbol"
-                    ].items():
-                        symbol = self._watchlist_frame.body_widgets["Symbol"][key].cget(
-                            "text"
-                        )
-                        exchange = self._watchlist_frame.body_widgets["Exchange"][
-                            key
-                        ].cget("text")
-
-                        if exchange == "Binance":
-                            if symbol not in self.binance.contracts:
-                                continue
+                    for b_index, strat in client.strategies.items():
+                        for log in strat.logs:
+                            if not log["displayed"]:
+                                self.logging_frame.add_log(log["log"])
+                                log["displayed"] = True
 
+                        for trade in strat.trades:
                             if (
-                                symbol
-                                not in self.binance.ws_subscriptions["bookTicker"]
-                                and self.binance.ws_connected
+                                trade.time
+                                not in self._trades_frame.body_widgets["symbol"]
                             ):
-                                self.binance.subscribe_channel(
-                                    [self.binance.contracts[symbol]], "bookTicker"
-                                )
+                                self._trades_frame.add_trade(trade)
 
-                            prices = self.binance.get_bid_ask(
-                                self.binance.contracts[symbol]
+                            precision = trade.contract.price_decimals
+                            pnl_str = "{0:.{prec}f}".format(trade.pnl, prec=precision)
+                            self._trades_frame.body_widgets["pnl_var"][trade.time].set(
+                                pnl_str
                             )
-                            precision = self.binance.contracts[symbol].price_decimals
-
-                            if prices:
-                                if "bid" in prices and prices["bid"] is not None:
-                                    price_str = "{0:.{prec}f}".format(
-                                        prices["bid"], prec=precision
-                                    )
-                                    self._watchlist_frame.body_widgets["Bid_var"][
-                                        key
-                                    ].set(price_str)
-                                if "ask" in prices and prices["ask"] is not None:
-                                    price_str = "{0:.{prec}f}".format(
-                                        prices["ask"], prec=precision
-                                    )
-                                    self._watchlist_frame.body_widgets["Ask_var"][
-                                        key
-                                    ].set(price_str)
-                                if "last" in prices and prices["last"] is not None:
-                                    last_price_str = "{0:.{prec}f}".format(
-                                        prices["last"], prec=precision
-                                    )
-                                    self._watchlist_frame.body_widgets[
-                                        "Last Price_var"
-                                    ][key].set(last_price_str)
-                                if "volume" in prices and prices["volume"] is not None:
-                                    volume_str = "{0:.{prec}f}".format(
-                                        prices["volume"], prec=precision
-                                    )
-                                    self._watchlist_frame.body_widgets["Volume_var"][
-                                        key
-                                    ].set(volume_str)
+                            self._trades_frame.body_widgets["status_var"][
+                                trade.time
+                            ].set(trade.status.capitalize())
+                            self._trades_frame.body_widgets["quantity_var"][
+                                trade.time
+                            ].set(trade.quantity)
 
                 except RuntimeError as e:
                     logger.error(
-                        "Error while looping through watchlist dictionary: %s", e
+                        "Error while looping through strategies dictionary: %s", e
                     )
 
-            self.after(1500, self._update_ui)
+            # The REST snapshots of the watchlist prices run on a worker thread, see _fetch_watchlist_prices()
+            watched = dict()
+            try:
+                for key, value in self._watchlist_frame.body_widgets["Symbol"].items():
+                    symbol = self._watchlist_frame.body_widgets["Symbol"][key].cget(
+                        "text"
+                    )
+                    exchange = self._watchlist_frame.body_widgets["Exchange"][key].cget(
+                        "text"
+                    )
 
-        threading.Thread(target=fetch_data).start()
+                    if exchange == "Binance":
+                        if symbol not in self.binance.contracts:
+                            continue
+
+                        if (
+                            symbol not in self.binance.ws_subscriptions["bookTicker"]
+                            and self.binance.ws_connected
+                        ):
+                            self.binance.subscribe_channel(
+                                [self.binance.contracts[symbol]], "bookTicker"
+                            )
+
+                        watched[key] = self.binance.contracts[symbol]
+
+            except RuntimeError as e:
+                logger.error("Error while looping through watchlist dictionary: %s", e)
+
+            if watched and not self._fetching_prices:
+                self._fetching_prices = True
+                scheduler.call_later(
+                    0, self._fetch_watchlist_prices, watched, blocking=True
+                )
+
+    def _fetch_watchlist_prices(self, watched: typing.Dict[int, Contract]):
+        prices = dict()
+        try:
+            for key, contract in watched.items():
+                prices[key] = (contract, self.binance.get_bid_ask(contract))
+        finally:
+            self.after(0, self._show_watchlist_prices, prices)
+
+    def _show_watchlist_prices(
+        self, prices: typing.Dict[int, typing.Tuple[Contract, typing.Dict[str, float]]]
+    ):
+        self._fetching_prices = False
+
+        for key, (contract, contract_prices) in prices.items():
+            # The row may have been removed during the requests
+            if key not in self._watchlist_frame.body_widgets["Symbol"]:
+                continue
+
+            precision = contract.price_decimals
+
+            for price_key, widget in [
+                ("bid", "Bid_var"),
+                ("ask", "Ask_var"),
+                ("last", "Last Price_var"),
+                ("volume", "Volume_var"),
+            ]:
+                if contract_prices.get(price_key) is not None:
+                    price_str = "{0:.{prec}f}".format(
+                        contract_prices[price_key], prec=precision
+                    )
+                    self._watchlist_frame.body_widgets[widget][key].set(price_str)
 
     def _save_workspace(self):
         layout = {
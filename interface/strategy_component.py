@@ -2,6 +2,10 @@ import tkinter as tk
 import typing
 
 import json
+import queue
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
 
 from interface.styling import *
 from interface.scrollable_frame import ScrollableFrame
@@ -9,14 +13,17 @@ from interface.scrollable_frame import ScrollableFrame
 from connectors.binance import BinanceClient
 
 from strategies import (
+    Strategy,
     TechnicalStrategy,
     BreakoutStrategy,
     FractalStrategy,
     DummyStrategy,
+    RuleStrategy,
 )
 from utils import *
 
 from database import WorkspaceData
+from snapshots import snapshots
 
 
 if typing.TYPE_CHECKING:
@@ -62,6 +69,39 @@ class StrategyEditor(tk.Frame):
         )
         self._add_button.pack(side=tk.LEFT, padx=5)
 
+        self._activate_all_button = tk.Button(
+            self._commands_frame,
+            text="Activate all",
+            font=("Arial", 12, "bold"),
+            command=lambda: self._activate_strategies(list(self._strategy_frames)),
+            bg="#2196F3",
+            fg="white",
+        )
+        self._activate_all_button.pack(side=tk.LEFT, padx=5)
+
+        self._activate_selected_button = tk.Button(
+            self._commands_frame,
+            text="Activate selected",
+            font=("Arial", 12, "bold"),
+            command=lambda: self._activate_strategies(
+                [b_index for b_index, var in self._selected.items() if var.get()]
+            ),
+            bg="#2196F3",
+            fg="white",
+        )
+        self._activate_selected_button.pack(side=tk.LEFT, padx=5)
+
+        self._activation_label = tk.Label(
+            self._commands_frame, text="", bg=BG_COLOR, fg="white", font=BOLD_FONT
+        )
+        self._activation_label.pack(side=tk.LEFT, padx=5)
+
+        # Bulk activation in progress, see _activate_strategies()
+        self._activation_executor: typing.Optional[ThreadPoolExecutor] = None
+        self._activation_results = queue.Queue()  # (b_index, strategy, download Future)
+        self._activation_total = 0
+        self._activation_done = 0
+
         # Create a canvas for the scrollable frame
         self._canvas = tk.Canvas(self, bg=BG_COLOR)
         self._canvas.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
@@ -83,13 +123,16 @@ class StrategyEditor(tk.Frame):
         self.additional_parameters = dict()
         self._extra_input = dict()
         self._strategy_frames = dict()
+        self._selected: typing.Dict[int, tk.BooleanVar] = dict()
+        # Key of each row in the database
+        self._strategy_ids: typing.Dict[int, str] = dict()
 
         self._base_params = [
             {
                 "code_name": "strategy_type",
                 "widget": tk.OptionMenu,
                 "data_type": str,
-                "values": ["Technical", "Breakout", "Fractals", "Dummy"],
+                "values": ["Technical", "Breakout", "Fractals", "Dummy", "Rules"],
                 "width": 20,
                 "header": "Strategy",
             },
@@ -228,6 +271,26 @@ class StrategyEditor(tk.Frame):
                     "data_type": float,
                 },
             ],  # No extra parameters for the Dummy strategy
+            "Rules": [
+                {
+                    "code_name": "buy_rule",
+                    "name": "Buy Rule",
+                    "widget": tk.Entry,
+                    "data_type": str,
+                },
+                {
+                    "code_name": "sell_rule",
+                    "name": "Sell Rule",
+                    "widget": tk.Entry,
+                    "data_type": str,
+                },
+                {
+                    "code_name": "balance_pct",
+                    "name": "Balance Pct",
+                    "widget": tk.Entry,
+                    "data_type": float,
+                },
+            ],
         }
 
         for h in self._base_params:
@@ -320,6 +383,18 @@ class StrategyEditor(tk.Frame):
                 row=idx, column=1, padx=5, pady=5
             )
 
+        self._selected[b_index] = tk.BooleanVar()
+        tk.Checkbutton(
+            strategy_frame,
+            text="Select",
+            variable=self._selected[b_index],
+            bg=BG_COLOR,
+            fg="white",
+            selectcolor=BG_COLOR_2,
+            activebackground=BG_COLOR,
+        ).grid(row=len(self._base_params), column=1, padx=5, pady=5)
+
+        self._strategy_ids[b_index] = uuid.uuid4().hex
         self.additional_parameters[b_index] = dict()
 
         for strat, params in self.extra_params.items():
@@ -332,6 +407,23 @@ class StrategyEditor(tk.Frame):
         if b_index in self._strategy_frames:
             self._strategy_frames[b_index].destroy()
             del self._strategy_frames[b_index]
+            del self._selected[b_index]
+            self.db.delete_strategy(self._strategy_ids.pop(b_index))
+
+    def _save_row(self, b_index: int):
+        """
+        Record the current content of a row to the database, only this row is written.
+        :param b_index:
+        :return:
+        """
+
+        self.db.save_strategy(
+            self._strategy_ids[b_index],
+            self.body_widgets["strategy_type_var"][b_index].get(),
+            self.body_widgets["contract_var"][b_index].get(),
+            self.body_widgets["timeframe_var"][b_index].get(),
+            self.additional_parameters[b_index],
+        )
 
     def _show_popup(self, b_index: int):
         x = self.body_widgets["parameters"][b_index].winfo_rootx()
@@ -405,20 +497,51 @@ class StrategyEditor(tk.Frame):
 
     def _validate_parameters(self, b_index: int):
         strat_selected = self.body_widgets["strategy_type_var"][b_index].get()
+        new_params = dict(self.additional_parameters[b_index])
 
         for param in self.extra_params[strat_selected]:
             code_name = param["code_name"]
 
             if self._extra_input[b_index][code_name].get() == "":
-                self.additional_parameters[b_index][code_name] = None
+                new_params[code_name] = None
             else:
-                self.additional_parameters[b_index][code_name] = param["data_type"](
+                new_params[code_name] = param["data_type"](
                     self._extra_input[b_index][code_name].get()
                 )
 
+        exchange = self.body_widgets["contract_var"][b_index].get().split("_")[1]
+        strategy = self._exchanges[exchange].strategies.get(b_index)
+
+        # Running strategy: updated in place, its candles and trades are kept
+        if strategy is not None:
+            for param in self.extra_params[strat_selected]:
+                if new_params[param["code_name"]] is None:
+                    self.root.logging_frame.add_log(
+                        f"Missing {param['code_name']} parameter"
+                    )
+                    return
+
+            try:
+                strategy.update_params(new_params)
+            except ValueError as e:
+                self.root.logging_frame.add_log(f"Invalid parameters: {e}")
+                return
+
+            self.root.logging_frame.add_log(
+                f"{strat_selected} strategy on {strategy.contract.symbol} / {strategy.tf} updated"
+            )
+
+        self.additional_parameters[b_index] = new_params
+        self._save_row(b_index)
         self._popup_window.destroy()
 
-    def _switch_strategy(self, b_index: int):
+    def _create_strategy(self, b_index: int) -> typing.Optional[Strategy]:
+        """
+        Create the strategy of a row from its parameters, without its candles yet.
+        :param b_index:
+        :return: None if the parameters are incomplete or invalid
+        """
+
         strat_selected = self.body_widgets["strategy_type_var"][b_index].get()
 
         for param in self.extra_params[strat_selected]:
@@ -426,7 +549,7 @@ class StrategyEditor(tk.Frame):
                 self.root.logging_frame.add_log(
                     f"Missing {param['code_name']} parameter"
                 )
-                return
+                return None
 
         symbol = self.body_widgets["contract_var"][b_index].get().split("_")[0]
         timeframe = self.body_widgets["timeframe_var"][b_index].get()
@@ -434,74 +557,203 @@ class StrategyEditor(tk.Frame):
 
         contract = self._exchanges[exchange].contracts[symbol]
 
-        if self.body_widgets["activation"][b_index].cget("text") == "DEACTIVATED":
+        strategy_classes = {
+            "Technical": TechnicalStrategy,
+            "Breakout": BreakoutStrategy,
+            "Fractals": FractalStrategy,
+            "Dummy": DummyStrategy,
+            "Rules": RuleStrategy,
+        }
 
-            if strat_selected == "Technical":
-                new_strategy = TechnicalStrategy(
-                    self._exchanges[exchange],
-                    contract,
-                    exchange,
-                    timeframe,
-                    self.additional_parameters[b_index],
-                )
-            elif strat_selected == "Breakout":
-                new_strategy = BreakoutStrategy(
-                    self._exchanges[exchange],
-                    contract,
-                    exchange,
-                    timeframe,
-                    self.additional_parameters[b_index],
-                )
-            elif strat_selected == "Fractals":
-                new_strategy = FractalStrategy(
-                    self._exchanges[exchange],
-                    contract,
-                    exchange,
-                    timeframe,
-                    self.additional_parameters[b_index],
-                )
-            elif strat_selected == "Dummy":
-                new_strategy = DummyStrategy(
-                    self._exchanges[exchange],
-                    contract,
-                    exchange,
-                    timeframe,
-                    self.additional_parameters[b_index],
-                )
-            else:
-                return
+        if strat_selected not in strategy_classes:
+            return None
 
-            new_strategy.candles = self._exchanges[exchange].get_historical_candles(
-                contract, timeframe
+        try:
+            strategy = strategy_classes[strat_selected](
+                self._exchanges[exchange],
+                contract,
+                exchange,
+                timeframe,
+                self.additional_parameters[b_index],
+            )
+        except ValueError as e:
+            self.root.logging_frame.add_log(f"Invalid parameters: {e}")
+            return None
+
+        strategy.set_strategy_id(self._strategy_ids[b_index])
+        return strategy
+
+    @staticmethod
+    def _load_history(strategy: Strategy) -> bool:
+        """
+        Download the candles of a new strategy, can run outside of the Tkinter thread.
+        :param strategy:
+        :return: False if no candle could be retrieved
+        """
+
+        client = strategy.client
+
+        # Warm restart: resume from the last snapshot and only download the candles since then
+        if snapshots.load(strategy):
+            strategy.candles = client.backfill_candles(
+                strategy.contract, strategy.tf, strategy.candles
             )
+        else:
+            # Candle store: only the candles since the last run are downloaded
+            strategy.candles = client.load_candles(strategy.contract, strategy.tf)
 
-            if len(new_strategy.candles) == 0:
-                self.root.logging_frame.add_log(
-                    f"No historical data retrieved for {contract.symbol}"
-                )
-                return
+        return len(strategy.candles) > 0
 
-            if exchange == "Binance":
-                self._exchanges[exchange].subscribe_channel([contract], "aggTrade")
-                self._exchanges[exchange].subscribe_channel([contract], "bookTicker")
+    def _start_strategy(self, b_index: int, strategy: Strategy):
+        """
+        Make a strategy whose candles are loaded trade, the market data subscriptions are left to the caller.
+        :param b_index:
+        :param strategy:
+        :return:
+        """
 
-            self._exchanges[exchange].strategies[b_index] = new_strategy
+        self._exchanges[strategy.exchange].strategies[b_index] = strategy
+        strategy.start_candle_timer()
+        snapshots.register(strategy)
+        self._save_row(b_index)
 
-            for param in self._base_params:
-                code_name = param["code_name"]
+        for param in self._base_params:
+            code_name = param["code_name"]
 
-                if code_name != "activation" and "_var" not in code_name:
-                    self.body_widgets[code_name][b_index].config(state=tk.DISABLED)
+            if (
+                code_name not in ["activation", "parameters"]
+                and "_var" not in code_name
+            ):
+                self.body_widgets[code_name][b_index].config(state=tk.DISABLED)
 
-            self.body_widgets["activation"][b_index].config(
-                bg="green", text="ACTIVATED"
+        self.body_widgets["activation"][b_index].config(bg="green", text="ACTIVATED")
+        self.root.logging_frame.add_log(
+            f"{strategy.strat_name} strategy on {strategy.contract.symbol} / {strategy.tf} started"
+        )
+
+    def _subscribe(self, strategies: typing.List[Strategy]):
+        # One subscription message per exchange and channel
+        for exchange, client in self._exchanges.items():
+            contracts = list(
+                {
+                    s.contract.symbol: s.contract
+                    for s in strategies
+                    if s.exchange == exchange
+                }.values()
             )
-            self.root.logging_frame.add_log(
-                f"{strat_selected} strategy on {symbol} / {timeframe} started"
+            if exchange == "Binance" and len(contracts) > 0:
+                client.subscribe_channel(contracts, "aggTrade")
+                client.subscribe_channel(contracts, "bookTicker")
+
+    def _activate_strategies(self, b_indexes: typing.List[int]):
+        """
+        Activate several strategies at once without freezing the interface: their candles are downloaded
+        concurrently (the client keeps the requests within the exchange weight limit), and the strategies are
+        started and subscribed to the market data in batches as their downloads complete.
+        :param b_indexes: The rows to activate, the ones already activated are skipped
+        :return:
+        """
+
+        if self._activation_executor is not None:
+            self.root.logging_frame.add_log("Strategies are already being activated")
+            return
+
+        pending = dict()
+
+        for b_index in b_indexes:
+            if self.body_widgets["activation"][b_index].cget("text") != "DEACTIVATED":
+                continue
+            strategy = self._create_strategy(b_index)
+            if strategy is not None:
+                pending[b_index] = strategy
+
+        if len(pending) == 0:
+            return
+
+        self._activation_executor = ThreadPoolExecutor(
+            max_workers=8, thread_name_prefix="history"
+        )
+        self._activation_total = len(pending)
+        self._activation_done = 0
+
+        for b_index, strategy in pending.items():
+            future = self._activation_executor.submit(self._load_history, strategy)
+            future.add_done_callback(
+                lambda f, b=b_index, s=strategy: self._activation_results.put((b, s, f))
             )
 
+        self._activation_label.config(text=f"Activating 0/{self._activation_total}")
+        self.after(100, self._poll_activations)
+
+    def _poll_activations(self):
+        started = []
+
+        while True:
+            try:
+                b_index, strategy, future = self._activation_results.get_nowait()
+            except queue.Empty:
+                break
+
+            self._activation_done += 1
+
+            if future.exception() is not None or not future.result():
+                self.root.logging_frame.add_log(
+                    f"No historical data retrieved for {strategy.contract.symbol}"
+                )
+                continue
+
+            # The row may have been deleted or activated by hand during the download
+            if (
+                b_index not in self._strategy_frames
+                or self.body_widgets["activation"][b_index].cget("text")
+                != "DEACTIVATED"
+            ):
+                continue
+
+            self._start_strategy(b_index, strategy)
+            started.append(strategy)
+
+        self._subscribe(started)
+
+        if self._activation_done < self._activation_total:
+            self._activation_label.config(
+                text=f"Activating {self._activation_done}/{self._activation_total}"
+            )
+            self.after(100, self._poll_activations)
+            return
+
+        self._activation_executor.shutdown(wait=False)
+        self._activation_executor = None
+        self._activation_label.config(text="")
+
+    def _switch_strategy(self, b_index: int):
+        strat_selected = self.body_widgets["strategy_type_var"][b_index].get()
+        symbol = self.body_widgets["contract_var"][b_index].get().split("_")[0]
+        timeframe = self.body_widgets["timeframe_var"][b_index].get()
+        exchange = self.body_widgets["contract_var"][b_index].get().split("_")[1]
+
+        if self.body_widgets["activation"][b_index].cget("text") == "DEACTIVATED":
+
+            new_strategy = self._create_strategy(b_index)
+            if new_strategy is None:
+                return
+
+            if not self._load_history(new_strategy):
+                self.root.logging_frame.add_log(
+                    f"No historical data retrieved for {symbol}"
+                )
+                return
+
+            self._subscribe([new_strategy])
+            self._start_strategy(b_index, new_strategy)
+
         else:
             if b_index in self._exchanges[exchange].strategies:
+                strategy = self._exchanges[exchange].strategies[b_index]
+                strategy.stop_candle_timer()
+                snapshots.unregister(strategy)
+                if self._exchanges[exchange].evaluator is not None:
+                    self._exchanges[exchange].evaluator.remove(strategy)
                 del self._exchanges[exchange].strategies[b_index]
 
             for param in self._base_params:
@@ -524,6 +776,7 @@ class StrategyEditor(tk.Frame):
             self._add_strategy_row()
 
             b_index = self._body_index - 1
+            self._strategy_ids[b_index] = row["strategy_id"]
 
             for base_param in self._base_params:
                 code_name = base_param["code_name"]
@@ -120,6 +120,11 @@ class Watchlist(tk.Frame):
             self._add_symbol(s["symbol"], s["exchange"])
 
     def _remove_symbol(self, b_index: int):
+        self.db.remove_watchlist_symbol(
+            self.body_widgets["Symbol"][b_index].cget("text"),
+            self.body_widgets["Exchange"][b_index].cget("text"),
+        )
+
         for h in self._headers:
             self.body_widgets[h][b_index].grid_forget()
             del self.body_widgets[h][b_index]
@@ -128,6 +133,7 @@ class Watchlist(tk.Frame):
         symbol = event.widget.get()
         if symbol in self.binance_symbols:
             self._add_symbol(symbol, "Binance")
+            self.db.add_watchlist_symbol(symbol, "Binance")
             event.widget.delete(0, tk.END)
 
     def _add_symbol(self, symbol: str, exchange: str):
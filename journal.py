@@ -0,0 +1,287 @@
+import logging
+import typing
+import time
+import queue
+import sqlite3
+import threading
+
+from models import *
+from database import get_database
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+EVENTS = ("open", "fill", "pnl", "close")
+
+COLUMNS = (
+    "ts",
+    "event",
+    "strategy",
+    "exchange",
+    "symbol",
+    "timeframe",
+    "trade_time",
+    "entry_id",
+    "side",
+    "entry_price",
+    "quantity",
+    "status",
+    "pnl",
+)
+
+
+class TradeJournal:
+    def __init__(
+        self,
+        path: str = "database.db",
+        batch_size: int = 500,
+        flush_interval_s: float = 1.0,
+        max_queue: int = 100_000,
+        pnl_interval_s: float = 5.0,
+    ):
+        """
+        Every trade event (open, fill, pnl update, close) appended to the trade_journal table.
+        record() only copies the trade into a bounded queue, a background thread writes the queue in batches,
+        one transaction per batch, when batch_size events are waiting or flush_interval_s after the first one.
+        When the queue is full the events are dropped rather than blocking the websocket thread, and counted in
+        stats() with a warning in the logs.
+        :param path: SQLite database, the one of the workspace by default
+        :param batch_size: Maximum number of events per transaction
+        :param flush_interval_s: Maximum time an event waits before being written
+        :param max_queue: Maximum number of events waiting to be written
+        :param pnl_interval_s: Minimum time between two pnl events of a trade, the pnl changes at every bookTicker
+        """
+
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.pnl_interval_s = pnl_interval_s
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: typing.Optional[threading.Thread] = None
+        self._running = False
+
+        # id of the trade -> time.monotonic() of its last pnl event
+        self._last_pnl: typing.Dict[int, float] = dict()
+
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.max_batch_s = 0.0
+        self._last_drop_warning = 0.0
+
+    def _create_table(self):
+        with get_database(self.path).transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS trade_journal (id INTEGER PRIMARY KEY, ts INTEGER, event TEXT, "
+                "strategy TEXT, exchange TEXT, symbol TEXT, timeframe TEXT, trade_time INTEGER, entry_id TEXT, "
+                "side TEXT, entry_price REAL, quantity REAL, status TEXT, pnl REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS trade_journal_ts ON trade_journal (ts)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS trade_journal_symbol ON trade_journal (symbol, ts)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS trade_journal_strategy ON trade_journal (strategy, ts)"
+            )
+
+    def start(self):
+        if self._running:
+            return
+
+        self._create_table()
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="trade_journal", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write the events still in the queue and stop the writer thread.
+        :return:
+        """
+
+        if not self._running:
+            return
+
+        self._running = False
+        self._thread.join()
+        self._thread = None
+
+    def record(self, event: str, strategy: "Strategy", trade: Trade) -> bool:
+        """
+        Queue a trade event, never blocks. The trade is copied, its later changes don't affect the event.
+        :param event: One of EVENTS
+        :param strategy: The strategy owning the trade
+        :param trade:
+        :return: False if the event was dropped because the queue is full
+        """
+
+        if event == "pnl":
+            now = time.monotonic()
+            if now - self._last_pnl.get(id(trade), 0) < self.pnl_interval_s:
+                return True
+            self._last_pnl[id(trade)] = now
+        elif event == "close":
+            self._last_pnl.pop(id(trade), None)
+
+        row = (
+            int(time.time() * 1000),
+            event,
+            strategy.strat_name,
+            strategy.exchange,
+            trade.contract.symbol,
+            strategy.tf,
+            trade.time,
+            str(trade.entry_id),
+            trade.side,
+            trade.entry_price,
+            trade.quantity,
+            trade.status,
+            trade.pnl,
+        )
+
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            if time.monotonic() - self._last_drop_warning > 10:
+                self._last_drop_warning = time.monotonic()
+                logger.warning(
+                    "Trade journal queue full, %s events dropped so far", self.dropped
+                )
+            return False
+
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+        return True
+
+    def flush(self, timeout: typing.Optional[float] = None):
+        """
+        Wait until the events queued so far are written.
+        :param timeout: Seconds, None to wait as long as needed
+        :return:
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return
+                self._queue.all_tasks_done.wait(remaining)
+
+    def _next_batch(self) -> typing.List[typing.Tuple]:
+        batch = []
+
+        try:
+            batch.append(self._queue.get(timeout=0.2))
+        except queue.Empty:
+            return batch
+
+        deadline = time.monotonic() + self.flush_interval_s
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0 and self._running:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while self._running or not self._queue.empty():
+            batch = self._next_batch()
+            if len(batch) == 0:
+                continue
+
+            start = time.perf_counter()
+            try:
+                with get_database(self.path).transaction() as conn:
+                    conn.executemany(
+                        f"INSERT INTO trade_journal ({', '.join(COLUMNS)}) "
+                        f"VALUES ({', '.join(['?'] * len(COLUMNS))})",
+                        batch,
+                    )
+                self.written += len(batch)
+                self.batches += 1
+            except sqlite3.Error as e:
+                logger.error(
+                    "Error while writing %s trade journal events: %s", len(batch), e
+                )
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+            self.max_batch_s = max(self.max_batch_s, time.perf_counter() - start)
+
+    def query(
+        self,
+        start_ms: typing.Optional[int] = None,
+        end_ms: typing.Optional[int] = None,
+        symbol: typing.Optional[str] = None,
+        strategy: typing.Optional[str] = None,
+        event: typing.Optional[str] = None,
+        limit: typing.Optional[int] = None,
+    ) -> typing.List[sqlite3.Row]:
+        """
+        Journal events in chronological order, each filter is optional.
+        :param start_ms: Included
+        :param end_ms: Excluded
+        :param symbol: e.g. BTCUSDT
+        :param strategy: e.g. Technical
+        :param event: One of EVENTS
+        :param limit: Maximum number of rows
+        :return: sqlite3.Rows accessible like Python dictionaries
+        """
+
+        conditions = []
+        values = []
+
+        for sql, value in (
+            ("ts >= ?", start_ms),
+            ("ts < ?", end_ms),
+            ("symbol = ?", symbol),
+            ("strategy = ?", strategy),
+            ("event = ?", event),
+        ):
+            if value is not None:
+                conditions.append(sql)
+                values.append(value)
+
+        sql = "SELECT * FROM trade_journal"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY ts, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            values.append(limit)
+
+        self._create_table()
+
+        return get_database(self.path).connection().execute(sql, values).fetchall()
+
+    def stats(self) -> typing.Dict[str, float]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "max_batch_ms": self.max_batch_s * 1000,
+        }
+
+
+journal = TradeJournal()
@@ -0,0 +1,193 @@
+import logging
+import typing
+import threading
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# Measured per symbol, before the strategies
+SYMBOL_STAGES = ("exchange_to_receive",)
+
+# Measured per strategy
+STRATEGY_STAGES = (
+    "receive_to_dispatch",
+    "dispatch_to_candle",
+    "close_to_signal",
+    "signal_to_sent",
+    "sent_to_ack",
+)
+
+STAGES = SYMBOL_STAGES + STRATEGY_STAGES
+
+# Log-linear buckets: exact below 2 ** SUB_BITS nanoseconds, then 2 ** (SUB_BITS - 1) buckets per power of 2,
+# a relative error below 1.6%. The last bucket holds everything above 2 ** MAX_BITS ns (about 78 hours).
+SUB_BITS = 7
+HALF_BITS = SUB_BITS - 1
+MAX_BITS = 48
+LENGTH = ((MAX_BITS - SUB_BITS + 1) << HALF_BITS) + (1 << HALF_BITS)
+_LINEAR = 1 << SUB_BITS
+
+
+def bucket_bounds() -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: The lowest and the highest value in nanoseconds of each bucket
+    """
+
+    index = np.arange(LENGTH, dtype=np.int64)
+    shift = np.maximum((index >> HALF_BITS) - 1, 0)
+    lowest = np.where(index < _LINEAR, index, (index - (shift << HALF_BITS)) << shift)
+    highest = np.where(index < _LINEAR, index, lowest + (1 << shift) - 1)
+    return lowest, highest
+
+
+class LatencyHistogram:
+    __slots__ = ("counts",)
+
+    def __init__(self):
+        """
+        HDR-style histogram of durations in nanoseconds, a fixed array of counters. record() takes no lock: the
+        samples of a histogram come from one thread at a time (the websocket thread, or the thread evaluating the
+        strategy), and under the GIL a concurrent record() can at worst lose a count, never corrupt the histogram.
+        The readers work on a copy of the counters. The max is the highest value of the last bucket used.
+        """
+
+        self.counts = [0] * LENGTH
+
+    def record(self, value_ns: int):
+        if value_ns >= _LINEAR:
+            shift = value_ns.bit_length() - SUB_BITS
+            index = (shift << HALF_BITS) + (value_ns >> shift)
+            if index >= LENGTH:
+                index = LENGTH - 1
+        elif value_ns > 0:
+            index = value_ns
+        else:
+            index = 0
+
+        self.counts[index] += 1
+
+    def merge(self, other: "LatencyHistogram"):
+        self.counts = np.add(self.counts, other.counts).tolist()
+
+    def summary(
+        self, percentiles: typing.Iterable[float] = (50, 99, 99.9)
+    ) -> typing.Dict[str, float]:
+        """
+        :param percentiles:
+        :return: count, mean and max, and the requested percentiles (p50, p99, p999...) in microseconds
+        """
+
+        counts = np.array(self.counts, dtype=np.int64)
+        total = int(counts.sum())
+        result = {"count": total}
+
+        if total == 0:
+            return result
+
+        lowest, highest = bucket_bounds()
+        middle = (lowest + highest) / 2
+        cumulative = np.cumsum(counts)
+
+        result["mean_us"] = float((counts * middle).sum() / total / 1000)
+        for q in percentiles:
+            rank = max(int(np.ceil(q / 100 * total)), 1)
+            index = int(np.searchsorted(cumulative, rank))
+            name = "p" + f"{q:g}".replace(".", "")
+            result[name + "_us"] = float(highest[index] / 1000)
+        result["max_us"] = float(highest[np.flatnonzero(counts)[-1]] / 1000)
+
+        return result
+
+
+class LatencyRegistry:
+    def __init__(self):
+        """
+        The histograms of the hot path stages, keyed by (stage, symbol, strategy), strategy being "" for the
+        stages measured per symbol:
+        - exchange_to_receive: event time of the message (exchange clock) to its reception by _on_message,
+          millisecond resolution, includes the clock offset error
+        - receive_to_dispatch: reception to the call of parse_trades() of the strategy
+        - dispatch_to_candle: parse_trades() of the strategy, the candle and TP/SL update
+        - close_to_signal: candle close (by a trade or the timer) to the result of the signal check, including
+          the wait for the batch evaluator or the worker processes
+        - signal_to_sent: signal to the order sent, the trade size computation and the order thread pool
+        - sent_to_ack: order sent to the response of the exchange (entries and exits)
+        """
+
+        self._histograms: typing.Dict[typing.Tuple[str, str, str], LatencyHistogram] = (
+            dict()
+        )
+        self._lock = threading.Lock()
+
+    def histogram(
+        self, stage: str, symbol: str, strategy: str = ""
+    ) -> LatencyHistogram:
+        """
+        Created on first use. The hot path keeps the histogram instead of calling this for every sample.
+        :param stage: See STAGES
+        :param symbol:
+        :param strategy: e.g. "Technical 1m <strategy id>", "" for the stages measured per symbol. A histogram
+        has a single strategy, whose thread is its only writer
+        :return:
+        """
+
+        key = (stage, symbol, strategy)
+        histogram = self._histograms.get(key)
+
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+
+        return histogram
+
+    def summary(
+        self,
+        by: str = "strategy",
+        stage: typing.Optional[str] = None,
+        symbol: typing.Optional[str] = None,
+    ) -> typing.Dict[str, typing.Dict[str, typing.Dict[str, float]]]:
+        """
+        Percentiles of the samples recorded so far, e.g. summary("symbol")["close_to_signal"]["BTCUSDT"]["p99_us"]
+        :param by: "strategy" (keys "BTCUSDT Technical 1m <strategy id>"), "symbol" (the strategies of a symbol
+        merged) or "stage" (everything merged, key "all")
+        :param stage: Only this stage
+        :param symbol: Only this symbol
+        :return: stage -> key -> see LatencyHistogram.summary()
+        """
+
+        with self._lock:
+            items = list(self._histograms.items())
+
+        merged: typing.Dict[typing.Tuple[str, str], LatencyHistogram] = dict()
+
+        for (h_stage, h_symbol, h_strategy), histogram in items:
+            if stage is not None and h_stage != stage:
+                continue
+            if symbol is not None and h_symbol != symbol:
+                continue
+
+            if by == "strategy":
+                key = f"{h_symbol} {h_strategy}".strip()
+            elif by == "symbol":
+                key = h_symbol
+            else:
+                key = "all"
+
+            if (h_stage, key) not in merged:
+                merged[(h_stage, key)] = LatencyHistogram()
+            merged[(h_stage, key)].merge(histogram)
+
+        result: typing.Dict[str, typing.Dict[str, typing.Dict[str, float]]] = dict()
+        for (h_stage, key), histogram in sorted(merged.items()):
+            result.setdefault(h_stage, dict())[key] = histogram.summary()
+
+        return result
+
+    def reset(self):
+        with self._lock:
+            for histogram in self._histograms.values():
+                histogram.counts = [0] * LENGTH
+
+
+latencies = LatencyRegistry()
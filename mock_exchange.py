@@ -0,0 +1,620 @@
+"""
+Local stand-in for the Binance REST API and market data websocket, for offline integration and load tests.
+Run from the repository root: python mock_exchange.py --help
+Then point the client to it: BinanceClient(..., base_url="http://127.0.0.1:8900", wss_url="ws://127.0.0.1:8900/ws")
+or, for the interface, the BINANCE_BASE_URL and BINANCE_WSS_URL environment variables.
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import math
+import random
+import threading
+import time
+import typing
+import zlib
+
+from aiohttp import web, WSMsgType
+
+from candle_store import INTERVAL_MS
+
+logger = logging.getLogger()
+
+KLINES_WEIGHT = {True: 5, False: 2}  # Futures, Spot
+POSITION_RISK_WEIGHT = 5
+
+
+class MockExchange:
+    def __init__(
+        self,
+        symbols: typing.Optional[typing.List[str]] = None,
+        futures: bool = True,
+        trade_rate: float = 10,
+        book_rate: float = 10,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        error_rate: float = 0,
+        error_status: int = 500,
+        ws_latency_ms: float = 0,
+        balance: float = 10000,
+        seed: int = 0,
+    ):
+        """
+        The prices follow a deterministic function of the time per symbol, so that the klines and the streamed
+        trades agree, with random noise on the trades. The market orders are filled immediately at the top of
+        book, the other orders stay open until they are cancelled. On Futures the filled orders make a net
+        position per symbol, served by positionRisk: the reduce only orders are rejected without a position to
+        reduce, and capped at its size. The signatures are not checked.
+        :param symbols: Symbols listed by exchangeInfo, BTCUSDT is always added (the client subscribes to it)
+        :param futures: Answer the /fapi endpoints with the Futures formats, else the /api endpoints with the Spot ones
+        :param trade_rate: aggTrade messages per second per subscribed symbol
+        :param book_rate: bookTicker messages per second per subscribed symbol
+        :param latency_ms: Delay added to every REST response
+        :param jitter_ms: Random delay added on top of latency_ms, uniform between 0 and jitter_ms
+        :param error_rate: Share of the REST requests answered with error_status instead of their response
+        :param error_status: e.g. 500, 429 or 418
+        :param ws_latency_ms: Delay between the event time of a websocket message and its sending
+        :param balance: Quote asset balance of the account
+        :param seed:
+        """
+
+        symbols = list(symbols or ["BTCUSDT", "ETHUSDT", "BNBUSDT"])
+        if "BTCUSDT" not in symbols:
+            symbols.insert(0, "BTCUSDT")
+
+        self.symbols = symbols
+        self.futures = futures
+        self.trade_rate = trade_rate
+        self.book_rate = book_rate
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.ws_latency_ms = ws_latency_ms
+
+        self._random = random.Random(seed)
+
+        self.balances = {"USDT": balance}
+        self.orders: typing.Dict[int, typing.Dict] = dict()
+        self.my_trades: typing.List[typing.Dict] = []
+        self._trade_id = 0
+        self.positions: typing.Dict[str, float] = (
+            dict()
+        )  # Futures, negative for a short
+
+        self._weights: typing.Deque[typing.Tuple[float, int]] = collections.deque()
+        self._used_weight = 0
+
+        self.requests = 0
+        self.errors = 0
+        self.messages_sent = 0
+
+        self._runner: typing.Optional[web.AppRunner] = None
+        self._loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self._thread: typing.Optional[threading.Thread] = None
+
+    # Market
+
+    def _base_price(self, symbol: str) -> float:
+        return 10 + zlib.crc32(symbol.encode()) % 50000
+
+    def fair_price(self, symbol: str, ts: float) -> float:
+        """
+        :param symbol:
+        :param ts: Time in milliseconds
+        :return:
+        """
+
+        phase = zlib.crc32(symbol.encode()) % 1000
+        hours = ts / 3_600_000
+        return self._base_price(symbol) * (
+            1
+            + 0.02 * math.sin(hours / 5 + phase)
+            + 0.005 * math.sin(hours * 3 + phase)
+            + 0.001 * math.sin(hours * 60 + phase)
+        )
+
+    @staticmethod
+    def _noise(symbol: str, ts: int) -> float:
+        # Deterministic value between 0 and 1 for a candle
+        return (
+            math.sin(ts / 1000 * 12.9898 + zlib.crc32(symbol.encode())) * 43758.5453
+        ) % 1
+
+    def _book(self, symbol: str, ts: float) -> typing.Tuple[float, float]:
+        price = self.fair_price(symbol, ts)
+        half_spread = price * 0.00005
+        return price - half_spread, price + half_spread
+
+    def _price_decimals(self, symbol: str) -> int:
+        return 2 if self._base_price(symbol) > 100 else 4
+
+    def _format_price(self, symbol: str, price: float) -> str:
+        return f"{price:.{self._price_decimals(symbol)}f}"
+
+    # REST
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler):
+        self.requests += 1
+
+        delay = self.latency_ms + self._random.random() * self.jitter_ms
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        weight = 1
+        if request.path.endswith("/klines"):
+            weight = KLINES_WEIGHT[self.futures]
+        elif request.path.endswith("/positionRisk"):
+            weight = POSITION_RISK_WEIGHT
+
+        now = time.monotonic()
+        while self._weights and self._weights[0][0] <= now - 60:
+            self._used_weight -= self._weights.popleft()[1]
+        self._weights.append((now, weight))
+        self._used_weight += weight
+        headers = {"X-MBX-USED-WEIGHT-1M": str(self._used_weight)}
+
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response(
+                {"code": -1000, "msg": "Injected error"},
+                status=self.error_status,
+                headers=headers,
+            )
+
+        try:
+            response = await handler(request)
+        except KeyError as e:
+            response = web.json_response(
+                {"code": -1102, "msg": f"Mandatory parameter {e} was not sent"},
+                status=400,
+            )
+        except ValueError as e:
+            response = web.json_response({"code": -1100, "msg": str(e)}, status=400)
+
+        response.headers.update(headers)
+        return response
+
+    async def _time(self, request: web.Request) -> web.Response:
+        return web.json_response({"serverTime": int(time.time() * 1000)})
+
+    async def _exchange_info(self, request: web.Request) -> web.Response:
+        symbols = []
+        for symbol in self.symbols:
+            decimals = self._price_decimals(symbol)
+            # Both the Futures and the Spot fields, see models.Contract
+            symbols.append(
+                {
+                    "symbol": symbol,
+                    "status": "TRADING",
+                    "baseAsset": symbol[:-4],
+                    "quoteAsset": "USDT",
+                    "pricePrecision": decimals,
+                    "quantityPrecision": 3,
+                    "filters": [
+                        {
+                            "filterType": "PRICE_FILTER",
+                            "tickSize": f"{10 ** -decimals:.{decimals}f}",
+                        },
+                        {"filterType": "LOT_SIZE", "stepSize": "0.001"},
+                    ],
+                }
+            )
+        return web.json_response(
+            {"serverTime": int(time.time() * 1000), "symbols": symbols}
+        )
+
+    def _symbol(self, request: web.Request) -> str:
+        symbol = request.query["symbol"]
+        if symbol not in self.symbols:
+            raise ValueError(f"Invalid symbol {symbol}")
+        return symbol
+
+    async def _klines(self, request: web.Request) -> web.Response:
+        symbol = self._symbol(request)
+        interval_ms = INTERVAL_MS[request.query["interval"]]
+        limit = min(int(request.query.get("limit", 500)), 1500)
+
+        now = int(time.time() * 1000)
+        last_open = now // interval_ms * interval_ms
+
+        if "startTime" in request.query:
+            start = int(request.query["startTime"])
+            first_open = -(-start // interval_ms) * interval_ms
+        else:
+            first_open = last_open - (limit - 1) * interval_ms
+
+        klines = []
+        open_time = first_open
+        while open_time <= last_open and len(klines) < limit:
+            close_time = min(open_time + interval_ms, now)
+            open_price = self.fair_price(symbol, open_time)
+            close_price = self.fair_price(symbol, close_time)
+            noise = self._noise(symbol, open_time)
+            high = max(open_price, close_price) * (1 + 0.001 * noise)
+            low = min(open_price, close_price) * (1 - 0.001 * (1 - noise))
+            klines.append(
+                [
+                    open_time,
+                    self._format_price(symbol, open_price),
+                    self._format_price(symbol, high),
+                    self._format_price(symbol, low),
+                    self._format_price(symbol, close_price),
+                    f"{100 + 500 * noise:.3f}",
+                    open_time + interval_ms - 1,
+                ]
+            )
+            open_time += interval_ms
+
+        return web.json_response(klines)
+
+    async def _book_ticker(self, request: web.Request) -> web.Response:
+        symbol = self._symbol(request)
+        bid, ask = self._book(symbol, time.time() * 1000)
+        return web.json_response(
+            {
+                "symbol": symbol,
+                "bidPrice": self._format_price(symbol, bid),
+                "bidQty": "1.000",
+                "askPrice": self._format_price(symbol, ask),
+                "askQty": "1.000",
+            }
+        )
+
+    async def _ticker_24hr(self, request: web.Request) -> web.Response:
+        symbol = self._symbol(request)
+        return web.json_response(
+            {
+                "symbol": symbol,
+                "lastPrice": self._format_price(
+                    symbol, self.fair_price(symbol, time.time() * 1000)
+                ),
+                "volume": "12345.678",
+            }
+        )
+
+    async def _account(self, request: web.Request) -> web.Response:
+        if self.futures:
+            assets = [
+                {
+                    "asset": asset,
+                    "initialMargin": "0",
+                    "maintMargin": "0",
+                    "marginBalance": str(balance),
+                    "walletBalance": str(balance),
+                    "unrealizedProfit": "0",
+                }
+                for asset, balance in self.balances.items()
+            ]
+            return web.json_response({"assets": assets})
+
+        balances = [
+            {"asset": asset, "free": str(balance), "locked": "0"}
+            for asset, balance in self.balances.items()
+        ]
+        return web.json_response({"balances": balances})
+
+    def _order_response(self, order: typing.Dict) -> typing.Dict:
+        response = dict(order)
+        if not self.futures:
+            del response[
+                "avgPrice"
+            ]  # Not in the Spot responses, see BinanceClient._get_execution_price()
+        return response
+
+    async def _new_order(self, request: web.Request) -> web.Response:
+        symbol = self._symbol(request)
+        side = request.query["side"]
+        order_type = request.query["type"]
+        quantity = float(request.query["quantity"])
+
+        if quantity <= 0:
+            raise ValueError("Invalid quantity")
+
+        reduce_only = self.futures and request.query.get("reduceOnly") == "true"
+        if reduce_only:
+            position = self.positions.get(symbol, 0.0)
+            if position == 0 or (position > 0) == (side == "BUY"):
+                return web.json_response(
+                    {"code": -2022, "msg": "ReduceOnly Order is rejected."}, status=400
+                )
+            quantity = min(quantity, abs(position))
+
+        order_id = len(self.orders) + 1
+        order = {
+            "orderId": order_id,
+            "symbol": symbol,
+            "side": side,
+            "type": order_type,
+            "origQty": str(quantity),
+            "executedQty": "0",
+            "avgPrice": "0",
+            "status": "NEW",
+        }
+        if self.futures:
+            order["reduceOnly"] = reduce_only
+
+        if order_type == "MARKET":
+            bid, ask = self._book(symbol, time.time() * 1000)
+            price = ask if side == "BUY" else bid
+            order.update(
+                {
+                    "executedQty": str(quantity),
+                    "avgPrice": self._format_price(symbol, price),
+                    "status": "FILLED",
+                }
+            )
+            self._trade_id += 1
+            self.my_trades.append(
+                {
+                    "id": self._trade_id,
+                    "orderId": order_id,
+                    "symbol": symbol,
+                    "price": order["avgPrice"],
+                    "qty": str(quantity),
+                    "time": int(time.time() * 1000),
+                }
+            )
+            if self.futures:
+                signed_quantity = quantity if side == "BUY" else -quantity
+                self.positions[symbol] = round(
+                    self.positions.get(symbol, 0.0) + signed_quantity, 8
+                )
+
+        self.orders[order_id] = order
+
+        return web.json_response(self._order_response(order))
+
+    def _existing_order(self, request: web.Request) -> typing.Dict:
+        order_id = int(request.query["orderId"])
+        if order_id not in self.orders:
+            raise ValueError("Unknown order")
+        return self.orders[order_id]
+
+    async def _get_order(self, request: web.Request) -> web.Response:
+        return web.json_response(self._order_response(self._existing_order(request)))
+
+    async def _cancel_order(self, request: web.Request) -> web.Response:
+        order = self._existing_order(request)
+        if order["status"] == "NEW":
+            order["status"] = "CANCELED"
+        return web.json_response(self._order_response(order))
+
+    async def _position_risk(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            [
+                {
+                    "symbol": symbol,
+                    "positionAmt": str(self.positions.get(symbol, 0.0)),
+                    "positionSide": "BOTH",
+                }
+                for symbol in self.symbols
+            ]
+        )
+
+    async def _my_trades(self, request: web.Request) -> web.Response:
+        symbol = self._symbol(request)
+        return web.json_response([t for t in self.my_trades if t["symbol"] == symbol])
+
+    # Websocket
+
+    def _trade_message(self, symbol: str, trade_id: int) -> str:
+        ts = int(time.time() * 1000)
+        price = self.fair_price(symbol, ts) * (1 + self._random.gauss(0, 0.0001))
+        return json.dumps(
+            {
+                "e": "aggTrade",
+                "E": ts,
+                "a": trade_id,
+                "s": symbol,
+                "p": self._format_price(symbol, price),
+                "q": f"{self._random.expovariate(50):.3f}",
+                "f": trade_id,
+                "l": trade_id,
+                "T": ts,
+                "m": self._random.random() < 0.5,
+            }
+        )
+
+    def _book_message(self, symbol: str, update_id: int) -> str:
+        ts = int(time.time() * 1000)
+        bid, ask = self._book(symbol, ts)
+        message = {
+            "u": update_id,
+            "s": symbol,
+            "b": self._format_price(symbol, bid),
+            "B": f"{self._random.uniform(0.1, 5):.3f}",
+            "a": self._format_price(symbol, ask),
+            "A": f"{self._random.uniform(0.1, 5):.3f}",
+        }
+        if self.futures:
+            message.update({"e": "bookTicker", "T": ts, "E": ts})
+        return json.dumps(message)
+
+    async def _websocket(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        # (symbol, channel) subscribed by the connection
+        subscriptions: typing.Set[typing.Tuple[str, str]] = set()
+        outbox: asyncio.Queue = asyncio.Queue()
+
+        generator = asyncio.ensure_future(self._generate(subscriptions, outbox))
+        sender = asyncio.ensure_future(self._send(ws, outbox))
+
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+
+                data = json.loads(msg.data)
+                streams = []
+                for param in data.get("params", []):
+                    symbol, _, channel = param.partition("@")
+                    streams.append((symbol.upper(), channel))
+
+                if data.get("method") == "SUBSCRIBE":
+                    subscriptions.update(streams)
+                elif data.get("method") == "UNSUBSCRIBE":
+                    subscriptions.difference_update(streams)
+
+                await ws.send_str(json.dumps({"result": None, "id": data.get("id")}))
+        finally:
+            generator.cancel()
+            sender.cancel()
+
+        return ws
+
+    async def _generate(
+        self,
+        subscriptions: typing.Set[typing.Tuple[str, str]],
+        outbox: asyncio.Queue,
+    ):
+        rates = {"aggTrade": self.trade_rate, "bookTicker": self.book_rate}
+        credits: typing.Dict[typing.Tuple[str, str], float] = collections.defaultdict(
+            float
+        )
+        message_id = 0
+        last = time.monotonic()
+
+        while True:
+            await asyncio.sleep(0.005)
+            now = time.monotonic()
+            elapsed = now - last
+            last = now
+
+            for stream in list(subscriptions):
+                symbol, channel = stream
+                if channel not in rates or symbol not in self.symbols:
+                    continue
+
+                credits[stream] += rates[channel] * elapsed
+                while credits[stream] >= 1:
+                    credits[stream] -= 1
+                    message_id += 1
+                    if channel == "aggTrade":
+                        message = self._trade_message(symbol, message_id)
+                    else:
+                        message = self._book_message(symbol, message_id)
+                    outbox.put_nowait((now + self.ws_latency_ms / 1000, message))
+
+    async def _send(self, ws: web.WebSocketResponse, outbox: asyncio.Queue):
+        while True:
+            send_at, message = await outbox.get()
+            delay = send_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await ws.send_str(message)
+            self.messages_sent += 1
+
+    # Server
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        prefix = "/fapi/v1" if self.futures else "/api/v3"
+        account = "/fapi/v2/account" if self.futures else "/api/v3/account"
+
+        app.router.add_get(prefix + "/time", self._time)
+        app.router.add_get(prefix + "/exchangeInfo", self._exchange_info)
+        app.router.add_get(prefix + "/klines", self._klines)
+        app.router.add_get(prefix + "/ticker/bookTicker", self._book_ticker)
+        app.router.add_get(prefix + "/ticker/24hr", self._ticker_24hr)
+        app.router.add_get(account, self._account)
+        app.router.add_post(prefix + "/order", self._new_order)
+        app.router.add_get(prefix + "/order", self._get_order)
+        app.router.add_delete(prefix + "/order", self._cancel_order)
+        app.router.add_get("/api/v3/myTrades", self._my_trades)
+        if self.futures:
+            app.router.add_get("/fapi/v2/positionRisk", self._position_risk)
+        app.router.add_get("/ws", self._websocket)
+
+        return app
+
+    def run(self, host: str = "127.0.0.1", port: int = 8900):
+        """
+        Serve until interrupted.
+        :param host:
+        :param port:
+        :return:
+        """
+
+        web.run_app(self.make_app(), host=host, port=port, print=None)
+
+    def start(self, host: str = "127.0.0.1", port: int = 8900):
+        """
+        Serve from a background thread, e.g. inside a test or a load test script. Returns once the port is open.
+        :param host:
+        :param port:
+        :return:
+        """
+
+        started = threading.Event()
+
+        def serve():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self.make_app())
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, host, port)
+            self._loop.run_until_complete(site.start())
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=serve, name="mock_exchange", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument(
+        "--spot", action="store_true", help="Binance Spot instead of Futures"
+    )
+    parser.add_argument("--symbols", default="BTCUSDT,ETHUSDT,BNBUSDT")
+    parser.add_argument(
+        "--trade-rate", type=float, default=10, help="aggTrade/s per symbol"
+    )
+    parser.add_argument(
+        "--book-rate", type=float, default=10, help="bookTicker/s per symbol"
+    )
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--ws-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    exchange = MockExchange(
+        args.symbols.split(","),
+        futures=not args.spot,
+        trade_rate=args.trade_rate,
+        book_rate=args.book_rate,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        ws_latency_ms=args.ws_latency_ms,
+    )
+    logger.info("Mock exchange listening on http://%s:%s", args.host, args.port)
+    exchange.run(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
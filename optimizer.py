@@ -0,0 +1,444 @@
+import logging
+import typing
+import itertools
+import random
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from backtesting import Backtester
+
+logger = logging.getLogger()
+
+
+def parameter_grid(
+    space: typing.Dict[str, typing.Sequence],
+) -> typing.List[typing.Dict]:
+    """
+    Every combination of the parameter values.
+    :param space: e.g. {"rsi_length": [7, 14, 21], "ema_fast": [8, 12]}
+    :return: A list of parameter dictionaries
+    """
+
+    keys = list(space.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*space.values())]
+
+
+def random_parameters(
+    space: typing.Dict[str, typing.Union[typing.Sequence, typing.Tuple]],
+    n: int,
+    seed: typing.Optional[int] = None,
+) -> typing.List[typing.Dict]:
+    """
+    Random samples of the parameters.
+    :param space: A list of values to pick from, or a (low, high) tuple to draw uniformly from.
+    Integer bounds give integer parameters, like the lengths of the indicators.
+    :param n: Number of parameter dictionaries
+    :param seed:
+    :return:
+    """
+
+    rng = random.Random(seed)
+    samples = []
+
+    for _ in range(n):
+        params = dict()
+        for key, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    params[key] = rng.randint(low, high)
+                else:
+                    params[key] = rng.uniform(low, high)
+            else:
+                params[key] = rng.choice(values)
+        samples.append(params)
+
+    return samples
+
+
+class SharedCandles:
+    def __init__(self, data: np.ndarray):
+        """
+        Copy the candle array once into a shared memory block that the worker processes map without copying.
+        Use as a context manager so that the block is released at the end of the sweep.
+        :param data: Candle array as returned by backtesting.candles_to_array()
+        """
+
+        self.shape = data.shape
+        self.dtype = data.dtype.str
+
+        self._shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        array = np.ndarray(self.shape, dtype=data.dtype, buffer=self._shm.buf)
+        array[:] = data
+
+        self.name = self._shm.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+# Per worker process state, set by _init_worker()
+_worker_shm: typing.Optional[shared_memory.SharedMemory] = None
+_worker_backtester: typing.Optional[Backtester] = None
+
+
+def _init_worker(
+    shm_name: str, shape: typing.Tuple, dtype: str, backtest_kwargs: typing.Dict
+):
+    global _worker_shm, _worker_backtester
+
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    data = np.ndarray(shape, dtype=np.dtype(dtype), buffer=_worker_shm.buf)
+
+    # The Backtester lives as long as the worker, so its indicator cache is shared by all the chunks it runs
+    _worker_backtester = Backtester(data, **backtest_kwargs)
+
+
+def _run_chunk(
+    strategy_type: typing.Type,
+    chunk: typing.List[typing.Dict],
+    start: int,
+    end: typing.Optional[int],
+) -> typing.List[typing.Dict]:
+    return _run_params(_worker_backtester, strategy_type, chunk, start, end)
+
+
+def _run_params(
+    backtester: Backtester,
+    strategy_type: typing.Type,
+    chunk: typing.List[typing.Dict],
+    start: int,
+    end: typing.Optional[int],
+) -> typing.List[typing.Dict]:
+    results = []
+
+    for params in chunk:
+        try:
+            metrics = backtester.run(strategy_type, params, start, end)
+        except Exception as e:  # An invalid combination must not stop the whole sweep
+            logger.error("Backtest error with parameters %s: %s", params, e)
+            continue
+        results.append({**params, **metrics})
+
+    return results
+
+
+def _chunks(
+    param_sets: typing.List[typing.Dict], workers: int, chunk_size: typing.Optional[int]
+):
+    if chunk_size is None:
+        # A few chunks per worker balances the load without paying the IPC cost for every combination
+        chunk_size = max(1, len(param_sets) // (workers * 4))
+
+    # Sorting keeps the combinations sharing the same indicator lengths in the same chunk (better cache hits)
+    ordered = sorted(param_sets, key=lambda p: tuple(sorted(p.items())))
+
+    return [ordered[i : i + chunk_size] for i in range(0, len(ordered), chunk_size)]
+
+
+def run_sweep(
+    strategy_type: typing.Type,
+    data: np.ndarray,
+    param_sets: typing.List[typing.Dict],
+    workers: typing.Optional[int] = None,
+    backend: str = "process",
+    chunk_size: typing.Optional[int] = None,
+    rank_by: str = "pnl",
+    start: int = 0,
+    end: typing.Optional[int] = None,
+    **backtest_kwargs,
+) -> pd.DataFrame:
+    """
+    Backtest every parameter set and rank the results.
+    :param strategy_type: TechnicalStrategy, BreakoutStrategy or FractalStrategy
+    :param data: Candle array as returned by backtesting.candles_to_array()
+    :param param_sets: Output of parameter_grid() or random_parameters()
+    :param workers: Number of processes, defaults to the number of CPUs. 0 runs in the current process.
+    :param backend: "process" for a local process pool, "ray" for Ray (started locally if not initialized)
+    :param chunk_size: Number of parameter sets sent to a worker at once
+    :param rank_by: Metric column used to sort the table, the best first
+    :param start: Index of the first candle of the window
+    :param end: Index after the last candle of the window
+    :param backtest_kwargs: initial_balance, fee_pct, allow_short, see Backtester
+    :return: One row per parameter set: the parameters followed by the metrics
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    start_time = time.perf_counter()
+
+    if workers == 0 or len(param_sets) == 0:
+        backtester = Backtester(data, **backtest_kwargs)
+        results = _run_params(backtester, strategy_type, param_sets, start, end)
+
+    elif backend == "process":
+        chunks = _chunks(param_sets, workers, chunk_size)
+        results = []
+
+        with SharedCandles(data) as shared:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(shared.name, shared.shape, shared.dtype, backtest_kwargs),
+            ) as executor:
+                futures = [
+                    executor.submit(_run_chunk, strategy_type, chunk, start, end)
+                    for chunk in chunks
+                ]
+                for future in futures:
+                    results.extend(future.result())
+
+    elif backend == "ray":
+        results = _run_ray(
+            strategy_type,
+            data,
+            param_sets,
+            workers,
+            chunk_size,
+            start,
+            end,
+            backtest_kwargs,
+        )
+
+    else:
+        raise ValueError(f"Unknown sweep backend: {backend}")
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(
+        "Parameter sweep: %s combinations in %.2f seconds (%.0f/s)",
+        len(param_sets),
+        elapsed,
+        len(param_sets) / elapsed if elapsed > 0 else 0,
+    )
+
+    table = pd.DataFrame(results)
+    if len(table) > 0:
+        table = table.sort_values(rank_by, ascending=False).reset_index(drop=True)
+
+    return table
+
+
+def _run_ray(
+    strategy_type: typing.Type,
+    data: np.ndarray,
+    param_sets: typing.List[typing.Dict],
+    workers: int,
+    chunk_size: typing.Optional[int],
+    start: int,
+    end: typing.Optional[int],
+    backtest_kwargs: typing.Dict,
+) -> typing.List[typing.Dict]:
+    import ray  # Optional, only needed for this backend
+
+    if not ray.is_initialized():
+        ray.init(num_cpus=workers, include_dashboard=False, ignore_reinit_error=True)
+
+    @ray.remote
+    def run_chunk(shared_data: np.ndarray, chunk: typing.List[typing.Dict]):
+        # NumPy arrays are read from the Ray object store without being copied
+        return _run_params(
+            Backtester(shared_data, **backtest_kwargs), strategy_type, chunk, start, end
+        )
+
+    data_ref = ray.put(data)
+    chunks = _chunks(param_sets, workers, chunk_size)
+
+    results = []
+    for chunk_results in ray.get(
+        [run_chunk.remote(data_ref, chunk) for chunk in chunks]
+    ):
+        results.extend(chunk_results)
+
+    return results
+
+
+def walk_forward_windows(
+    n: int,
+    train_size: int,
+    test_size: int,
+    step: typing.Optional[int] = None,
+    anchored: bool = False,
+) -> typing.List[typing.Tuple[int, int, int, int]]:
+    """
+    Split n candles into consecutive train/test windows.
+    :param n: Number of candles
+    :param train_size: Number of candles of each train window
+    :param test_size: Number of candles of each test window, the test window starts where the train window ends
+    :param step: Shift between two windows, defaults to test_size so that the test windows don't overlap
+    :param anchored: True to keep every train window starting at the first candle (expanding window)
+    :return: A list of (train_start, train_end, test_start, test_end) candle indexes, the ends are exclusive
+    """
+
+    step = test_size if step is None else step
+    windows = []
+
+    train_start = 0
+    while train_start + train_size + test_size <= n:
+        train_end = train_start + train_size
+        windows.append(
+            (
+                0 if anchored else train_start,
+                train_end,
+                train_end,
+                train_end + test_size,
+            )
+        )
+        train_start += step
+
+    return windows
+
+
+def _run_windows(
+    backtester: Backtester,
+    strategy_type: typing.Type,
+    chunk: typing.List[typing.Dict],
+    windows: typing.List[typing.Tuple[int, int, int, int]],
+    rank_by: str,
+) -> typing.List[
+    typing.Tuple[typing.Dict, typing.List[float], typing.List[typing.Dict]]
+]:
+    results = []
+
+    for params in chunk:
+        try:
+            train_scores = []
+            test_metrics = []
+            for train_start, train_end, test_start, test_end in windows:
+                train_scores.append(
+                    backtester.run(strategy_type, params, train_start, train_end)[
+                        rank_by
+                    ]
+                )
+                test_metrics.append(
+                    backtester.run(strategy_type, params, test_start, test_end)
+                )
+        except Exception as e:
+            logger.error("Backtest error with parameters %s: %s", params, e)
+            continue
+        results.append((params, train_scores, test_metrics))
+
+    return results
+
+
+def _run_windows_chunk(
+    strategy_type: typing.Type,
+    chunk: typing.List[typing.Dict],
+    windows: typing.List[typing.Tuple[int, int, int, int]],
+    rank_by: str,
+):
+    return _run_windows(_worker_backtester, strategy_type, chunk, windows, rank_by)
+
+
+def walk_forward(
+    strategy_type: typing.Type,
+    data: np.ndarray,
+    param_sets: typing.List[typing.Dict],
+    train_size: int,
+    test_size: int,
+    step: typing.Optional[int] = None,
+    anchored: bool = False,
+    workers: typing.Optional[int] = None,
+    chunk_size: typing.Optional[int] = None,
+    rank_by: str = "pnl",
+    **backtest_kwargs,
+) -> pd.DataFrame:
+    """
+    Walk-forward evaluation: for each window, pick the parameter set with the best train score and report how it
+    performed on the following test window, that it has never seen.
+
+    The work is sharded by parameter set rather than by window: each worker scores its parameter sets on all
+    the windows at once, so the windows are evaluated in parallel and every indicator is computed only once
+    per worker over the whole history. The indicators are causal, so the values computed over the whole history
+    are the same as the ones computed incrementally up to the end of each window, and the signals of a
+    parameter set are computed once and sliced for every window.
+
+    :param strategy_type: TechnicalStrategy, BreakoutStrategy or FractalStrategy
+    :param data: Candle array as returned by backtesting.candles_to_array()
+    :param param_sets: Output of parameter_grid() or random_parameters()
+    :param train_size: See walk_forward_windows()
+    :param test_size: See walk_forward_windows()
+    :param step: See walk_forward_windows()
+    :param anchored: See walk_forward_windows()
+    :param workers: Number of processes, defaults to the number of CPUs. 0 runs in the current process.
+    :param chunk_size: Number of parameter sets sent to a worker at once
+    :param rank_by: Metric used to pick the best parameter set on each train window
+    :param backtest_kwargs: initial_balance, fee_pct, allow_short, see Backtester
+    :return: One row per window: the window bounds, the selected parameters, the train score and the test metrics
+    """
+
+    windows = walk_forward_windows(data.shape[1], train_size, test_size, step, anchored)
+
+    if len(windows) == 0:
+        raise ValueError("Not enough candles for one train and one test window")
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    start_time = time.perf_counter()
+
+    if workers == 0:
+        backtester = Backtester(data, **backtest_kwargs)
+        results = _run_windows(backtester, strategy_type, param_sets, windows, rank_by)
+
+    else:
+        chunks = _chunks(param_sets, workers, chunk_size)
+        results = []
+
+        with SharedCandles(data) as shared:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(shared.name, shared.shape, shared.dtype, backtest_kwargs),
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        _run_windows_chunk, strategy_type, chunk, windows, rank_by
+                    )
+                    for chunk in chunks
+                ]
+                for future in futures:
+                    results.extend(future.result())
+
+    logger.info(
+        "Walk-forward: %s combinations on %s windows in %.2f seconds",
+        len(param_sets),
+        len(windows),
+        time.perf_counter() - start_time,
+    )
+
+    if len(results) == 0:
+        return pd.DataFrame()
+
+    train_scores = np.array([scores for _, scores, _ in results])
+
+    rows = []
+    for w, (train_start, train_end, test_start, test_end) in enumerate(windows):
+        best = int(np.argmax(train_scores[:, w]))
+        params, _, test_metrics = results[best]
+        rows.append(
+            {
+                "train_start": int(data[0, train_start]),
+                "train_end": int(data[0, train_end - 1]),
+                "test_start": int(data[0, test_start]),
+                "test_end": int(data[0, test_end - 1]),
+                **params,
+                "train_" + rank_by: train_scores[best, w],
+                **{"test_" + k: v for k, v in test_metrics[w].items()},
+            }
+        )
+
+    return pd.DataFrame(rows)
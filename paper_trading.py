@@ -0,0 +1,620 @@
+import logging
+import typing
+import heapq
+import random
+import threading
+
+from models import *
+from connectors.binance import BinanceClient
+
+logger = logging.getLogger()
+
+# Taker and maker fees of the regular Binance accounts
+FEES = {
+    "binance_futures": {"taker": 0.0004, "maker": 0.0002},
+    "binance_spot": {"taker": 0.001, "maker": 0.001},
+}
+
+# Finished orders kept for get_order_status(), the oldest are forgotten beyond this number
+MAX_ORDERS = 100_000
+
+
+class PaperOrder:
+    def __init__(
+        self,
+        order_id: int,
+        contract: Contract,
+        order_type: str,
+        side: str,
+        quantity: float,
+        price: typing.Optional[float],
+        arrival_ms: int,
+        reduce_only: bool = False,
+    ):
+        self.order_id = order_id
+        self.contract = contract
+        self.order_type = order_type
+        self.side = side
+        self.quantity = quantity
+        self.price = price
+        self.arrival_ms = arrival_ms
+        self.reduce_only = reduce_only
+
+        self.status = "NEW"
+        self.executed_qty = 0.0
+        self.avg_price = 0.0
+        self.fee = 0.0
+
+    def order_status(self, platform: str) -> OrderStatus:
+        return OrderStatus(
+            {
+                "orderId": self.order_id,
+                "status": self.status,
+                "avgPrice": self.avg_price,
+                "executedQty": self.executed_qty,
+            },
+            platform,
+        )
+
+
+class MatchingEngine:
+    def __init__(
+        self,
+        futures: bool,
+        clock: typing.Callable[[], int],
+        balance: float = 10000,
+        quote_asset: str = "USDT",
+        taker_fee: typing.Optional[float] = None,
+        maker_fee: typing.Optional[float] = None,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        leverage: float = 1,
+        seed: typing.Optional[int] = None,
+    ):
+        """
+        Simulated order gateway fed with the market data of a client, live or replayed.
+        The market orders are filled against the last bookTicker of their symbol: up to the quantity at the top
+        of book at the best price, the rest walks down a book assumed flat, each next level one tick further with
+        the same quantity as the top. Before the first bookTicker they are filled at the last trade price.
+        The limit orders rest until the opposite side of the book reaches their price, and are filled there with
+        the maker fee. An order reaches the engine latency_ms (+ up to jitter_ms) after it is placed, it is
+        matched against the book of that time, so place_order() returns an unfilled order when there is latency.
+        Futures: one wallet in the quote asset and a net position per symbol. Spot: a free and a locked balance
+        per asset, the fees are paid in the quote asset. Orders beyond the margin or the balance are rejected.
+        All the state is in memory behind one lock, an order costs a few microseconds.
+        :param futures:
+        :param clock: Current time in milliseconds, the exchange time of the client
+        :param balance: Initial balance of the quote asset
+        :param quote_asset:
+        :param taker_fee: Rate of the traded notional, see FEES for the default
+        :param maker_fee:
+        :param latency_ms:
+        :param jitter_ms:
+        :param leverage: Futures only, the initial margin of a position is its notional divided by the leverage
+        :param seed: Of the latency jitter
+        """
+
+        self.futures = futures
+        self.platform = "binance_futures" if futures else "binance_spot"
+        self.clock = clock
+        self.quote_asset = quote_asset
+        self.taker_fee = (
+            FEES[self.platform]["taker"] if taker_fee is None else taker_fee
+        )
+        self.maker_fee = (
+            FEES[self.platform]["maker"] if maker_fee is None else maker_fee
+        )
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.leverage = leverage
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        # symbol -> [bid, bid quantity, ask, ask quantity]
+        self._books: typing.Dict[str, typing.List[float]] = dict()
+        self._last_prices: typing.Dict[str, float] = dict()
+
+        self._orders: typing.Dict[int, PaperOrder] = dict()
+        self._next_id = 1
+        # (arrival time, order id) of the orders not yet arrived
+        self._in_flight: typing.List[typing.Tuple[int, int]] = []
+        # symbol -> resting limit orders
+        self._resting: typing.Dict[str, typing.List[PaperOrder]] = dict()
+
+        # Futures
+        self.wallet = balance
+        # symbol -> [signed quantity, entry price]
+        self.positions: typing.Dict[str, typing.List[float]] = dict()
+
+        # Spot, asset -> [free, locked]
+        self.assets: typing.Dict[str, typing.List[float]] = {
+            quote_asset: [balance, 0.0]
+        }
+
+        self.orders_placed = 0
+        self.orders_filled = 0
+        self.orders_rejected = 0
+        self.fees_paid = 0.0
+
+    # Market data
+
+    def on_book(
+        self, symbol: str, bid: float, bid_qty: float, ask: float, ask_qty: float
+    ):
+        with self._lock:
+            book = self._books.get(symbol)
+            if book is None:
+                self._books[symbol] = [bid, bid_qty, ask, ask_qty]
+            else:
+                book[0] = bid
+                book[1] = bid_qty
+                book[2] = ask
+                book[3] = ask_qty
+
+            if self._in_flight:
+                self._process_arrivals()
+
+            resting = self._resting.get(symbol)
+            if resting:
+                self._match_resting(symbol, resting, bid, ask)
+
+    def on_trade(self, symbol: str, price: float):
+        with self._lock:
+            self._last_prices[symbol] = price
+
+            if self._in_flight:
+                self._process_arrivals()
+
+    # Orders
+
+    def place_order(
+        self,
+        contract: Contract,
+        order_type: str,
+        quantity: float,
+        side: str,
+        price: typing.Optional[float] = None,
+        reduce_only: bool = False,
+    ) -> typing.Optional[OrderStatus]:
+        """
+        Same arguments and result as BinanceClient.place_order(), None when the order is rejected.
+        :param contract:
+        :param order_type: MARKET or LIMIT
+        :param quantity:
+        :param side:
+        :param price: Required for the LIMIT orders
+        :param reduce_only: Futures only, rejected without a position to reduce, and capped at its size
+        :return:
+        """
+
+        order_type = order_type.upper()
+        side = side.upper()
+        quantity = round(int(quantity / contract.lot_size) * contract.lot_size, 8)
+
+        if order_type not in ("MARKET", "LIMIT") or quantity <= 0:
+            logger.error(
+                "Paper trading: invalid %s order of %s %s",
+                order_type,
+                quantity,
+                contract.symbol,
+            )
+            return None
+        if order_type == "LIMIT":
+            if price is None:
+                logger.error(
+                    "Paper trading: LIMIT order without price on %s", contract.symbol
+                )
+                return None
+            price = round(round(price / contract.tick_size) * contract.tick_size, 8)
+
+        latency = self.latency_ms
+        if self.jitter_ms > 0:
+            latency += self._random.random() * self.jitter_ms
+
+        with self._lock:
+            order = PaperOrder(
+                self._next_id,
+                contract,
+                order_type,
+                side,
+                quantity,
+                price,
+                self.clock() + int(latency),
+                reduce_only,
+            )
+            self._next_id += 1
+            self.orders_placed += 1
+
+            if latency > 0:
+                heapq.heappush(self._in_flight, (order.arrival_ms, order.order_id))
+            elif not self._arrive(order):
+                return None
+
+            self._orders[order.order_id] = order
+            if len(self._orders) > MAX_ORDERS:
+                self._forget_orders()
+
+            return order.order_status(self.platform)
+
+    def get_order_status(self, order_id: int) -> typing.Optional[OrderStatus]:
+        with self._lock:
+            if self._in_flight:
+                self._process_arrivals()
+
+            order = self._orders.get(order_id)
+            if order is None:
+                return None
+            return order.order_status(self.platform)
+
+    def cancel_order(self, order_id: int) -> typing.Optional[OrderStatus]:
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None:
+                return None
+
+            if order.status == "NEW":
+                order.status = "CANCELED"
+                resting = self._resting.get(order.contract.symbol)
+                if resting is not None and order in resting:
+                    resting.remove(order)
+                    self._unlock(order)
+
+            return order.order_status(self.platform)
+
+    def _process_arrivals(self):
+        now = self.clock()
+        while self._in_flight and self._in_flight[0][0] <= now:
+            _, order_id = heapq.heappop(self._in_flight)
+            order = self._orders.get(order_id)
+            if order is not None and order.status == "NEW":
+                self._arrive(order)
+
+    def _arrive(self, order: PaperOrder) -> bool:
+        """
+        Match an order that reaches the engine, or make it rest.
+        :param order:
+        :return: False if the order is rejected
+        """
+
+        symbol = order.contract.symbol
+        book = self._books.get(symbol)
+
+        if order.order_type == "LIMIT":
+            # Marketable limit orders are filled at once at their price, as a taker
+            if book is not None and (
+                (order.side == "BUY" and book[2] <= order.price)
+                or (order.side == "SELL" and book[0] >= order.price)
+            ):
+                return self._fill(order, order.price, self.taker_fee)
+            if not self._lock_funds(order):
+                return self._reject(order)
+            self._resting.setdefault(symbol, []).append(order)
+            return True
+
+        if book is not None:
+            if order.side == "BUY":
+                price = self._walk(
+                    book[2], book[3], order.quantity, order.contract.tick_size
+                )
+            else:
+                price = self._walk(
+                    book[0], book[1], order.quantity, -order.contract.tick_size
+                )
+        elif symbol in self._last_prices:
+            price = self._last_prices[symbol]
+        else:
+            logger.error("Paper trading: no price yet for %s", symbol)
+            return self._reject(order)
+
+        return self._fill(order, price, self.taker_fee)
+
+    @staticmethod
+    def _walk(price: float, level_qty: float, quantity: float, step: float) -> float:
+        """
+        Average price of a market order through a flat book.
+        :param price: Best price
+        :param level_qty: Quantity at the best price, the same at each next level
+        :param quantity:
+        :param step: Price difference between two levels, negative for the bids
+        :return:
+        """
+
+        if level_qty <= 0 or quantity <= level_qty:
+            return price
+
+        full_levels = int(quantity // level_qty)
+        remainder = quantity - full_levels * level_qty
+        cost = level_qty * (
+            full_levels * price + step * full_levels * (full_levels - 1) / 2
+        )
+        cost += remainder * (price + step * full_levels)
+        return cost / quantity
+
+    def _match_resting(
+        self, symbol: str, resting: typing.List[PaperOrder], bid: float, ask: float
+    ):
+        remaining = []
+        for order in resting:
+            if (order.side == "BUY" and ask <= order.price) or (
+                order.side == "SELL" and bid >= order.price
+            ):
+                self._unlock(order)
+                self._fill(order, order.price, self.maker_fee)
+            else:
+                remaining.append(order)
+        self._resting[symbol] = remaining
+
+    def _reject(self, order: PaperOrder) -> bool:
+        order.status = "REJECTED"
+        self.orders_rejected += 1
+        return False
+
+    def _forget_orders(self):
+        # Keeps the orders still working and the newest half of the others
+        finished = [o for o in self._orders.values() if o.status != "NEW"]
+        forgotten = set(o.order_id for o in finished[: len(finished) // 2 + 1])
+        self._orders = {
+            order_id: o
+            for order_id, o in self._orders.items()
+            if order_id not in forgotten
+        }
+
+    # Balances
+
+    def _fill(self, order: PaperOrder, price: float, fee_rate: float) -> bool:
+        symbol = order.contract.symbol
+
+        if self.futures and order.reduce_only:
+            size = self.positions.get(symbol, [0.0, 0.0])[0]
+            if size == 0 or (size > 0) == (order.side == "BUY"):
+                logger.warning(
+                    "Paper trading: reduce only order without position on %s", symbol
+                )
+                return self._reject(order)
+            order.quantity = min(order.quantity, abs(size))
+        quantity = order.quantity
+        notional = price * quantity
+        fee = notional * fee_rate
+        signed_qty = quantity if order.side == "BUY" else -quantity
+
+        if self.futures:
+            position = self.positions.setdefault(symbol, [0.0, 0.0])
+            size, entry = position
+            new_size = size + signed_qty
+
+            # Only the orders that increase the exposure need margin
+            if abs(new_size) > abs(size):
+                added = (abs(new_size) - abs(size)) * price / self.leverage
+                if added + fee > self._available_margin():
+                    logger.warning("Paper trading: insufficient margin for %s", symbol)
+                    return self._reject(order)
+
+            if size == 0 or (size > 0) == (signed_qty > 0):
+                position[1] = (size * entry + signed_qty * price) / new_size
+            else:
+                closed = min(abs(size), quantity)
+                self.wallet += closed * (price - entry) * (1 if size > 0 else -1)
+                if abs(signed_qty) > abs(size):
+                    position[1] = price  # The position is reversed
+            position[0] = round(new_size, 8)
+            if position[0] == 0:
+                position[1] = 0.0
+            self.wallet -= fee
+        else:
+            base = self.assets.setdefault(order.contract.base_asset, [0.0, 0.0])
+            quote = self.assets.setdefault(order.contract.quote_asset, [0.0, 0.0])
+
+            if order.side == "BUY":
+                if quote[0] < notional + fee:
+                    logger.warning(
+                        "Paper trading: insufficient %s balance",
+                        order.contract.quote_asset,
+                    )
+                    return self._reject(order)
+                quote[0] -= notional + fee
+                base[0] += quantity
+            else:
+                if base[0] < quantity - 1e-12:
+                    logger.warning(
+                        "Paper trading: insufficient %s balance",
+                        order.contract.base_asset,
+                    )
+                    return self._reject(order)
+                base[0] -= quantity
+                quote[0] += notional - fee
+
+        order.status = "FILLED"
+        order.executed_qty = quantity
+        order.avg_price = price
+        order.fee = fee
+        self.orders_filled += 1
+        self.fees_paid += fee
+
+        return True
+
+    def _mark_price(self, symbol: str, entry: float) -> float:
+        book = self._books.get(symbol)
+        if book is not None:
+            return (book[0] + book[2]) / 2
+        return self._last_prices.get(symbol, entry)
+
+    def _unrealized_pnl(self) -> float:
+        return sum(
+            size * (self._mark_price(symbol, entry) - entry)
+            for symbol, (size, entry) in self.positions.items()
+            if size != 0
+        )
+
+    def _initial_margin(self) -> float:
+        margin = sum(
+            abs(size) * self._mark_price(symbol, entry)
+            for symbol, (size, entry) in self.positions.items()
+            if size != 0
+        )
+        # The resting orders reserve their margin too
+        for resting in self._resting.values():
+            margin += sum(o.quantity * o.price for o in resting)
+        return margin / self.leverage
+
+    def _available_margin(self) -> float:
+        return self.wallet + self._unrealized_pnl() - self._initial_margin()
+
+    def _lock_funds(self, order: PaperOrder) -> bool:
+        if self.futures:
+            return (
+                order.quantity * order.price / self.leverage <= self._available_margin()
+            )
+
+        if order.side == "BUY":
+            asset = self.assets.setdefault(order.contract.quote_asset, [0.0, 0.0])
+            amount = order.quantity * order.price * (1 + self.maker_fee)
+        else:
+            asset = self.assets.setdefault(order.contract.base_asset, [0.0, 0.0])
+            amount = order.quantity
+
+        if asset[0] < amount:
+            return False
+        asset[0] -= amount
+        asset[1] += amount
+        return True
+
+    def _unlock(self, order: PaperOrder):
+        if self.futures:
+            return
+
+        if order.side == "BUY":
+            asset = self.assets[order.contract.quote_asset]
+            amount = order.quantity * order.price * (1 + self.maker_fee)
+        else:
+            asset = self.assets[order.contract.base_asset]
+            amount = order.quantity
+        asset[0] += amount
+        asset[1] -= amount
+
+    def get_positions(self) -> typing.Dict[str, float]:
+        with self._lock:
+            return {symbol: size for symbol, (size, entry) in self.positions.items()}
+
+    def get_balances(self) -> typing.Dict[str, Balance]:
+        with self._lock:
+            if self.futures:
+                unrealized_pnl = self._unrealized_pnl()
+                info = {
+                    "initialMargin": self._initial_margin(),
+                    "maintMargin": 0,
+                    "marginBalance": self.wallet + unrealized_pnl,
+                    "walletBalance": self.wallet,
+                    "unrealizedProfit": unrealized_pnl,
+                }
+                return {self.quote_asset: Balance(info, self.platform)}
+
+            return {
+                asset: Balance({"free": free, "locked": locked}, self.platform)
+                for asset, (free, locked) in self.assets.items()
+            }
+
+    def stats(self) -> typing.Dict[str, float]:
+        return {
+            "placed": self.orders_placed,
+            "filled": self.orders_filled,
+            "rejected": self.orders_rejected,
+            "in_flight": len(self._in_flight),
+            "resting": sum(len(r) for r in self._resting.values()),
+            "fees": self.fees_paid,
+        }
+
+
+class PaperTradingClient(BinanceClient):
+    # The simulated trades stay out of the trade journal
+    persistent = False
+
+    def __init__(
+        self,
+        public_key: str = "",
+        secret_key: str = "",
+        testnet: bool = False,
+        futures: bool = True,
+        base_url: typing.Optional[str] = None,
+        wss_url: typing.Optional[str] = None,
+        balance: float = 10000,
+        quote_asset: str = "USDT",
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        **engine_params,
+    ):
+        """
+        A BinanceClient on the live market data whose orders, order statuses and balances are those of a
+        MatchingEngine instead of the account: the strategies run unchanged, at no risk and without signed
+        requests, so the keys can be empty. All the strategies of the client share the simulated account.
+        :param public_key:
+        :param secret_key:
+        :param testnet: Market data of the testnet instead of the real market
+        :param futures:
+        :param base_url:
+        :param wss_url:
+        :param balance: Initial balance of the quote asset
+        :param quote_asset:
+        :param latency_ms: Between place_order() and the arrival of the order in the engine
+        :param jitter_ms:
+        :param engine_params: Other parameters of MatchingEngine, e.g. taker_fee or leverage
+        """
+
+        # Before BinanceClient.__init__(), which calls get_balances()
+        self.engine = MatchingEngine(
+            futures,
+            self.server_time,
+            balance,
+            quote_asset,
+            latency_ms=latency_ms,
+            jitter_ms=jitter_ms,
+            **engine_params,
+        )
+
+        super().__init__(public_key, secret_key, testnet, futures, base_url, wss_url)
+
+    def validate_keys(self) -> bool:
+        return True
+
+    def get_balances(self) -> typing.Dict[str, Balance]:
+        return self.engine.get_balances()
+
+    def place_order(
+        self,
+        contract: Contract,
+        order_type: str,
+        quantity: float,
+        side: str,
+        price=None,
+        tif=None,
+        reduce_only: bool = False,
+    ) -> typing.Optional[OrderStatus]:
+        return self.engine.place_order(
+            contract, order_type, quantity, side, price, reduce_only
+        )
+
+    def get_positions(self) -> typing.Optional[typing.Dict[str, float]]:
+        return self.engine.get_positions()
+
+    def get_order_status(
+        self, contract: Contract, order_id: int
+    ) -> typing.Optional[OrderStatus]:
+        return self.engine.get_order_status(order_id)
+
+    def cancel_order(
+        self, contract: Contract, order_id: int
+    ) -> typing.Optional[OrderStatus]:
+        return self.engine.cancel_order(order_id)
+
+    def _on_book_ticker(self, data: typing.Dict):
+        super()._on_book_ticker(data)
+
+        prices = self.prices[data["s"]]
+        self.engine.on_book(
+            data["s"], prices["bid"], float(data["B"]), prices["ask"], float(data["A"])
+        )
+
+    def _on_agg_trade(self, data: typing.Dict):
+        # Before the strategies, the orders arrived by now are matched at the previous book
+        self.engine.on_trade(data["s"], float(data["p"]))
+        super()._on_agg_trade(data)
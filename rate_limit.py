@@ -0,0 +1,70 @@
+import logging
+import typing
+import time
+import threading
+import collections
+
+logger = logging.getLogger()
+
+
+class RequestWeightLimiter:
+    def __init__(self, max_weight: int, period_s: float = 60):
+        """
+        Client side limit of the request weight used per period, kept below the IP limit of the exchange so that
+        concurrent requests (e.g. the history of many strategies activated at once) wait for their turn instead
+        of being rejected with a 429 and getting the IP banned.
+        :param max_weight: Maximum weight over any window of period_s
+        :param period_s:
+        """
+
+        self.max_weight = max_weight
+        self.period_s = period_s
+
+        self._events: typing.Deque[typing.Tuple[float, int]] = collections.deque()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._events and self._events[0][0] <= now - self.period_s:
+            self._used -= self._events.popleft()[1]
+
+    def acquire(self, weight: int = 1):
+        """
+        Block until the request can be sent.
+        :param weight: Weight of the request, see the documentation of the endpoint
+        :return:
+        """
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+
+                if self._used + weight <= self.max_weight or not self._events:
+                    self._events.append((now, weight))
+                    self._used += weight
+                    return
+
+                wait = self._events[0][0] + self.period_s - now
+
+            time.sleep(wait)
+
+    def sync(self, used_weight: int):
+        """
+        Account for the weight used according to the exchange (e.g. the X-MBX-USED-WEIGHT-1M header of Binance),
+        which includes the requests of other programs using the same IP.
+        :param used_weight:
+        :return:
+        """
+
+        with self._lock:
+            self._expire(time.monotonic())
+            if used_weight > self._used:
+                self._events.append((time.monotonic(), used_weight - self._used))
+                self._used = used_weight
+
+    @property
+    def used_weight(self) -> int:
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._used
@@ -0,0 +1,243 @@
+import logging
+import typing
+import os
+import glob
+import time
+import struct
+import threading
+import collections
+
+import msgpack
+import lz4.frame
+
+logger = logging.getLogger()
+
+_LENGTH = struct.Struct("<I")  # Prefix of each record, the size of its msgpack bytes
+
+
+def segment_name(timestamp: int) -> str:
+    # One segment per hour of reception time
+    return "ticks_" + time.strftime("%Y%m%d_%H", time.gmtime(timestamp / 1000))
+
+
+class TickRecorder:
+    def __init__(
+        self,
+        directory: str,
+        flush_interval_s: float = 0.5,
+        max_buffer: int = 1_000_000,
+        compression_level: int = 0,
+    ):
+        """
+        Record the raw websocket messages, e.g. every aggTrade and bookTicker, for replay, debugging and backtests.
+        record() only appends the message and its reception time to a deque, a background thread writes the deque
+        every flush_interval_s to the segment of the hour: each write is one lz4 frame of length-prefixed msgpack
+        records [reception time in ms, message], appended to the .lz4 file of the segment.
+        The .idx file next to it lists [reception time of the first record, file offset] for each frame, so that
+        a reader can start decompressing at the frame of a given time instead of the start of the hour.
+        A crash loses at most the frames not yet written, the previous frames stay readable.
+        :param directory: Created if it doesn't exist
+        :param flush_interval_s:
+        :param max_buffer: Messages waiting to be written above which the new messages are dropped and counted
+        :param compression_level: lz4 level, 0 is the fastest
+        """
+
+        self.directory = directory
+        self.flush_interval_s = flush_interval_s
+        self.max_buffer = max_buffer
+        self.compression_level = compression_level
+
+        self._buffer: typing.Deque[typing.Tuple[int, str]] = collections.deque()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._running = False
+
+        self.recorded = 0
+        self.dropped = 0
+        self.written_bytes = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, msg: str):
+        """
+        Called from the websocket thread for every message, never blocks nor touches the disk.
+        :param msg: The raw message
+        :return:
+        """
+
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+
+        self._buffer.append((int(time.time() * 1000), msg))
+
+    def start(self):
+        if self._running:
+            return
+
+        self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name="tick_recorder", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write the messages still in the buffer and stop the writer thread.
+        :return:
+        """
+
+        if not self._running:
+            return
+
+        self._running = False
+        self._thread.join()
+        self._thread = None
+
+        if self.dropped:
+            logger.warning(
+                "Tick recorder: %s messages dropped, the disk could not keep up",
+                self.dropped,
+            )
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.flush_interval_s)
+            self.flush()
+
+        self.flush()
+
+    def flush(self):
+        # The deque is shared with record() without a lock: only the messages present now are taken
+        count = len(self._buffer)
+        if count == 0:
+            return
+
+        segments: typing.Dict[str, typing.List[bytes]] = collections.defaultdict(list)
+        first_ts: typing.Dict[str, int] = dict()
+        packer = msgpack.Packer()
+
+        for _ in range(count):
+            ts, msg = self._buffer.popleft()
+            name = segment_name(ts)
+            packed = packer.pack((ts, msg))
+            segments[name].append(_LENGTH.pack(len(packed)))
+            segments[name].append(packed)
+            first_ts.setdefault(name, ts)
+
+        for name, chunks in segments.items():
+            frame = lz4.frame.compress(
+                b"".join(chunks), compression_level=self.compression_level
+            )
+            path = os.path.join(self.directory, name)
+
+            try:
+                with open(path + ".lz4", "ab") as data_file:
+                    offset = data_file.tell()
+                    data_file.write(frame)
+                with open(path + ".idx", "ab") as index_file:
+                    index_file.write(packer.pack((first_ts[name], offset)))
+            except OSError as e:
+                logger.error("Error while writing the tick segment %s: %s", name, e)
+                continue
+
+            self.written_bytes += len(frame)
+
+        self.recorded += count
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "buffered": len(self._buffer),
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written_bytes": self.written_bytes,
+        }
+
+
+def read_index(path: str) -> typing.List[typing.Tuple[int, int]]:
+    """
+    :param path: Segment path without extension
+    :return: [reception time of the first record, file offset] of each frame of the segment
+    """
+
+    try:
+        with open(path + ".idx", "rb") as index_file:
+            return [tuple(entry) for entry in msgpack.Unpacker(index_file)]
+    except FileNotFoundError:
+        return []
+
+
+def read_segment(
+    path: str,
+    start_ms: typing.Optional[int] = None,
+    end_ms: typing.Optional[int] = None,
+) -> typing.Iterator[typing.Tuple[int, str]]:
+    """
+    Messages of one segment in reception order.
+    :param path: Segment path without extension
+    :param start_ms: Reception time of the first message, included
+    :param end_ms: Reception time of the last message, excluded
+    :return: (reception time in ms, raw message)
+    """
+
+    offset = 0
+    if start_ms is not None:
+        # Last frame starting before start_ms, its first records are skipped below
+        for first_ts, frame_offset in read_index(path):
+            if first_ts > start_ms:
+                break
+            offset = frame_offset
+
+    with open(path + ".lz4", "rb") as data_file:
+        data_file.seek(offset)
+        compressed = data_file.read()
+
+    while compressed:
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        try:
+            records = decompressor.decompress(compressed)
+        except RuntimeError as e:
+            logger.warning("Corrupted tick segment %s: %s", path, e)
+            return
+        if not decompressor.eof:  # Last frame truncated by a crash
+            logger.warning("Truncated tick segment %s", path)
+            return
+        compressed = decompressor.unused_data
+
+        position = 0
+        while position < len(records):
+            (length,) = _LENGTH.unpack_from(records, position)
+            position += _LENGTH.size
+            ts, msg = msgpack.unpackb(records[position : position + length])
+            position += length
+
+            if start_ms is not None and ts < start_ms:
+                continue
+            if end_ms is not None and ts >= end_ms:
+                return
+            yield ts, msg
+
+
+def read_recording(
+    directory: str,
+    start_ms: typing.Optional[int] = None,
+    end_ms: typing.Optional[int] = None,
+) -> typing.Iterator[typing.Tuple[int, str]]:
+    """
+    Messages of all the segments of a directory in reception order.
+    :param directory:
+    :param start_ms: Reception time of the first message, included
+    :param end_ms: Reception time of the last message, excluded
+    :return: (reception time in ms, raw message)
+    """
+
+    for data_path in sorted(glob.glob(os.path.join(directory, "ticks_*.lz4"))):
+        path = data_path[: -len(".lz4")]
+        name = os.path.basename(path)
+
+        # Segments entirely outside of the range are not opened
+        if start_ms is not None and name < segment_name(start_ms):
+            continue
+        if end_ms is not None and name > segment_name(end_ms):
+            break
+
+        yield from read_segment(path, start_ms, end_ms)
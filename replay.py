@@ -0,0 +1,616 @@
+"""
+Replay recorded (see recorder.TickRecorder) or synthetic market data through BinanceClient._on_message, without
+the exchange. Run from the repository root: python replay.py --help
+"""
+
+import argparse
+import json
+import logging
+import time
+import typing
+import collections
+
+import numpy as np
+
+from models import *
+from connectors.binance import BinanceClient
+from candle_store import array_to_candles, INTERVAL_MS
+from recorder import read_recording
+from paper_trading import MatchingEngine
+from strategies import (
+    Strategy,
+    TechnicalStrategy,
+    BreakoutStrategy,
+    FractalStrategy,
+    DummyStrategy,
+    RuleStrategy,
+)
+
+logger = logging.getLogger()
+
+# Exchange name of the replayed strategies, keeps their indicator cache and rule graphs apart from the live ones
+REPLAY_EXCHANGE = "Replay"
+
+
+def make_contract(symbol: str, quote_asset: str = "USDT") -> Contract:
+    return Contract(
+        {
+            "symbol": symbol,
+            "baseAsset": symbol[: -len(quote_asset)],
+            "quoteAsset": quote_asset,
+            "pricePrecision": 2,
+            "quantityPrecision": 3,
+        },
+        "binance_futures",
+    )
+
+
+class ReplayClient(BinanceClient):
+    persistent = False
+
+    def __init__(
+        self,
+        contracts: typing.Dict[str, Contract],
+        futures: bool = True,
+        balance: float = 10000,
+        quote_asset: str = "USDT",
+        engine: typing.Optional[MatchingEngine] = None,
+    ):
+        """
+        A BinanceClient without network: the messages are given to _on_message() by ReplayEngine, the exchange
+        clock is the time of the last message, and the orders go to a mock gateway that fills the market orders
+        immediately at the top of book (or the last trade price before the first bookTicker).
+        The balance is fixed, the orders don't change it. The candle close timers are not used: the candles are
+        closed by the trades, so that a replay only depends on its messages.
+        :param contracts: symbol -> Contract of the replayed symbols
+        :param futures:
+        :param balance: Quote asset balance used by the trade sizes
+        :param quote_asset:
+        :param engine: Paper trading engine replacing the mock gateway and the fixed balance, its clock should be
+        the server_time() of the client, see make_paper_client()
+        """
+
+        self.futures = futures
+        self.platform = "binance_futures" if futures else "binance_spot"
+
+        self.contracts = contracts
+        self.prices = dict()
+        self.strategies: typing.Dict[int, Strategy] = dict()
+        self.logs = []
+
+        # Candle closes evaluated synchronously, in the order of the messages
+        self.evaluator = None
+        self._tick_batcher = None
+        self._recorder = None
+        self._received_ns = 0
+        self._received_perf_ns = 0
+
+        self.time_offset = 0
+        self.clock_ms = 0
+
+        if futures:
+            balance_info = {
+                "initialMargin": 0,
+                "maintMargin": 0,
+                "marginBalance": balance,
+                "walletBalance": balance,
+                "unrealizedProfit": 0,
+            }
+        else:
+            balance_info = {"free": balance, "locked": 0}
+        self.balances = {quote_asset: Balance(balance_info, self.platform)}
+
+        self.orders: typing.List[typing.Dict] = []
+        self._order_status: typing.Dict[int, OrderStatus] = dict()
+
+        self.engine = engine
+
+    def server_time(self) -> int:
+        return self.clock_ms
+
+    def _correct_time(self, trade_time: int):
+        if trade_time > self.clock_ms:
+            self.clock_ms = trade_time
+
+    def _record_exchange_latency(self, symbol: str, event_time: int):
+        # The replayed event times are in the past
+        pass
+
+    def get_balances(self) -> typing.Dict[str, Balance]:
+        if self.engine is not None:
+            return self.engine.get_balances()
+        return self.balances
+
+    def get_positions(self) -> typing.Optional[typing.Dict[str, float]]:
+        # The mock gateway doesn't keep positions
+        if self.engine is not None:
+            return self.engine.get_positions()
+        return None
+
+    def _on_book_ticker(self, data: typing.Dict):
+        super()._on_book_ticker(data)
+
+        if self.engine is not None:
+            prices = self.prices[data["s"]]
+            self.engine.on_book(
+                data["s"],
+                prices["bid"],
+                float(data["B"]),
+                prices["ask"],
+                float(data["A"]),
+            )
+
+    def _on_agg_trade(self, data: typing.Dict):
+        if self.engine is not None:
+            self.engine.on_trade(data["s"], float(data["p"]))
+        super()._on_agg_trade(data)
+
+    def _last_price(self, symbol: str) -> typing.Optional[float]:
+        for strategy in self.strategies.values():
+            if strategy.contract.symbol == symbol and len(strategy.candles) > 0:
+                return strategy.candles[-1].close
+        return None
+
+    def place_order(
+        self,
+        contract: Contract,
+        order_type: str,
+        quantity: float,
+        side: str,
+        price=None,
+        tif=None,
+        reduce_only: bool = False,
+    ) -> typing.Optional[OrderStatus]:
+        if self.engine is not None:
+            order_status = self.engine.place_order(
+                contract, order_type, quantity, side, price, reduce_only
+            )
+            if order_status is not None:
+                self.orders.append(
+                    {
+                        "order_id": order_status.order_id,
+                        "time": self.clock_ms,
+                        "symbol": contract.symbol,
+                        "type": order_type.upper(),
+                        "side": side.upper(),
+                        "quantity": quantity,
+                        "price": order_status.avg_price,
+                    }
+                )
+            return order_status
+
+        quantity = round(int(quantity / contract.lot_size) * contract.lot_size, 8)
+
+        if contract.symbol in self.prices:
+            book = self.prices[contract.symbol]
+            fill_price = book["ask"] if side.upper() == "BUY" else book["bid"]
+        else:
+            fill_price = self._last_price(contract.symbol)
+
+        if fill_price is None or quantity <= 0:
+            return None
+
+        order_id = len(self.orders) + 1
+        self.orders.append(
+            {
+                "order_id": order_id,
+                "time": self.clock_ms,
+                "symbol": contract.symbol,
+                "type": order_type.upper(),
+                "side": side.upper(),
+                "quantity": quantity,
+                "price": fill_price,
+            }
+        )
+
+        order_status = OrderStatus(
+            {
+                "orderId": order_id,
+                "status": "FILLED",
+                "avgPrice": fill_price,
+                "executedQty": quantity,
+            },
+            self.platform,
+        )
+        self._order_status[order_id] = order_status
+
+        return order_status
+
+    def get_order_status(
+        self, contract: Contract, order_id: int
+    ) -> typing.Optional[OrderStatus]:
+        if self.engine is not None:
+            return self.engine.get_order_status(order_id)
+        return self._order_status.get(order_id)
+
+    def cancel_order(
+        self, contract: Contract, order_id: int
+    ) -> typing.Optional[OrderStatus]:
+        if self.engine is not None:
+            return self.engine.cancel_order(order_id)
+        return self._order_status.get(order_id)
+
+
+def make_paper_client(
+    contracts: typing.Dict[str, Contract],
+    futures: bool = True,
+    balance: float = 10000,
+    quote_asset: str = "USDT",
+    **engine_params,
+) -> ReplayClient:
+    """
+    ReplayClient whose orders and balances are simulated by a paper_trading.MatchingEngine on the replayed book,
+    the latency of the engine is then in replay time.
+    :param contracts:
+    :param futures:
+    :param balance:
+    :param quote_asset:
+    :param engine_params: e.g. latency_ms, taker_fee
+    :return:
+    """
+
+    client = ReplayClient(contracts, futures, balance, quote_asset)
+    client.engine = MatchingEngine(
+        futures, client.server_time, balance, quote_asset, **engine_params
+    )
+    return client
+
+
+class ReplayEngine:
+    def __init__(self, client: ReplayClient, speed: typing.Optional[float] = None):
+        """
+        Feed a stream of messages through the dispatch of the client and measure it.
+        The stages are timed around BinanceClient._on_message() (whole dispatch), Strategy.parse_trades() (candle
+        update and TP/SL triggers), Strategy.check_trade() (signal and order) and the place_order() of the gateway.
+        Two replays of the same messages with the same strategies give the same trades.
+        :param client:
+        :param speed: None to replay as fast as possible, else N times the real time of the messages
+        """
+
+        self.client = client
+        self.speed = speed
+
+        self._latencies: typing.Dict[str, typing.List[int]] = collections.defaultdict(
+            list
+        )
+        self._messages = 0
+        self._elapsed_s = 0.0
+
+    def add_strategy(
+        self,
+        strategy_class: typing.Type[Strategy],
+        symbol: str,
+        timeframe: str,
+        params: typing.Dict,
+        history: np.ndarray,
+    ) -> Strategy:
+        """
+        :param strategy_class: e.g. TechnicalStrategy
+        :param symbol: Must be in client.contracts
+        :param timeframe:
+        :param params: The parameters given by the interface
+        :param history: Candles before the first message, see backtesting.candles_to_array()
+        :return:
+        """
+
+        strategy = strategy_class(
+            self.client,
+            self.client.contracts[symbol],
+            REPLAY_EXCHANGE,
+            timeframe,
+            params,
+        )
+        strategy.candles = array_to_candles(history, timeframe)
+        self.client.strategies[len(self.client.strategies)] = strategy
+
+        return strategy
+
+    def _timed(self, stage: str, function: typing.Callable) -> typing.Callable:
+        latencies = self._latencies[stage]
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter_ns() - start)
+
+        return timed
+
+    def _instrument(self):
+        # Instance attributes shadowing the methods for the duration of the run
+        for strategy in self.client.strategies.values():
+            strategy.parse_trades = self._timed("parse_trades", strategy.parse_trades)
+            strategy.check_trade = self._timed("check_trade", strategy.check_trade)
+        self.client.place_order = self._timed("place_order", self.client.place_order)
+
+    def _uninstrument(self):
+        for strategy in self.client.strategies.values():
+            del strategy.parse_trades
+            del strategy.check_trade
+        del self.client.place_order
+
+    def run(
+        self,
+        messages: typing.Iterable[typing.Tuple[int, str]],
+        max_messages: typing.Optional[int] = None,
+    ) -> typing.Dict:
+        """
+        :param messages: (time in ms, raw websocket message), e.g. from recorder.read_recording() or
+        synthetic_messages()
+        :param max_messages: Stop after this number of messages
+        :return: See report()
+        """
+
+        client = self.client
+        on_message = client._on_message
+        dispatch_latencies = self._latencies["on_message"]
+
+        self._instrument()
+
+        first_ts = None
+        start = time.perf_counter()
+
+        try:
+            for ts, msg in messages:
+                if max_messages is not None and self._messages >= max_messages:
+                    break
+
+                if self.speed is not None:
+                    if first_ts is None:
+                        first_ts = ts
+                    delay = (
+                        start
+                        + (ts - first_ts) / 1000 / self.speed
+                        - time.perf_counter()
+                    )
+                    if delay > 0:
+                        time.sleep(delay)
+
+                if ts > client.clock_ms:
+                    client.clock_ms = ts
+
+                dispatch_start = time.perf_counter_ns()
+                on_message(None, msg)
+                dispatch_latencies.append(time.perf_counter_ns() - dispatch_start)
+
+                self._messages += 1
+        finally:
+            self._elapsed_s += time.perf_counter() - start
+            self._uninstrument()
+
+        return self.report()
+
+    def report(self) -> typing.Dict:
+        """
+        :return: The throughput, the latency of each stage in microseconds, the orders of the gateway and the
+        trades of the strategies
+        """
+
+        stages = dict()
+        for stage, latencies in self._latencies.items():
+            if len(latencies) == 0:
+                continue
+            values = np.array(latencies, dtype=np.float64) / 1000
+            stages[stage] = {
+                "count": len(values),
+                "mean_us": float(values.mean()),
+                "p50_us": float(np.percentile(values, 50)),
+                "p99_us": float(np.percentile(values, 99)),
+                "max_us": float(values.max()),
+            }
+
+        trades = []
+        for strategy in self.client.strategies.values():
+            for trade in strategy.trades:
+                trades.append(
+                    {
+                        "time": trade.time,
+                        "strategy": strategy.strat_name,
+                        "symbol": strategy.contract.symbol,
+                        "timeframe": strategy.tf,
+                        "side": trade.side,
+                        "entry_price": trade.entry_price,
+                        "quantity": trade.quantity,
+                        "status": trade.status,
+                        "pnl": trade.pnl,
+                    }
+                )
+        trades.sort(key=lambda t: (t["time"], t["symbol"], t["strategy"]))
+
+        return {
+            "messages": self._messages,
+            "elapsed_s": self._elapsed_s,
+            "messages_per_s": (
+                self._messages / self._elapsed_s if self._elapsed_s > 0 else 0
+            ),
+            "stages": stages,
+            "orders": list(self.client.orders),
+            "trades": trades,
+        }
+
+
+def synthetic_messages(
+    symbols: typing.List[str],
+    n: int,
+    start_ms: int,
+    step_ms: float = 10,
+    start_price: float = 30000,
+    volatility: float = 0.0002,
+    book_ratio: float = 0.3,
+    seed: int = 0,
+) -> typing.Iterator[typing.Tuple[int, str]]:
+    """
+    Random walk aggTrade messages, with bookTicker messages around the last price, in the Binance Futures format.
+    :param symbols: The messages go to the symbols in turn
+    :param n: Number of messages
+    :param start_ms: Time of the first message
+    :param step_ms: Time between two messages
+    :param start_price:
+    :param volatility: Standard deviation of the trade to trade returns
+    :param book_ratio: Share of bookTicker messages
+    :param seed:
+    :return: (time in ms, raw message)
+    """
+
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0, volatility, n)
+    is_book = rng.random(n) < book_ratio
+    quantities = rng.gamma(2.0, 0.01, n)
+
+    prices = {symbol: start_price for symbol in symbols}
+
+    for i in range(n):
+        symbol = symbols[i % len(symbols)]
+        ts = int(start_ms + i * step_ms)
+
+        if is_book[i]:
+            price = prices[symbol]
+            msg = {
+                "e": "bookTicker",
+                "u": i,
+                "s": symbol,
+                "b": f"{price - 0.05:.2f}",
+                "B": "1.000",
+                "a": f"{price + 0.05:.2f}",
+                "A": "1.000",
+                "T": ts,
+                "E": ts,
+            }
+        else:
+            prices[symbol] *= np.exp(returns[i])
+            msg = {
+                "e": "aggTrade",
+                "E": ts,
+                "a": i,
+                "s": symbol,
+                "p": f"{prices[symbol]:.2f}",
+                "q": f"{quantities[i]:.3f}",
+                "T": ts,
+                "m": bool(returns[i] < 0),
+            }
+
+        yield ts, json.dumps(msg)
+
+
+STRATEGIES = {
+    "technical": (
+        TechnicalStrategy,
+        {
+            "rsi_length": 14,
+            "ema_fast": 12,
+            "ema_slow": 26,
+            "ema_signal": 9,
+            "balance_pct": 5,
+            "take_profit_pct": 1,
+            "stop_loss_pct": 1,
+        },
+    ),
+    "breakout": (
+        BreakoutStrategy,
+        {
+            "min_volume": 0,
+            "balance_pct": 5,
+            "take_profit_pct": 1,
+            "stop_loss_pct": 1,
+        },
+    ),
+    "fractals": (
+        FractalStrategy,
+        {
+            "ema_fast": 20,
+            "ema_slow": 50,
+            "ema_very_slow": 100,
+            "rsi_length": 14,
+            "risk_pct": 1,
+        },
+    ),
+    "dummy": (DummyStrategy, {"balance_pct": 5}),
+    "rules": (
+        RuleStrategy,
+        {
+            "buy_rule": "rsi(14) < 30",
+            "sell_rule": "rsi(14) > 70",
+            "balance_pct": 5,
+            "take_profit_pct": 1,
+            "stop_loss_pct": 1,
+        },
+    ),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--recording", help="Directory of a tick recording, else synthetic messages"
+    )
+    parser.add_argument("--symbols", default="BTCUSDT,ETHUSDT")
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--strategy", choices=sorted(STRATEGIES), default="technical")
+    parser.add_argument("--timeframe", default="1m")
+    parser.add_argument(
+        "--speed", type=float, help="N times real time, as fast as possible if unset"
+    )
+    parser.add_argument(
+        "--paper",
+        action="store_true",
+        help="Simulate the balances, fees and book depth with the paper trading engine",
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=0, help="Order latency with --paper"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    symbols = args.symbols.split(",")
+    contracts = {symbol: make_contract(symbol) for symbol in symbols}
+    if args.paper:
+        client = make_paper_client(contracts, latency_ms=args.latency_ms)
+    else:
+        client = ReplayClient(contracts)
+    engine = ReplayEngine(client, args.speed)
+
+    if args.recording:
+        messages = read_recording(args.recording)
+        first = next(read_recording(args.recording), None)
+        if first is None:
+            parser.error(f"No message in {args.recording}")
+        start_ms = first[0]
+    else:
+        start_ms = 1_600_000_000_000
+        messages = synthetic_messages(symbols, args.messages, start_ms)
+
+    # Flat history ending at the first message, the indicators warm up on the replayed candles
+    interval_ms = INTERVAL_MS[args.timeframe]
+    history = np.empty((6, 200), dtype=np.float64)
+    history[0] = start_ms // interval_ms * interval_ms - interval_ms * np.arange(
+        199, -1, -1
+    )
+    history[1:5] = 30000
+    history[5] = 0
+
+    strategy_class, params = STRATEGIES[args.strategy]
+    for symbol in symbols:
+        engine.add_strategy(strategy_class, symbol, args.timeframe, params, history)
+
+    report = engine.run(messages, args.messages)
+
+    print(
+        f"{report['messages']} messages in {report['elapsed_s']:.2f} s: "
+        f"{report['messages_per_s']:.0f} messages/s"
+    )
+    for stage, stats in report["stages"].items():
+        print(
+            f"  {stage:<13} {stats['count']:>8} calls  mean {stats['mean_us']:7.2f} us  "
+            f"p50 {stats['p50_us']:7.2f} us  p99 {stats['p99_us']:7.2f} us  max {stats['max_us']:8.1f} us"
+        )
+    print(f"{len(report['orders'])} orders, {len(report['trades'])} trades")
+    if client.engine is not None:
+        print(f"Paper trading: {client.engine.stats()}")
+        for asset, balance in client.get_balances().items():
+            print(f"  {asset}: {vars(balance)}")
+
+
+if __name__ == "__main__":
+    main()
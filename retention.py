@@ -0,0 +1,213 @@
+import logging
+import typing
+import os
+import re
+import sys
+import json
+import time
+import threading
+import weakref
+
+from scheduler import scheduler
+
+logger = logging.getLogger()
+
+
+class RetentionPolicy:
+    def __init__(
+        self,
+        max_items: typing.Optional[int] = None,
+        max_age_s: typing.Optional[float] = None,
+        timestamp: typing.Optional[typing.Callable[[typing.Any], int]] = None,
+        keep: typing.Optional[typing.Callable[[typing.Any], bool]] = None,
+        archive: bool = True,
+    ):
+        """
+        How many items of a container are kept in memory.
+        :param max_items: The oldest items above this number are evicted, None for no limit
+        :param max_age_s: Items older than this number of seconds are evicted, None for no limit
+        :param timestamp: Returns the timestamp of an item in milliseconds, required by max_age_s
+        :param keep: Items for which it returns True are never evicted (e.g. open trades), nor the ones after them
+        :param archive: Append the evicted items to a file instead of dropping them
+        """
+
+        if max_age_s is not None and timestamp is None:
+            raise ValueError("A timestamp function is required to evict by age")
+
+        self.max_items = max_items
+        self.max_age_s = max_age_s
+        self.timestamp = timestamp
+        self.keep = keep
+        self.archive = archive
+
+    def evictable(self, container: typing.List) -> int:
+        """
+        Number of items to evict from the head of the container, the oldest items being first.
+        :param container:
+        :return:
+        """
+
+        excess = len(container) - self.max_items if self.max_items is not None else 0
+        min_ts = (
+            (time.time() - self.max_age_s) * 1000
+            if self.max_age_s is not None
+            else None
+        )
+
+        count = 0
+        for item in container:
+            too_many = count < excess
+            too_old = min_ts is not None and self.timestamp(item) < min_ts
+            if not (too_many or too_old):
+                break
+            if self.keep is not None and self.keep(item):
+                break
+            count += 1
+
+        return count
+
+
+# Default policies: the strategies need the 1000 historical candles plus the ones built live
+CANDLES_POLICY = RetentionPolicy(max_items=2000)
+TRADES_POLICY = RetentionPolicy(
+    max_items=500, keep=lambda trade: trade.status == "open"
+)
+STOP_LIST_POLICY = RetentionPolicy(max_items=100)
+LOGS_POLICY = RetentionPolicy(
+    max_items=1000, keep=lambda log: not log["displayed"]
+)  # Not yet shown by the UI
+
+
+def _to_record(item: typing.Any) -> typing.Any:
+    if isinstance(item, (int, float, str, dict, list)) or item is None:
+        return item
+    return {
+        key: getattr(value, "symbol", value)  # A Contract is archived as its symbol
+        for key, value in vars(item).items()
+    }
+
+
+def _size_of(item: typing.Any) -> int:
+    size = sys.getsizeof(item)
+
+    if hasattr(item, "__dict__"):
+        item = vars(item)
+        size += sys.getsizeof(item)
+
+    if isinstance(item, dict):
+        size += sum(sys.getsizeof(value) for value in item.values())
+
+    return size
+
+
+class RetentionManager:
+    def __init__(self, archive_dir: str = "archive", interval_s: float = 60):
+        """
+        Bound the containers that grow with the uptime (candles, trades, logs...) according to their
+        RetentionPolicy. The containers are checked every interval_s on the scheduler thread, their oldest
+        items are appended to archive_dir/<container name>.jsonl before being removed from memory.
+        The evicted items are removed from the head of the lists with a single slice deletion, so the threads
+        appending to the lists or reading their last items are not disturbed.
+        :param archive_dir:
+        :param interval_s:
+        """
+
+        self.archive_dir = archive_dir
+        self.interval_s = interval_s
+        self.evicted = 0
+
+        # name -> (weak reference to the owner, attribute holding the list, policy)
+        self._containers: typing.Dict[
+            str, typing.Tuple[weakref.ref, str, RetentionPolicy]
+        ] = dict()
+        self._lock = threading.Lock()
+        self._job = None
+
+    def register(
+        self, name: str, owner: typing.Any, attr: str, policy: RetentionPolicy
+    ):
+        """
+        :param name: Unique name of the container, also the name of its archive file
+        :param owner: The object holding the list, only weakly referenced: the container is forgotten with it
+        :param attr: Attribute name of the list, read at each check so the list can be replaced
+        :param policy:
+        :return:
+        """
+
+        with self._lock:
+            self._containers[name] = (weakref.ref(owner), attr, policy)
+
+    def unregister(self, name: str):
+        with self._lock:
+            self._containers.pop(name, None)
+
+    def start(self):
+        if self._job is None:
+            self._job = scheduler.call_every(self.interval_s, self.enforce)
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+
+    def _live_containers(
+        self,
+    ) -> typing.List[typing.Tuple[str, typing.List, RetentionPolicy]]:
+        live = []
+
+        with self._lock:
+            for name, (owner_ref, attr, policy) in list(self._containers.items()):
+                owner = owner_ref()
+                if owner is None:
+                    del self._containers[name]
+                    continue
+                live.append((name, getattr(owner, attr), policy))
+
+        return live
+
+    def enforce(self):
+        for name, container, policy in self._live_containers():
+            count = policy.evictable(container)
+            if count == 0:
+                continue
+
+            evicted = container[:count]
+
+            if policy.archive:
+                try:
+                    self._archive(name, evicted)
+                except OSError as e:
+                    logger.error("Error while archiving %s: %s", name, e)
+                    continue  # Kept in memory rather than lost
+
+            del container[:count]
+            self.evicted += count
+
+    def _archive(self, name: str, items: typing.List):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        file_name = re.sub(r"[^\w.-]", "_", name) + ".jsonl"
+
+        with open(os.path.join(self.archive_dir, file_name), "a") as file:
+            for item in items:
+                file.write(json.dumps(_to_record(item), default=str) + "\n")
+
+    def memory_report(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """
+        Approximate resident memory of each container: the list, its items and their attributes.
+        Objects shared between items (e.g. the Contract of the trades) are not counted.
+        :return: name -> {"items": number of items, "bytes": size}
+        """
+
+        report = dict()
+
+        for name, container, policy in self._live_containers():
+            items = list(container)
+            report[name] = {
+                "items": len(items),
+                "bytes": sys.getsizeof(items) + sum(_size_of(item) for item in items),
+            }
+
+        return report
+
+
+retention = RetentionManager()
@@ -0,0 +1,565 @@
+import logging
+import typing
+import ast
+import collections
+import threading
+
+import numpy as np
+
+logger = logging.getLogger()
+
+# Values of the candle that just closed, lag n for the candle n periods before it.
+# "price" is the first price of the new candle: the open of the next candle in a backtest.
+FIELDS = ["open", "high", "low", "close", "volume", "price"]
+
+# Indicator name -> (number of parameters, outputs for the multi-output indicators)
+INDICATORS = {
+    "ema": (1, None),
+    "sma": (1, None),
+    "rsi": (1, None),
+    "volume_mean": (1, None),
+    "macd": (3, ("line", "signal", "hist")),
+}
+
+_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+    ast.And: np.logical_and,
+    ast.Or: np.logical_or,
+}
+
+
+# Compiled expressions: evaluated on NumPy arrays in a backtest and on scalars in live trading, the sources
+# (ArraySource, LiveSource) decide which.
+
+
+class _Expression:
+    condition = False  # True if the expression evaluates to booleans
+
+    def evaluate(self, source) -> typing.Any:
+        raise NotImplementedError
+
+
+class _Constant(_Expression):
+    def __init__(self, value: float):
+        self.value = value
+        self.condition = isinstance(value, bool)
+
+    def evaluate(self, source) -> typing.Any:
+        return self.value
+
+
+class _Field(_Expression):
+    def __init__(self, name: str, lag: int = 0):
+        self.name = name
+        self.lag = lag
+
+    def evaluate(self, source) -> typing.Any:
+        return source.field(self.name, self.lag)
+
+
+class _Indicator(_Expression):
+    def __init__(
+        self,
+        name: str,
+        params: typing.Tuple,
+        output: typing.Optional[str],
+        lag: int = 0,
+    ):
+        self.name = name
+        self.params = params
+        self.output = output
+        self.lag = lag
+
+    def evaluate(self, source) -> typing.Any:
+        return source.indicator(self.name, self.params, self.output, self.lag)
+
+
+class _Operation(_Expression):
+    def __init__(self, function: typing.Callable, operands: typing.List[_Expression]):
+        self.function = function
+        self.operands = operands
+        self.condition = function not in (
+            np.add,
+            np.subtract,
+            np.multiply,
+            np.true_divide,
+            np.negative,
+        )
+
+    def evaluate(self, source) -> typing.Any:
+        return self.function(*(operand.evaluate(source) for operand in self.operands))
+
+
+class _Compiler:
+    def __init__(self, params: typing.Dict):
+        self.params = params
+        self.indicators: typing.Dict[typing.Tuple[str, typing.Tuple], int] = dict()
+        self._last_call: typing.Dict[str, typing.Tuple] = dict()
+
+    def compile(self, node: ast.AST) -> _Expression:
+        if isinstance(node, ast.BoolOp):
+            function = _OPERATORS[type(node.op)]
+            expression = self.compile(node.values[0])
+            for value in node.values[1:]:
+                expression = _Operation(function, [expression, self.compile(value)])
+            return expression
+
+        if isinstance(node, ast.UnaryOp):
+            operand = self.compile(node.operand)
+            if isinstance(node.op, ast.Not):
+                return _Operation(np.logical_not, [operand])
+            if isinstance(node.op, ast.USub):
+                return _Operation(np.negative, [operand])
+            if isinstance(node.op, ast.UAdd):
+                return operand
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            return _Operation(
+                _OPERATORS[type(node.op)],
+                [self.compile(node.left), self.compile(node.right)],
+            )
+
+        if isinstance(node, ast.Compare):
+            # a < b < c is a < b and b < c
+            operands = [self.compile(node.left)] + [
+                self.compile(c) for c in node.comparators
+            ]
+            expression = None
+            for i, op in enumerate(node.ops):
+                if type(op) not in _OPERATORS:
+                    break
+                comparison = _Operation(
+                    _OPERATORS[type(op)], [operands[i], operands[i + 1]]
+                )
+                expression = (
+                    comparison
+                    if expression is None
+                    else _Operation(np.logical_and, [expression, comparison])
+                )
+            else:
+                return expression
+
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return _Constant(node.value)
+
+        if isinstance(node, ast.Name):
+            if node.id in FIELDS:
+                return _Field(node.id)
+            if node.id in INDICATORS:
+                raise ValueError(f"{node.id} needs its parameters, e.g. {node.id}(14)")
+            return _Constant(self._param(node))
+
+        if isinstance(node, ast.Call):
+            return self._indicator(node, None)
+
+        if isinstance(node, ast.Attribute):
+            if isinstance(node.value, ast.Call):
+                return self._indicator(node.value, node.attr)
+            if isinstance(node.value, ast.Name) and node.value.id in self._last_call:
+                # macd.signal: the macd of the rule called last, e.g. "macd(12, 26, 9).line > macd.signal"
+                return self._output(
+                    node.value.id, self._last_call[node.value.id], node.attr
+                )
+
+        if isinstance(node, ast.Subscript):
+            expression = self.compile(node.value)
+            lag = node.slice
+            if not (
+                isinstance(lag, ast.Constant)
+                and isinstance(lag.value, int)
+                and lag.value >= 0
+            ) or not isinstance(expression, (_Field, _Indicator)):
+                raise ValueError(
+                    "Only a field or an indicator can be shifted, by a positive integer: close[1]"
+                )
+            expression.lag = lag.value
+            if isinstance(expression, _Indicator):
+                key = (expression.name, expression.params)
+                self.indicators[key] = max(self.indicators[key], lag.value)
+            return expression
+
+        raise ValueError(f"Unsupported expression: {ast.unparse(node)}")
+
+    def _param(self, node: ast.AST) -> float:
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return node.value
+        if isinstance(node, ast.Name) and isinstance(
+            self.params.get(node.id), (int, float)
+        ):
+            return self.params[node.id]
+        raise ValueError(
+            f"{ast.unparse(node)} is neither a number nor a numeric parameter"
+        )
+
+    def _indicator(self, call: ast.Call, output: typing.Optional[str]) -> _Indicator:
+        if not isinstance(call.func, ast.Name) or call.func.id not in INDICATORS:
+            raise ValueError(
+                f"Unknown indicator {ast.unparse(call.func)}, available: {', '.join(INDICATORS)}"
+            )
+
+        name = call.func.id
+        n_params, _ = INDICATORS[name]
+
+        if len(call.args) != n_params or call.keywords:
+            raise ValueError(f"{name} takes {n_params} parameter(s)")
+
+        params = tuple(int(self._param(arg)) for arg in call.args)
+        self._last_call[name] = params
+
+        return self._output(name, params, output)
+
+    def _output(
+        self, name: str, params: typing.Tuple, output: typing.Optional[str]
+    ) -> _Indicator:
+        outputs = INDICATORS[name][1]
+
+        if outputs is None and output is not None:
+            raise ValueError(f"{name} has no output {output}")
+        if outputs is not None and output not in outputs:
+            raise ValueError(f"{name} needs one of the outputs: {', '.join(outputs)}")
+
+        self.indicators.setdefault((name, params), 0)
+        return _Indicator(name, params, output)
+
+
+class Rule:
+    def __init__(self, text: str, params: typing.Optional[typing.Dict] = None):
+        """
+        A condition on indicators and candle fields, e.g. "rsi(14) < 30 and macd(12, 26, 9).line > macd.signal".
+        The same compiled rule is evaluated on NumPy arrays by the backtester and on the last closed candle by
+        the live strategies, see ArraySource and LiveSource.
+        Syntax: comparisons, and/or/not, + - * /, numbers, candle fields (open, high, low, close, volume, price),
+        indicators (ema(span), sma(n), rsi(length), volume_mean(n), macd(fast, slow, signal).line/.signal/.hist)
+        and a lag in candles with [n], e.g. close[1] is the close of the candle before the last closed one.
+        :param text:
+        :param params: Names usable in place of numbers in the rule, e.g. "rsi(rsi_length) < oversold"
+        """
+
+        self.text = text
+
+        try:
+            tree = ast.parse(text.strip(), mode="eval")
+        except SyntaxError as e:
+            raise ValueError(f"Invalid rule {text!r}: {e.msg}")
+
+        compiler = _Compiler(params or dict())
+        self._expression = compiler.compile(tree.body)
+
+        if not self._expression.condition:
+            raise ValueError(f"The rule {text!r} is not a condition")
+
+        # (name, params) -> largest lag used
+        self.indicators = compiler.indicators
+
+    def evaluate(self, source: typing.Union["ArraySource", "LiveSource"]) -> typing.Any:
+        with np.errstate(all="ignore"):  # NaN values compare as False, as in pandas
+            return self._expression.evaluate(source)
+
+
+def _shift(values: np.ndarray, lag: int) -> np.ndarray:
+    if lag == 0:
+        return values
+    shifted = np.full(values.shape, np.nan)
+    shifted[lag:] = values[:-lag]
+    return shifted
+
+
+class ArraySource:
+    def __init__(self, backtester):
+        """
+        Values of a rule for every candle of a backtest: index i is evaluated at the close of candle i.
+        :param backtester: A backtesting.Backtester, whose indicator() cache is shared with the other strategies
+        """
+
+        self.backtester = backtester
+
+    def field(self, name: str, lag: int) -> np.ndarray:
+        data = self.backtester.data
+
+        if name == "price":
+            values = np.full(data.shape[1], np.nan)
+            values[:-1] = data[1, 1:]  # Open of the next candle
+            return values
+
+        return _shift(data[FIELDS.index(name) + 1], lag)
+
+    def indicator(
+        self, name: str, params: typing.Tuple, output: typing.Optional[str], lag: int
+    ) -> np.ndarray:
+        values = self.backtester.indicator(name, params)
+
+        if output is not None:
+            line, signal = values
+            values = {"line": line, "signal": signal, "hist": line - signal}[output]
+
+        return _shift(values, lag)
+
+    def run(self, rule: Rule) -> np.ndarray:
+        n = self.backtester.data.shape[1]
+        return np.broadcast_to(rule.evaluate(self), (n,)).astype(bool)
+
+
+# Live trading: one graph of incrementally updated indicators per candle series, shared by all the rules of all
+# the strategies on the series. Each closed candle updates every node once, in O(1) for most indicators, instead
+# of recomputing the indicators over the whole history.
+
+
+class _Node:
+    def __init__(self):
+        self.values = collections.deque(maxlen=1)
+
+    def reset(self):
+        self.values.clear()
+
+    def step(self, candle):
+        raise NotImplementedError
+
+    def value(self, output: typing.Optional[str], lag: int) -> float:
+        if lag >= len(self.values):
+            return np.nan
+        return self.values[-1 - lag]
+
+
+class _EwmNode(_Node):
+    # Same recursion as indicators._ewm(), i.e. pandas ewm(adjust=True)
+    def __init__(self, alpha: float):
+        super().__init__()
+        self.w = 1 - alpha
+        self.num = 0.0
+        self.den = 0.0
+
+    def reset(self):
+        super().reset()
+        self.num = 0.0
+        self.den = 0.0
+
+    def push(self, x: float) -> float:
+        self.num = x + self.w * self.num
+        self.den = 1 + self.w * self.den
+        return self.num / self.den
+
+
+class _EmaNode(_EwmNode):
+    def __init__(self, span: int):
+        super().__init__(2 / (span + 1))
+
+    def step(self, candle):
+        self.values.append(self.push(candle.close))
+
+
+class _RsiNode(_Node):
+    def __init__(self, length: int):
+        super().__init__()
+        self.length = length
+        self.gain = _EwmNode(1 / length)
+        self.loss = _EwmNode(1 / length)
+        self.prev = None
+        self.count = 0
+
+    def reset(self):
+        super().reset()
+        self.gain.reset()
+        self.loss.reset()
+        self.prev = None
+        self.count = 0
+
+    def step(self, candle):
+        if self.prev is None:
+            self.prev = candle.close
+            self.values.append(np.nan)
+            return
+
+        delta = candle.close - self.prev
+        self.prev = candle.close
+        self.count += 1
+
+        avg_gain = np.float64(self.gain.push(max(delta, 0.0)))
+        avg_loss = np.float64(self.loss.push(max(-delta, 0.0)))
+
+        if self.count < self.length:
+            self.values.append(np.nan)
+        else:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                self.values.append(np.round(100 - 100 / (1 + avg_gain / avg_loss), 2))
+
+
+class _MacdNode(_Node):
+    def __init__(self, ema_fast: int, ema_slow: int, ema_signal: int):
+        super().__init__()
+        # Its own EMAs rather than the ema() nodes, so that the node can be rebuilt alone
+        self.ema_fast = _EwmNode(2 / (ema_fast + 1))
+        self.ema_slow = _EwmNode(2 / (ema_slow + 1))
+        self.signal = _EwmNode(2 / (ema_signal + 1))
+
+    def reset(self):
+        super().reset()
+        self.ema_fast.reset()
+        self.ema_slow.reset()
+        self.signal.reset()
+
+    def step(self, candle):
+        line = self.ema_fast.push(candle.close) - self.ema_slow.push(candle.close)
+        self.values.append((line, self.signal.push(line)))
+
+    def value(self, output: typing.Optional[str], lag: int) -> float:
+        if lag >= len(self.values):
+            return np.nan
+        line, signal = self.values[-1 - lag]
+        return {"line": line, "signal": signal, "hist": line - signal}[output]
+
+
+class _RollingMeanNode(_Node):
+    def __init__(self, field: str, window: int):
+        super().__init__()
+        self.field = field
+        self.window = collections.deque(maxlen=window)
+
+    def reset(self):
+        super().reset()
+        self.window.clear()
+
+    def step(self, candle):
+        self.window.append(getattr(candle, self.field))
+        if len(self.window) < self.window.maxlen:
+            self.values.append(np.nan)
+        else:
+            self.values.append(sum(self.window) / self.window.maxlen)
+
+
+class LiveGraph:
+    def __init__(self):
+        """
+        Indicators of one candle series, updated with each closed candle. A node used by several rules is
+        computed once.
+        """
+
+        self.lock = threading.RLock()
+        self._nodes: typing.Dict[typing.Tuple, _Node] = dict()
+        self._new_nodes: typing.Set[typing.Tuple] = (
+            set()
+        )  # Built from the first candle at the next update
+        self._last_ts = None
+        self._last_close = None
+
+    def require(self, required: typing.Dict[typing.Tuple[str, typing.Tuple], int]):
+        """
+        Add the nodes needed by a rule. Only the new nodes (or the ones that have to keep more values for a
+        larger lag) are computed from the first candle at the next update, the others stay incremental.
+        :param required: Rule.indicators
+        :return:
+        """
+
+        with self.lock:
+            for (name, params), lag in required.items():
+                key = (name, params)
+
+                if key not in self._nodes:
+                    if name == "ema":
+                        self._nodes[key] = _EmaNode(*params)
+                    elif name == "rsi":
+                        self._nodes[key] = _RsiNode(*params)
+                    elif name == "sma":
+                        self._nodes[key] = _RollingMeanNode("close", *params)
+                    elif name == "volume_mean":
+                        self._nodes[key] = _RollingMeanNode("volume", *params)
+                    elif name == "macd":
+                        self._nodes[key] = _MacdNode(*params)
+                    else:
+                        raise ValueError(f"Unknown indicator {name}")
+                    self._new_nodes.add(key)
+
+                node = self._nodes[key]
+                if node.values.maxlen < lag + 1:
+                    node.values = collections.deque(maxlen=lag + 1)
+                    self._new_nodes.add(key)
+
+    def update(self, candles: typing.List):
+        """
+        Bring the nodes up to the last closed candle, candles[-2]. Only the candles closed since the previous update
+        are processed, unless the history changed (e.g. a late trade modified the last closed candle).
+        :param candles:
+        :return:
+        """
+
+        with self.lock:
+            closed = len(candles) - 1
+            start = None
+
+            if self._last_ts is not None:
+                for i in range(closed - 1, -1, -1):
+                    if candles[i].timestamp == self._last_ts:
+                        if candles[i].close == self._last_close:
+                            start = i + 1
+                        break
+                    if candles[i].timestamp < self._last_ts:
+                        break
+
+            if start is None:
+                for node in self._nodes.values():
+                    node.reset()
+                start = 0
+            else:
+                for key in self._new_nodes:
+                    node = self._nodes[key]
+                    node.reset()
+                    for i in range(start):
+                        node.step(candles[i])
+
+            self._new_nodes.clear()
+
+            for i in range(start, closed):
+                for node in self._nodes.values():
+                    node.step(candles[i])
+
+            if closed > 0:
+                self._last_ts = candles[closed - 1].timestamp
+                self._last_close = candles[closed - 1].close
+
+    def value(
+        self, name: str, params: typing.Tuple, output: typing.Optional[str], lag: int
+    ) -> float:
+        return self._nodes[(name, params)].value(output, lag)
+
+
+_graphs: typing.Dict[typing.Tuple, LiveGraph] = dict()
+_graphs_lock = threading.Lock()
+
+
+def live_graph(series_id: typing.Tuple) -> LiveGraph:
+    with _graphs_lock:
+        if series_id not in _graphs:
+            _graphs[series_id] = LiveGraph()
+        return _graphs[series_id]
+
+
+class LiveSource:
+    def __init__(self, candles: typing.List, graph: LiveGraph):
+        """
+        Values of a rule at the close of candles[-2], the last candle being the one just opened.
+        :param candles:
+        :param graph: Updated to candles[-2]
+        """
+
+        self.candles = candles
+        self.graph = graph
+
+    def field(self, name: str, lag: int) -> float:
+        if name == "price":
+            return self.candles[-1].close
+        if lag + 2 > len(self.candles):
+            return np.nan
+        return getattr(self.candles[-2 - lag], name)
+
+    def indicator(
+        self, name: str, params: typing.Tuple, output: typing.Optional[str], lag: int
+    ) -> float:
+        return self.graph.value(name, params, output, lag)
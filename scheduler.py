@@ -0,0 +1,235 @@
+import logging
+import typing
+import heapq
+import itertools
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger()
+
+# Threads running the blocking jobs (REST requests), see Scheduler.call_later()
+BLOCKING_WORKERS = 4
+
+
+class Job:
+    __slots__ = (
+        "when",
+        "interval",
+        "callback",
+        "args",
+        "name",
+        "blocking",
+        "running",
+        "cancelled",
+    )
+
+    def __init__(
+        self,
+        when: float,
+        interval: typing.Optional[float],
+        callback: typing.Callable,
+        args: typing.Tuple,
+        name: str,
+        blocking: bool = False,
+    ):
+        self.when = when  # time.monotonic() of the next run
+        self.interval = interval  # None for a one-shot job
+        self.callback = callback
+        self.args = args
+        self.name = name
+        self.blocking = blocking
+        self.running = False  # A blocking job still running on a worker thread
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler:
+    def __init__(self):
+        """
+        Runs the delayed and periodic jobs of the whole program (order polling, UI refresh, candle closes...)
+        on a single thread, instead of one threading.Timer or threading.Thread per job.
+        The jobs share the thread, so they should not block for long: their lateness shows when they do.
+        The jobs that wait on the network are scheduled with blocking=True and run on a few worker threads.
+        """
+
+        self.jobs_run = 0
+        self.max_lateness = 0.0  # Seconds
+        self.last_lateness = 0.0
+        self._total_lateness = 0.0
+
+        self._queue: typing.List[typing.Tuple[float, int, Job]] = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._running = False
+        self._blocking_executor: typing.Optional[ThreadPoolExecutor] = None
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> typing.Dict[str, float]:
+        """
+        Health of the scheduler. The lateness is the delay between the time a job was due and the time it started.
+        :return:
+        """
+
+        return {
+            "queue_depth": self.queue_depth,
+            "jobs_run": self.jobs_run,
+            "avg_lateness_ms": (
+                self._total_lateness / self.jobs_run * 1000 if self.jobs_run else 0
+            ),
+            "max_lateness_ms": self.max_lateness * 1000,
+            "last_lateness_ms": self.last_lateness * 1000,
+        }
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(
+                target=self._run, name="scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+        if self._blocking_executor is not None:
+            self._blocking_executor.shutdown(wait=False)
+            self._blocking_executor = None
+
+    def call_later(
+        self,
+        delay: float,
+        callback: typing.Callable,
+        *args,
+        name: str = "",
+        blocking: bool = False,
+    ) -> Job:
+        """
+        Run callback(*args) once, after delay seconds.
+        :param blocking: The callback waits on I/O (REST requests, the request weight limiter): it runs on a
+        worker thread so that it doesn't delay the other jobs
+        :return: The Job, to cancel it
+        """
+
+        return self._push(
+            Job(
+                time.monotonic() + delay,
+                None,
+                callback,
+                args,
+                name or callback.__name__,
+                blocking,
+            )
+        )
+
+    def call_every(
+        self,
+        interval: float,
+        callback: typing.Callable,
+        *args,
+        delay: typing.Optional[float] = None,
+        name: str = "",
+        blocking: bool = False,
+    ) -> Job:
+        """
+        Run callback(*args) every interval seconds, until the Job is cancelled.
+        A run that starts late doesn't make the next ones run in a burst, the missed runs are skipped.
+        :param delay: Delay before the first run, defaults to interval
+        :param blocking: See call_later(), a run is skipped while the previous one is still running
+        :return: The Job, to cancel it
+        """
+
+        first = time.monotonic() + (interval if delay is None else delay)
+        return self._push(
+            Job(first, interval, callback, args, name or callback.__name__, blocking)
+        )
+
+    def call_at(
+        self, timestamp: float, callback: typing.Callable, *args, name: str = ""
+    ) -> Job:
+        """
+        Run callback(*args) once at a Unix timestamp (time.time() clock), e.g. a candle boundary.
+        :return: The Job, to cancel it
+        """
+
+        return self.call_later(
+            max(timestamp - time.time(), 0), callback, *args, name=name
+        )
+
+    def _push(self, job: Job) -> Job:
+        with self._condition:
+            heapq.heappush(self._queue, (job.when, next(self._seq), job))
+            self._condition.notify()
+
+        if not self._running:
+            self.start()
+
+        return job
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running:
+                    if self._queue and self._queue[0][2].cancelled:
+                        heapq.heappop(self._queue)
+                        continue
+
+                    now = time.monotonic()
+                    if self._queue and self._queue[0][0] <= now:
+                        break
+
+                    timeout = self._queue[0][0] - now if self._queue else None
+                    self._condition.wait(timeout)
+
+                if not self._running:
+                    break
+
+                when, _, job = heapq.heappop(self._queue)
+
+            lateness = now - when
+            self.jobs_run += 1
+            self.last_lateness = lateness
+            self._total_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+
+            if job.blocking:
+                if not job.running:
+                    job.running = True
+                    if self._blocking_executor is None:
+                        self._blocking_executor = ThreadPoolExecutor(
+                            BLOCKING_WORKERS, thread_name_prefix="scheduler-io"
+                        )
+                    self._blocking_executor.submit(self._run_blocking, job)
+            else:
+                try:
+                    job.callback(*job.args)
+                except Exception as e:  # A failing job must not stop the other ones
+                    logger.error("Error in scheduled job %s: %s", job.name, e)
+
+            if job.interval is not None and not job.cancelled:
+                job.when = max(job.when + job.interval, time.monotonic())
+                with self._condition:
+                    heapq.heappush(self._queue, (job.when, next(self._seq), job))
+
+    @staticmethod
+    def _run_blocking(job: Job):
+        try:
+            job.callback(*job.args)
+        except Exception as e:
+            logger.error("Error in scheduled job %s: %s", job.name, e)
+        finally:
+            job.running = False
+
+
+scheduler = Scheduler()
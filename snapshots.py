@@ -0,0 +1,240 @@
+import logging
+import typing
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import weakref
+
+import numpy as np
+
+from models import *
+from database import get_database
+from scheduler import scheduler
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+
+def snapshot_key(strategy: "Strategy") -> str:
+    """
+    Identifies a strategy across restarts: same interface row (see Strategy.set_strategy_id()), market data source
+    (testnet or not, Spot or Futures, see BinanceClient.candle_source), type, market and parameters.
+    A strategy created outside of the interface has no row: its snapshot is never resumed by another one.
+    :param strategy:
+    :return:
+    """
+
+    params = json.dumps(strategy.params, sort_keys=True, default=str)
+    digest = hashlib.sha1(params.encode()).hexdigest()[:12]
+    identity = (
+        strategy.strategy_id
+        if strategy.strategy_id is not None
+        else f"{id(strategy):x}"
+    )
+    return (
+        f"{strategy.client.candle_source}_{identity}_{strategy.strat_name}_{strategy.contract.symbol}_"
+        f"{strategy.tf}_{digest}"
+    )
+
+
+def pack_candles(candles: typing.List[Candle]) -> bytes:
+    data = np.array(
+        [[c.timestamp, c.open, c.high, c.low, c.close, c.volume] for c in candles],
+        dtype=np.float64,
+    )
+    return zlib.compress(data.tobytes())
+
+
+def unpack_candles(blob: bytes, timeframe: str) -> typing.List[Candle]:
+    data = np.frombuffer(zlib.decompress(blob), dtype=np.float64).reshape(-1, 6)
+    return [
+        Candle(
+            {
+                "ts": int(row[0]),
+                "open": float(row[1]),
+                "high": float(row[2]),
+                "low": float(row[3]),
+                "close": float(row[4]),
+                "volume": float(row[5]),
+            },
+            timeframe,
+            "parse_trade",
+        )
+        for row in data
+    ]
+
+
+class SnapshotStore:
+    def __init__(self, path: str = "database.db", interval_s: float = 60):
+        """
+        Periodic snapshots of the active strategies, so that a restart resumes from them instead of downloading
+        the whole history again: the candles (compressed float64 array) and the state returned by
+        Strategy.get_state() (open trades, stop lists...). The indicators are not stored, they are recomputed
+        from the restored candles and give the same values.
+        A strategy is only written again when its last candle or its state changed, and its previous snapshot is
+        replaced when its parameters change (see Strategy.update_params()).
+        :param path: SQLite database, the one of the workspace by default
+        :param interval_s:
+        """
+
+        self.path = path
+        self.interval_s = interval_s
+        self._table_created = False
+
+        self._lock = threading.Lock()
+        self._strategies: typing.Dict[int, weakref.ref] = dict()
+        self._keys: typing.Dict[int, str] = dict()  # id of the strategy -> its key
+        self._saved: typing.Dict[str, typing.Tuple] = dict()  # key -> last signature
+        self._job = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connection of the calling thread (scheduler or Tkinter), see database.Database
+        conn = get_database(self.path).connection()
+        if not self._table_created:
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS snapshots (key TEXT PRIMARY KEY, saved_at INTEGER, candles BLOB, state TEXT)"
+                )
+            self._table_created = True
+        return conn
+
+    def register(self, strategy: "Strategy"):
+        if not strategy.client.persistent:
+            return
+
+        with self._lock:
+            self._strategies[id(strategy)] = weakref.ref(strategy)
+
+    def unregister(self, strategy: "Strategy"):
+        """
+        Stop saving a strategy, its last snapshot is written first so that it can be resumed later.
+        :param strategy:
+        :return:
+        """
+
+        with self._lock:
+            self._strategies.pop(id(strategy), None)
+
+        self.save(strategy)
+        self._keys.pop(id(strategy), None)
+
+    def start(self):
+        if self._job is None:
+            self._job = scheduler.call_every(self.interval_s, self.save_all)
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+
+    def save_all(self):
+        with self._lock:
+            strategies = []
+            for strategy_id, strategy_ref in list(self._strategies.items()):
+                strategy = strategy_ref()
+                if strategy is None:
+                    del self._strategies[strategy_id]
+                    self._keys.pop(strategy_id, None)
+                    continue
+                strategies.append(strategy)
+
+        for strategy in strategies:
+            try:
+                self.save(strategy)
+            except (sqlite3.Error, ValueError, TypeError) as e:
+                logger.error(
+                    "Error while saving the snapshot of %s %s: %s",
+                    strategy.strat_name,
+                    strategy.contract.symbol,
+                    e,
+                )
+
+    def save(self, strategy: "Strategy") -> bool:
+        """
+        :param strategy:
+        :return: False if the snapshot was already up to date, or the client is not persistent
+        """
+
+        if not strategy.client.persistent:
+            return False
+
+        with strategy._candle_lock:
+            candles = list(strategy.candles)
+            state = json.dumps(strategy.get_state(), default=str)
+
+        if len(candles) == 0:
+            return False
+
+        key = snapshot_key(strategy)
+        last = candles[-1]
+        signature = (
+            len(candles),
+            last.timestamp,
+            last.close,
+            last.volume,
+            state,
+        )
+
+        if self._saved.get(key) == signature:
+            return False
+
+        blob = pack_candles(candles)
+        previous_key = self._keys.get(id(strategy))
+
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots (key, saved_at, candles, state) VALUES (?, ?, ?, ?)",
+                (key, int(time.time() * 1000), blob, state),
+            )
+            if previous_key is not None and previous_key != key:
+                # Parameters changed: the old snapshot would resume trades now saved under the new key
+                conn.execute("DELETE FROM snapshots WHERE key = ?", (previous_key,))
+                self._saved.pop(previous_key, None)
+
+        self._saved[key] = signature
+        self._keys[id(strategy)] = key
+        return True
+
+    def load(self, strategy: "Strategy") -> bool:
+        """
+        Restore the candles and the state of a strategy from its last snapshot.
+        The candles of the gap since the snapshot still have to be downloaded, see BinanceClient.backfill_candles().
+        :param strategy:
+        :return: False if there is no snapshot for the strategy, or the client is not persistent
+        """
+
+        if not strategy.client.persistent:
+            return False
+
+        row = (
+            self._connection()
+            .execute(
+                "SELECT candles, state FROM snapshots WHERE key = ?",
+                (snapshot_key(strategy),),
+            )
+            .fetchone()
+        )
+
+        if row is None:
+            return False
+
+        try:
+            candles = unpack_candles(row[0], strategy.tf)
+            state = json.loads(row[1])
+        except (zlib.error, ValueError) as e:
+            logger.error("Invalid snapshot for %s: %s", snapshot_key(strategy), e)
+            return False
+
+        with strategy._candle_lock:
+            strategy.candles = candles
+            strategy.set_state(state)
+
+        return True
+
+
+snapshots = SnapshotStore()
@@ -1,9 +1,27 @@
 import logging
 from typing import *
+import bisect
+import collections
+import threading
 import time
-from threading import Timer
-import pandas as pd
+import weakref
+from scheduler import scheduler
+import numpy as np
 from models import *
+from indicators import indicator_cache
+import indicators
+from triggers import TriggerIndex, Trigger
+from rules import Rule, LiveSource, live_graph
+from journal import journal
+from candle_store import candle_store
+from latency import latencies, LatencyHistogram, STRATEGY_STAGES
+from retention import (
+    retention,
+    CANDLES_POLICY,
+    TRADES_POLICY,
+    STOP_LIST_POLICY,
+    LOGS_POLICY,
+)
 
 if TYPE_CHECKING:  # Import the connector class names only for typing purpose
     from connectors.binance import BinanceClient
@@ -12,6 +30,11 @@ logger = logging.getLogger()
 
 TF_EQUIV = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400}
 
+# Strategies that resumed open trades from a snapshot: the rows activated together are restored concurrently,
+# before any of them is in client.strategies, see Strategy.set_state()
+_resumed: "weakref.WeakSet[Strategy]" = weakref.WeakSet()
+_resume_lock = threading.Lock()
+
 
 class Strategy:
     def __init__(
@@ -28,16 +51,108 @@ class Strategy:
         self.tf = timeframe
         self.tf_equiv = TF_EQUIV[timeframe] * 1000
         self.strat_name = strat_name
+        self.params: Dict = dict()  # Parameters given by the interface
+        self.strategy_id: Optional[str] = None  # Interface row, see set_strategy_id()
+
+        # Identifies the candle series in the indicator cache, shared by the strategies on the same symbol/timeframe
+        self.series_id = (exchange, contract.symbol, timeframe)
 
         self.ongoing_position = False
         self.candles: List[Candle] = []
         self.trades: List[Trade] = []
         self.logs = []
 
+        # Stop loss and take profit prices of the open trades, checked on every trade of the symbol
+        self._triggers = TriggerIndex()
+        # Open trades of a snapshot whose exits are sent reduce only, see set_state()
+        self._unverified_trades: Set[Trade] = set()
+
+        # Candle close: by the first trade of the next candle, or by a timer at the candle boundary
+        self.candle_close_grace_ms = (
+            250  # Time left to the trades of the candle to arrive before the timer
+        )
+        self.candle_close_delays = collections.deque(
+            maxlen=500
+        )  # Milliseconds after the boundary
+        self._candle_lock = threading.RLock()  # Websocket and scheduler threads
+        self._close_job = None
+
+        # Hot path latency histograms of this strategy only (see set_strategy_id()), and the perf_counter_ns() of
+        # the last candle close and signal
+        self.latency = self._latency_histograms(f"{id(self):x}")
+        self._closed_ns = 0
+        self._signal_ns = 0
+
+        # Bounded history, the older items are archived to disk under retention_name, see set_strategy_id()
+        self._retained = {
+            "candles": CANDLES_POLICY,
+            "trades": TRADES_POLICY,
+            "logs": LOGS_POLICY,
+        }
+        self.retention_name = f"{exchange}_{contract.symbol}_{timeframe}_{strat_name}"
+        self._register_retention()
+
+    def _latency_histograms(self, identity: str) -> Dict[str, LatencyHistogram]:
+        return {
+            stage: latencies.histogram(
+                stage, self.contract.symbol, f"{self.strat_name} {self.tf} {identity}"
+            )
+            for stage in STRATEGY_STAGES
+        }
+
+    def _register_retention(self):
+        for attr, policy in self._retained.items():
+            retention.register(f"{self.retention_name}_{attr}", self, attr, policy)
+
+    def set_strategy_id(self, strategy_id: str):
+        """
+        Archive the evicted items under the key of the interface row of the strategy (see
+        database.WorkspaceData.save_strategy), kept across sessions: the archive files of a strategy continue
+        over its runs and re-activations. The snapshots and the latency histograms are keyed by it too, two rows
+        with the same settings have their own.
+        :param strategy_id:
+        :return:
+        """
+
+        for attr in self._retained:
+            retention.unregister(f"{self.retention_name}_{attr}")
+
+        self.strategy_id = strategy_id
+        self.retention_name = f"{self.exchange}_{self.contract.symbol}_{self.tf}_{self.strat_name}_{strategy_id}"
+        self._register_retention()
+
+        self.latency = self._latency_histograms(strategy_id)
+
     def _add_log(self, msg: str):
         logger.info("%s", msg)
         self.logs.append({"log": msg, "displayed": False})
 
+    def _closes(self) -> np.ndarray:
+        return np.array([candle.close for candle in self.candles])
+
+    def _indicator(self, name: str, params: Tuple) -> Any:
+        """
+        Get an indicator value for the last closed candle through the shared indicator cache.
+        :param name: e.g. "rsi", see indicators.last_closed()
+        :param params: The indicator parameters, part of the cache key
+        :return:
+        """
+        return indicator_cache.get(
+            self.series_id,
+            name,
+            params,
+            self.candles[-2].timestamp,
+            lambda: indicators.last_closed(name, self._closes(), *params),
+        )
+
+    def indicator_specs(self) -> List[Tuple[str, Tuple]]:
+        """
+        The (name, params) of the indicators used by _check_signal(), so that they can be computed ahead in a
+        batch with the other strategies (see evaluator.CandleCloseEvaluator).
+        :return:
+        """
+        return []
+
     def get_trade_size(self, price: float) -> float:
         """
         Compute the trade size. This method should be overridden by each specific strategy.
@@ -48,8 +163,106 @@ class Strategy:
             "get_trade_size method should be implemented by each strategy."
         )
 
-    def parse_trades(self, price: float, size: float, timestamp: int) -> str:
-        timestamp_diff = int(time.time() * 1000) - timestamp
+    def start_candle_timer(self):
+        """
+        Close the candles at their boundary, in exchange time, even when no trade arrives: the signals of an
+        illiquid symbol are then checked at most candle_close_grace_ms (plus the scheduler lateness) after the
+        end of the candle.
+        :return:
+        """
+
+        with self._candle_lock:
+            if self._close_job is None:
+                self._schedule_candle_close()
+
+    def stop_candle_timer(self):
+        with self._candle_lock:
+            if self._close_job is not None:
+                self._close_job.cancel()
+                self._close_job = None
+
+    def _schedule_candle_close(self):
+        boundary = self.candles[-1].timestamp + self.tf_equiv
+        delay = boundary + self.candle_close_grace_ms - self.client.server_time()
+        self._close_job = scheduler.call_later(
+            max(delay, 0) / 1000,
+            self._on_candle_timer,
+            name=f"candle close {self.contract.symbol} {self.tf}",
+        )
+
+    def _on_candle_timer(self):
+        with self._candle_lock:
+            if self._close_job is None:  # Stopped meanwhile
+                return
+
+            now = self.client.server_time()
+            last_candle = self.candles[-1]
+            closed = now >= last_candle.timestamp + self.tf_equiv
+
+            if closed:
+                # No trade since the boundary: the new candles start flat at the last close
+                opened = 0
+                while now >= last_candle.timestamp + self.tf_equiv:
+                    candle_info = {
+                        "ts": last_candle.timestamp + self.tf_equiv,
+                        "open": last_candle.close,
+                        "high": last_candle.close,
+                        "low": last_candle.close,
+                        "close": last_candle.close,
+                        "volume": 0,
+                    }
+                    last_candle = Candle(candle_info, self.tf, "parse_trade")
+                    self.candles.append(last_candle)
+                    opened += 1
+
+                indicator_cache.invalidate(self.series_id, self.candles[-2].timestamp)
+                self._record_close_delay(last_candle.timestamp)
+                self._store_closed_candles(opened)
+                self._closed_ns = time.perf_counter_ns()
+
+                logger.info(
+                    "%s Candle closed by timer for %s %s",
+                    self.exchange,
+                    self.contract.symbol,
+                    self.tf,
+                )
+
+            # Rescheduled for the boundary of the candle now open, whether it was opened by a trade or above
+            self._schedule_candle_close()
+
+        if closed:
+            self.on_tick("new_candle")
+
+    def _record_close_delay(self, boundary: int):
+        self.candle_close_delays.append(self.client.server_time() - boundary)
+
+    def record_signal(self):
+        """
+        Called when the signal check of a candle close has a result, wherever it ran (check_trade(), the batch
+        evaluator or the worker processes).
+        :return:
+        """
+
+        now = time.perf_counter_ns()
+        if self._closed_ns:
+            self.latency["close_to_signal"].record(now - self._closed_ns)
+            self._closed_ns = 0
+        self._signal_ns = now
+
+    def _store_closed_candles(self, opened: int):
+        # The candles closed by the opening of the last opened candles, written later by the candle store
+        if not self.client.persistent:
+            return
+
+        candle_store.record_closed(
+            self.client.candle_source,
+            self.contract.symbol,
+            self.tf,
+            self.candles[-1 - opened : -1],
+        )
+
+    def _check_lag(self, timestamp: int):
+        timestamp_diff = self.client.server_time() - timestamp
         if timestamp_diff >= 2000:
             logger.warning(
                 "%s %s: %s milliseconds of difference between the current time and the trade time",
@@ -58,9 +271,32 @@ class Strategy:
                 timestamp_diff,
             )
 
+    def parse_trades(self, price: float, size: float, timestamp: int) -> str:
+        self._check_lag(timestamp)
+
+        with self._candle_lock:
+            result = self._parse_trade(price, size, timestamp)
+
+        if result == "new_candle":
+            self._closed_ns = time.perf_counter_ns()
+        return result
+
+    def _parse_trade(self, price: float, size: float, timestamp: int) -> str:
         last_candle = self.candles[-1]
 
+        if timestamp < last_candle.timestamp and len(self.candles) > 1:
+            # Traded before the candle was closed by the timer but received after: it belongs to the previous
+            # candle according to its trade time
+            self._parse_late_trade(price, size, timestamp)
+            return "same_candle"
+
         if timestamp < last_candle.timestamp + self.tf_equiv:
+            if last_candle.volume == 0:
+                # First trade of a candle opened by the timer or filled in as missing
+                last_candle.open = price
+                last_candle.high = price
+                last_candle.low = price
+
             last_candle.close = price
             last_candle.volume += size
 
@@ -69,9 +305,8 @@ class Strategy:
             elif price < last_candle.low:
                 last_candle.low = price
 
-            for trade in self.trades:
-                if trade.status == "open" and trade.entry_price is not None:
-                    self._check_tp_sl(trade)
+            for trigger in self._triggers.check(price):
+                self._on_trigger(trigger, price)
 
             return "same_candle"
 
@@ -116,6 +351,9 @@ class Strategy:
             }
             new_candle = Candle(candle_info, self.tf, "parse_trade")
             self.candles.append(new_candle)
+            indicator_cache.invalidate(self.series_id, self.candles[-2].timestamp)
+            self._record_close_delay(new_ts)
+            self._store_closed_candles(missing_candles + 1)
 
             return "new_candle"
 
@@ -132,12 +370,115 @@ class Strategy:
             new_candle = Candle(candle_info, self.tf, "parse_trade")
             self.candles.append(new_candle)
 
+            indicator_cache.invalidate(self.series_id, self.candles[-2].timestamp)
+            self._record_close_delay(new_ts)
+            self._store_closed_candles(1)
+
             logger.info(
                 "%s New candle for %s %s", self.exchange, self.contract.symbol, self.tf
             )
 
             return "new_candle"
 
+    def _parse_late_trade(self, price: float, size: float, timestamp: int):
+        candle = self.candles[-2]
+
+        if timestamp >= candle.timestamp:
+            candle.close = price
+            candle.volume += size
+            candle.high = max(candle.high, price)
+            candle.low = min(candle.low, price)
+
+            # The values computed at the timer close no longer match the candle
+            indicator_cache.invalidate(self.series_id)
+
+        for trigger in self._triggers.check(price):
+            self._on_trigger(trigger, price)
+
+    def parse_trades_batch(
+        self, prices: List[float], sizes: List[float], timestamps: List[int]
+    ) -> str:
+        """
+        Same as parse_trades() for a batch of trades in time order (see ingestion.TickBatcher): the candle is
+        updated once per batch, and the TP/SL triggers are checked against the lowest and the highest price of
+        the batch so that no trigger crossed inside the batch is missed. A batch out of order (a late trade in
+        it) is processed trade by trade, so that each trade goes to the candle of its trade time.
+        :param prices:
+        :param sizes:
+        :param timestamps:
+        :return: "new_candle" if at least one candle was opened by the batch, else "same_candle"
+        """
+
+        self._check_lag(timestamps[-1])
+
+        with self._candle_lock:
+            if timestamps == sorted(timestamps):
+                result = self._parse_trades_batch(prices, sizes, timestamps)
+            else:
+                result = "same_candle"
+                for price, size, timestamp in zip(prices, sizes, timestamps):
+                    if self._parse_trade(price, size, timestamp) == "new_candle":
+                        result = "new_candle"
+
+        if result == "new_candle":
+            self._closed_ns = time.perf_counter_ns()
+        return result
+
+    def _parse_trades_batch(
+        self, prices: List[float], sizes: List[float], timestamps: List[int]
+    ) -> str:
+        result = "same_candle"
+        start = 0
+
+        while start < len(prices):
+            last_candle = self.candles[-1]
+            candle_end = last_candle.timestamp + self.tf_equiv
+
+            if timestamps[start] >= candle_end:
+                # The first trade of a new candle goes through the single trade path (missing candles, logs...)
+                self._parse_trade(prices[start], sizes[start], timestamps[start])
+                result = "new_candle"
+                start += 1
+                continue
+
+            if timestamps[start] < last_candle.timestamp or last_candle.volume == 0:
+                # Late trade or first trade of a candle opened by the timer
+                self._parse_trade(prices[start], sizes[start], timestamps[start])
+                start += 1
+                continue
+
+            stop = bisect.bisect_left(timestamps, candle_end, start)
+
+            segment = prices[start:stop]
+            high = max(segment)
+            low = min(segment)
+
+            last_candle.close = segment[-1]
+            last_candle.volume += sum(sizes[start:stop])
+
+            if high > last_candle.high:
+                last_candle.high = high
+            if low < last_candle.low:
+                last_candle.low = low
+
+            # Extremes in the order they were traded
+            if segment.index(low) < segment.index(high):
+                extremes = (low, high)
+            else:
+                extremes = (high, low)
+
+            for price in extremes:
+                for trigger in self._triggers.check(price):
+                    self._on_trigger(trigger, price)
+
+            start = stop
+
+        return result
+
+    def _journal(self, event: str, trade: Trade):
+        if self.client.persistent:
+            journal.record(event, self, trade)
+
     def _check_order_status(self, order_id):
         order_status = self.client.get_order_status(self.contract, order_id)
 
@@ -148,11 +489,12 @@ class Strategy:
                     if trade.entry_id == order_id:
                         trade.entry_price = order_status.avg_price
                         trade.quantity = order_status.executed_qty
+                        self._journal("fill", trade)
+                        self._register_exits(trade)
                         break
                 return
 
-        t = Timer(2.0, lambda: self._check_order_status(order_id))
-        t.start()
+        scheduler.call_later(2.0, self._check_order_status, order_id, blocking=True)
 
     def _open_position(
         self,
@@ -171,9 +513,15 @@ class Strategy:
             f"{position_side.capitalize()} signal on {self.contract.symbol} {self.tf}"
         )
 
+        sent_ns = time.perf_counter_ns()
+        if self._signal_ns:
+            self.latency["signal_to_sent"].record(sent_ns - self._signal_ns)
+            self._signal_ns = 0
+
         order_status = self.client.place_order(
             self.contract, "MARKET", trade_size, order_side
         )
+        self.latency["sent_to_ack"].record(time.perf_counter_ns() - sent_ns)
 
         if order_status is not None:
             self._add_log(
@@ -186,12 +534,13 @@ class Strategy:
             if order_status.status == "filled":
                 avg_fill_price = order_status.avg_price
             else:
-                t = Timer(2.0, lambda: self._check_order_status(order_status.order_id))
-                t.start()
+                scheduler.call_later(
+                    2.0, self._check_order_status, order_status.order_id, blocking=True
+                )
 
             new_trade = Trade(
                 {
-                    "time": int(time.time() * 1000),
+                    "time": self.client.server_time(),
                     "entry_price": avg_fill_price,
                     "contract": self.contract,
                     "strategy": self.strat_name,
@@ -203,16 +552,259 @@ class Strategy:
                 }
             )
             self.trades.append(new_trade)
+            self._journal("open", new_trade)
 
-    def _check_tp_sl(self, trade: Trade):
-        pass  # To be implemented in the subclass
+            if avg_fill_price is not None:
+                self._journal("fill", new_trade)
+                self._register_exits(new_trade)
+
+    def _exit_levels(self, trade: Trade) -> Tuple[Optional[float], Optional[float]]:
+        """
+        Stop loss and take profit prices of a filled trade. To be implemented in the subclass.
+        :param trade:
+        :return: (stop_loss, take_profit), None for no exit level
+        """
+        return None, None
+
+    def _register_exits(self, trade: Trade):
+        stop_loss, take_profit = self._exit_levels(trade)
+        self._triggers.add(trade, stop_loss, take_profit)
+
+    def _on_trigger(self, trigger: Trigger, price: float):
+        trade = trigger.trade
+
+        if trade.status != "open":
+            return
+
+        self._add_log(
+            f"{'Stop loss' if trigger.kind == 'stop_loss' else 'Take profit'} triggered for "
+            f"{self.contract.symbol} {self.tf} | Current Price = {price} (Entry price was {trade.entry_price})"
+        )
+
+        if not self._close_position(trade):
+            self._register_exits(trade)  # The exit is tried again on the next trade
+
+    def _close_position(self, trade: Trade) -> bool:
+        order_side = "SELL" if trade.side == "long" else "BUY"
+        if not self.client.futures:
+            current_balances = self.client.get_balances()
+            if current_balances is not None:
+                if (
+                    order_side == "SELL"
+                    and self.contract.base_asset in current_balances
+                ):
+                    trade.quantity = min(
+                        current_balances[self.contract.base_asset].free, trade.quantity
+                    )
+        sent_ns = time.perf_counter_ns()
+        # The position of an unverified trade may be gone: its exit must not open the opposite one
+        order_status = self.client.place_order(
+            self.contract,
+            "MARKET",
+            trade.quantity,
+            order_side,
+            reduce_only=trade in self._unverified_trades,
+        )
+        self.latency["sent_to_ack"].record(time.perf_counter_ns() - sent_ns)
+        if order_status is not None:
+            self._add_log(
+                f"Exit order on {self.contract.symbol} {self.tf} placed successfully"
+            )
+            trade.status = "closed"
+            self.ongoing_position = False
+            self._triggers.remove(trade)
+            self._unverified_trades.discard(trade)
+            self._journal("close", trade)
+            return True
+        return False
+
+    def update_params(self, params: Dict):
+        """
+        Apply new parameters to the running strategy. The candles, the trades and the exits of the open trades are
+        kept, and only the indicators that depend on the changed parameters are computed (on demand, through
+        the indicator cache keyed by parameters).
+        :param params: The complete new parameters, as given at creation
+        :return:
+        """
+        with self._candle_lock:
+            self._load_params(params)
+            self.params = params
+
+    def _load_params(self, params: Dict):
+        """
+        Read the parameters into the attributes of the strategy, raises before changing anything if they are
+        invalid. To be implemented in the subclass.
+        :param params:
+        :return:
+        """
+        pass
+
+    def get_state(self) -> Dict:
+        """
+        What a snapshot needs besides the candles to resume the strategy after a restart, see snapshots.py.
+        :return: A JSON serializable dictionary
+        """
+        return {
+            "ongoing_position": self.ongoing_position,
+            "trades": [
+                {key: value for key, value in vars(trade).items() if key != "contract"}
+                for trade in self.trades
+            ],
+        }
+
+    def set_state(self, state: Dict):
+        """
+        Resume from get_state(): the exits of the open trades are watched again, and the status of the entry
+        orders that were not filled yet is checked again.
+        The open trades are checked against the account first: a position closed by hand or liquidated while
+        the program was stopped closes its trade instead of re-arming exits that would trade against nothing.
+        Each trade only takes what is left of the position after the previous ones.
+        When the account can't be read, or when the position is shared with other strategies and their trades
+        don't add up to it, the exits are re-armed as reduce only orders (Futures).
+        :param state:
+        :return:
+        """
+        self.ongoing_position = state["ongoing_position"]
+        self.trades = [
+            Trade({**trade, "contract": self.contract}) for trade in state["trades"]
+        ]
+
+        filled = [
+            trade
+            for trade in self.trades
+            if trade.status == "open" and trade.entry_price is not None
+        ]
+
+        with _resume_lock:
+            held = self._held_quantity() if filled else None
+            remaining = held
+
+            for trade in self.trades:
+                if trade.status != "open":
+                    continue
+                if trade.entry_price is None:
+                    scheduler.call_later(
+                        2.0, self._check_order_status, trade.entry_id, blocking=True
+                    )
+                elif held is not None and not self._restore_position(trade, remaining):
+                    trade.status = "closed"
+                    self._add_log(
+                        f"{self.contract.symbol} {self.tf}: the {trade.side} position was closed while the program "
+                        f"was stopped"
+                    )
+                    self._journal("close", trade)
+                else:
+                    if held is None:
+                        self._unverified_trades.add(trade)
+                    else:
+                        remaining -= self._signed_quantity(trade)
+                    self._register_exits(trade)
+
+            if held is not None:
+                self.ongoing_position = any(
+                    trade.status == "open" for trade in self.trades
+                )
+                self._check_shared_position(held)
+
+            if filled:
+                _resumed.add(self)
+
+    def _held_quantity(self) -> Optional[float]:
+        """
+        Quantity of the contract held on the account: the net position on Futures (negative for a short), the
+        base asset balance on Spot.
+        :return: None if the account could not be read
+        """
+        if self.client.futures:
+            positions = self.client.get_positions()
+            if positions is None:
+                return None
+            return positions.get(self.contract.symbol, 0.0)
+
+        balances = self.client.get_balances()
+        if not balances:
+            return None
+        balance = balances.get(self.contract.base_asset)
+        return balance.free + balance.locked if balance is not None else 0.0
+
+    def _restore_position(self, trade: Trade, held: float) -> bool:
+        """
+        :param trade: An open trade of a snapshot
+        :param held: See _held_quantity(), less the trades of the snapshot already restored
+        :return: False if the account no longer holds the position of the trade
+        """
+        held = held if trade.side == "long" else -held
+        if held < self.contract.lot_size:
+            return False
+
+        trade.quantity = min(trade.quantity, held)  # Partly closed by hand
+        return True
+
+    def _check_shared_position(self, held: float):
+        """
+        The other strategies of the client on the symbol share the position of the account. When all their open
+        trades don't add up to it, no trade can tell which part is its own: the exits of all of them are sent
+        reduce only, an exit exceeding the position is then cut instead of opening the opposite one.
+        :param held: See _held_quantity()
+        :return:
+        """
+        sharing = {
+            strategy
+            for strategy in [*list(self.client.strategies.values()), *_resumed]
+            if strategy.client is self.client
+            and strategy.contract.symbol == self.contract.symbol
+        }
+        sharing.add(self)
+        if len(sharing) == 1:
+            return
+
+        open_trades = {
+            strategy: [
+                trade
+                for trade in strategy.trades
+                if trade.status == "open" and trade.entry_price is not None
+            ]
+            for strategy in sharing
+        }
+        total = sum(
+            self._signed_quantity(trade)
+            for trades in open_trades.values()
+            for trade in trades
+        )
+        if abs(total - held) < self.contract.lot_size:
+            return
+
+        self._add_log(
+            f"{self.contract.symbol}: the open trades of the strategies add up to {total} but the account holds "
+            f"{held}, their exits are sent reduce only"
+        )
+        for strategy, trades in open_trades.items():
+            strategy._unverified_trades.update(trades)
+
+    @staticmethod
+    def _signed_quantity(trade: Trade) -> float:
+        return trade.quantity if trade.side == "long" else -trade.quantity
 
     def _check_signal(self) -> int:
         pass  # To be implemented in the subclass
 
+    def on_tick(self, tick_type: str):
+        """
+        Entry point after parse_trades(): the candle closes go through the batch evaluator of the client when
+        it has one, the other ticks directly to check_trade().
+        :param tick_type: "same_candle" or "new_candle"
+        :return:
+        """
+
+        if tick_type == "new_candle" and self.client.evaluator is not None:
+            self.client.evaluator.submit(self)
+        else:
+            self.check_trade(tick_type)
+
     def check_trade(self, tick_type: str):
         if tick_type == "new_candle" and not self.ongoing_position:
             signal_result = self._check_signal()
+            self.record_signal()
             if signal_result in [-1, 1]:
                 self._open_position(signal_result)
 
@@ -227,7 +819,11 @@ class DummyStrategy(Strategy):
         other_params: Dict,
     ):
         super().__init__(client, contract, exchange, timeframe, "Dummy")
-        self.balance_pct = other_params["balance_pct"]
+        self.params = other_params
+        self._load_params(other_params)
+
+    def _load_params(self, params: Dict):
+        self.balance_pct = params["balance_pct"]
 
     def get_trade_size(self, price: float) -> float:
         """
@@ -266,10 +862,6 @@ class DummyStrategy(Strategy):
         take_profit = 0  # No take profit for dummy strategy
         super()._open_position(signal_result, trade_size, stop_loss, take_profit)
 
-    def _check_tp_sl(self, trade: Trade):
-        # No take profit or stop loss for dummy strategy
-        pass
-
 
 class FractalStrategy(Strategy):
     def __init__(
@@ -281,32 +873,44 @@ class FractalStrategy(Strategy):
         other_params: Dict,
     ):
         super().__init__(client, contract, exchange, timeframe, "Fractals")
-        self._ema_fast = other_params["ema_fast"]
-        self._ema_slow = other_params["ema_slow"]
-        self._ema_very_slow = other_params["ema_very_slow"]
-        self._rsi_length = other_params["rsi_length"]
-        self.risk_pct = other_params["risk_pct"]
+        self.params = other_params
+        self._load_params(other_params)
         self.stop_list_long = []
         self.stop_list_short = []
 
+        self._retained["stop_list_long"] = STOP_LIST_POLICY
+        self._retained["stop_list_short"] = STOP_LIST_POLICY
+        self._register_retention()
+
+    def _load_params(self, params: Dict):
+        self._ema_fast = params["ema_fast"]
+        self._ema_slow = params["ema_slow"]
+        self._ema_very_slow = params["ema_very_slow"]
+        self._rsi_length = params["rsi_length"]
+        self.risk_pct = params["risk_pct"]
+
+    def get_state(self) -> Dict:
+        state = super().get_state()
+        state["stop_list_long"] = self.stop_list_long
+        state["stop_list_short"] = self.stop_list_short
+        return state
+
+    def set_state(self, state: Dict):
+        # Before the trades, whose exit levels come from the stop lists
+        self.stop_list_long = state["stop_list_long"]
+        self.stop_list_short = state["stop_list_short"]
+        super().set_state(state)
+
     def _rsi(self) -> float:
-        close_list = [candle.close for candle in self.candles]
-        closes = pd.Series(close_list)
-        delta = closes.diff().dropna()
-        up, down = delta.copy(), delta.copy()
-        up[up < 0] = 0
-        down[down > 0] = 0
-        avg_gain = up.ewm(
-            com=(self._rsi_length - 1), min_periods=self._rsi_length
-        ).mean()
-        avg_loss = (
-            down.abs()
-            .ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length)
-            .mean()
-        )
-        rs = avg_gain / avg_loss
-        rsi = 100 - 100 / (1 + rs)
-        return rsi.round(2).iloc[-2]
+        return self._indicator("rsi", (self._rsi_length,))
+
+    def indicator_specs(self) -> List[Tuple[str, Tuple]]:
+        return [
+            ("rsi", (self._rsi_length,)),
+            ("ema", (self._ema_fast,)),
+            ("ema", (self._ema_slow,)),
+            ("ema", (self._ema_very_slow,)),
+        ]
 
     def get_trade_size(self, price: float, stop_loss: float) -> float:
         """
@@ -344,55 +948,13 @@ class FractalStrategy(Strategy):
             return
         super()._open_position(signal_result, trade_size, stop_loss, None)
 
-    def _check_tp_sl(self, trade: Trade):
-        tp_triggered = False
-        sl_triggered = False
-        price = self.candles[-1].close
+    def _exit_levels(self, trade: Trade) -> Tuple[Optional[float], Optional[float]]:
         if trade.side == "long":
-            stop_loss_long = self.stop_list_long[-1]
-            take_profit_long = (
-                trade.entry_price - stop_loss_long
-            ) * 1.7 + trade.entry_price
-            if price <= stop_loss_long:
-                sl_triggered = True
-            if price >= take_profit_long:
-                tp_triggered = True
-        elif trade.side == "short":
-            stop_loss_short = self.stop_list_short[-1]
-            take_profit_short = (
-                trade.entry_price - stop_loss_short
-            ) * 1.7 + trade.entry_price
-            if price >= stop_loss_short:
-                sl_triggered = True
-            if price <= take_profit_short:
-                tp_triggered = True
-
-        if tp_triggered or sl_triggered:
-            self._add_log(
-                f"{'Stop loss' if sl_triggered else 'Take profit'} for {self.contract.symbol} {self.tf} "
-                f"| Current Price = {price} (Entry price was {trade.entry_price})"
-            )
-            order_side = "SELL" if trade.side == "long" else "BUY"
-            if not self.client.futures:
-                current_balances = self.client.get_balances()
-                if current_balances is not None:
-                    if (
-                        order_side == "SELL"
-                        and self.contract.base_asset in current_balances
-                    ):
-                        trade.quantity = min(
-                            current_balances[self.contract.base_asset].free,
-                            trade.quantity,
-                        )
-            order_status = self.client.place_order(
-                self.contract, "MARKET", trade.quantity, order_side
-            )
-            if order_status is not None:
-                self._add_log(
-                    f"Exit order on {self.contract.symbol} {self.tf} placed successfully"
-                )
-                trade.status = "closed"
-                self.ongoing_position = False
+            stop_loss = self.stop_list_long[-1]
+        else:
+            stop_loss = self.stop_list_short[-1]
+        take_profit = (trade.entry_price - stop_loss) * 1.7 + trade.entry_price
+        return stop_loss, take_profit
 
     def fractal_bearish(self) -> float:
         if (
@@ -411,19 +973,13 @@ class FractalStrategy(Strategy):
             return self.candles[-2].low * (1 - 0.0002)
 
     def EmaFast(self) -> float:
-        close_list = [candle.close for candle in self.candles]
-        closes = pd.Series(close_list)
-        return closes.ewm(span=self._ema_fast).mean().iloc[-2]
+        return self._indicator("ema", (self._ema_fast,))
 
     def EmaSlow(self) -> float:
-        close_list = [candle.close for candle in self.candles]
-        closes = pd.Series(close_list)
-        return closes.ewm(span=self._ema_slow).mean().iloc[-2]
+        return self._indicator("ema", (self._ema_slow,))
 
     def EmaVerySlow(self) -> float:
-        close_list = [candle.close for candle in self.candles]
-        closes = pd.Series(close_list)
-        return closes.ewm(span=self._ema_very_slow).mean().iloc[-2]
+        return self._indicator("ema", (self._ema_very_slow,))
 
     def sell_signal(self) -> int:
         rsi = self._rsi()
@@ -482,13 +1038,17 @@ class TechnicalStrategy(Strategy):
         other_params: Dict,
     ):
         super().__init__(client, contract, exchange, timeframe, "Technical")
-        self._ema_fast = other_params["ema_fast"]
-        self._ema_slow = other_params["ema_slow"]
-        self._ema_signal = other_params["ema_signal"]
-        self._rsi_length = other_params["rsi_length"]
-        self.stop_loss_pct = other_params.get("stop_loss_pct", 1.0)  # Default to 1%
-        self.take_profit_pct = other_params.get("take_profit_pct", 2.0)  # Default to 2%
-        self.balance_pct = other_params["balance_pct"]
+        self.params = other_params
+        self._load_params(other_params)
+
+    def _load_params(self, params: Dict):
+        self._ema_fast = params["ema_fast"]
+        self._ema_slow = params["ema_slow"]
+        self._ema_signal = params["ema_signal"]
+        self._rsi_length = params["rsi_length"]
+        self.stop_loss_pct = params.get("stop_loss_pct", 1.0)  # Default to 1%
+        self.take_profit_pct = params.get("take_profit_pct", 2.0)  # Default to 2%
+        self.balance_pct = params["balance_pct"]
 
     def get_trade_size(self, price: float) -> float:
         """
@@ -516,32 +1076,18 @@ class TechnicalStrategy(Strategy):
         return trade_size
 
     def _rsi(self) -> float:
-        close_list = [candle.close for candle in self.candles]
-        closes = pd.Series(close_list)
-        delta = closes.diff().dropna()
-        up, down = delta.copy(), delta.copy()
-        up[up < 0] = 0
-        down[down > 0] = 0
-        avg_gain = up.ewm(
-            com=(self._rsi_length - 1), min_periods=self._rsi_length
-        ).mean()
-        avg_loss = (
-            down.abs()
-            .ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length)
-            .mean()
-        )
-        rs = avg_gain / avg_loss
-        rsi = 100 - 100 / (1 + rs)
-        return rsi.round(2).iloc[-2]
+        return self._indicator("rsi", (self._rsi_length,))
 
     def _macd(self) -> Tuple[float, float]:
-        close_list = [candle.close for candle in self.candles]
-        closes = pd.Series(close_list)
-        ema_fast = closes.ewm(span=self._ema_fast).mean()
-        ema_slow = closes.ewm(span=self._ema_slow).mean()
-        macd_line = ema_fast - ema_slow
-        macd_signal = macd_line.ewm(span=self._ema_signal).mean()
-        return macd_line.iloc[-2], macd_signal.iloc[-2]
+        return self._indicator(
+            "macd", (self._ema_fast, self._ema_slow, self._ema_signal)
+        )
+
+    def indicator_specs(self) -> List[Tuple[str, Tuple]]:
+        return [
+            ("rsi", (self._rsi_length,)),
+            ("macd", (self._ema_fast, self._ema_slow, self._ema_signal)),
+        ]
 
     def _check_signal(self):
         macd_line, macd_signal = self._macd()
@@ -553,9 +1099,7 @@ class TechnicalStrategy(Strategy):
         return 0
 
     def _open_position(self, signal_result: int):
-        trade_size = self.client.get_trade_size(
-            self.contract, self.candles[-1].close, self.balance_pct
-        )
+        trade_size = self.client.get_trade_size(self, self.candles[-1].close)
         if trade_size is None:
             return
         stop_loss = (
@@ -570,52 +1114,14 @@ class TechnicalStrategy(Strategy):
         )
         super()._open_position(signal_result, trade_size, stop_loss, take_profit)
 
-    def _check_tp_sl(self, trade: Trade):
-        price = self.candles[-1].close
+    def _exit_levels(self, trade: Trade) -> Tuple[Optional[float], Optional[float]]:
         if trade.side == "long":
-            if price <= trade.entry_price * (1 - self.stop_loss_pct / 100):
-                self._add_log(
-                    f"Stop loss triggered for {self.contract.symbol} {self.tf}"
-                )
-                self._close_position(trade)
-            elif price >= trade.entry_price * (1 + self.take_profit_pct / 100):
-                self._add_log(
-                    f"Take profit triggered for {self.contract.symbol} {self.tf}"
-                )
-                self._close_position(trade)
-        elif trade.side == "short":
-            if price >= trade.entry_price * (1 + self.stop_loss_pct / 100):
-                self._add_log(
-                    f"Stop loss triggered for {self.contract.symbol} {self.tf}"
-                )
-                self._close_position(trade)
-            elif price <= trade.entry_price * (1 - self.take_profit_pct / 100):
-                self._add_log(
-                    f"Take profit triggered for {self.contract.symbol} {self.tf}"
-                )
-                self._close_position(trade)
-
-    def _close_position(self, trade: Trade):
-        order_side = "SELL" if trade.side == "long" else "BUY"
-        if not self.client.futures:
-            current_balances = self.client.get_balances()
-            if current_balances is not None:
-                if (
-                    order_side == "SELL"
-                    and self.contract.base_asset in current_balances
-                ):
-                    trade.quantity = min(
-                        current_balances[self.contract.base_asset].free, trade.quantity
-                    )
-        order_status = self.client.place_order(
-            self.contract, "MARKET", trade.quantity, order_side
-        )
-        if order_status is not None:
-            self._add_log(
-                f"Exit order on {self.contract.symbol} {self.tf} placed successfully"
-            )
-            trade.status = "closed"
-            self.ongoing_position = False
+            stop_loss = trade.entry_price * (1 - self.stop_loss_pct / 100)
+            take_profit = trade.entry_price * (1 + self.take_profit_pct / 100)
+        else:
+            stop_loss = trade.entry_price * (1 + self.stop_loss_pct / 100)
+            take_profit = trade.entry_price * (1 - self.take_profit_pct / 100)
+        return stop_loss, take_profit
 
 
 class BreakoutStrategy(Strategy):
@@ -628,10 +1134,14 @@ class BreakoutStrategy(Strategy):
         other_params: Dict,
     ):
         super().__init__(client, contract, exchange, timeframe, "Breakout")
-        self._min_volume = other_params["min_volume"]
-        self.stop_loss_pct = other_params.get("stop_loss_pct", 1.0)  # Default to 1%
-        self.take_profit_pct = other_params.get("take_profit_pct", 2.0)  # Default to 2%
-        self.balance_pct = other_params["balance_pct"]
+        self.params = other_params
+        self._load_params(other_params)
+
+    def _load_params(self, params: Dict):
+        self._min_volume = params["min_volume"]
+        self.stop_loss_pct = params.get("stop_loss_pct", 1.0)  # Default to 1%
+        self.take_profit_pct = params.get("take_profit_pct", 2.0)  # Default to 2%
+        self.balance_pct = params["balance_pct"]
 
     def get_trade_size(self, price: float) -> float:
         """
@@ -674,9 +1184,7 @@ class BreakoutStrategy(Strategy):
         return 0
 
     def _open_position(self, signal_result: int):
-        trade_size = self.client.get_trade_size(
-            self.contract, self.candles[-1].close, self.balance_pct
-        )
+        trade_size = self.client.get_trade_size(self, self.candles[-1].close)
         if trade_size is None:
             return
         stop_loss = (
@@ -691,49 +1199,112 @@ class BreakoutStrategy(Strategy):
         )
         super()._open_position(signal_result, trade_size, stop_loss, take_profit)
 
-    def _check_tp_sl(self, trade: Trade):
-        price = self.candles[-1].close
+    def _exit_levels(self, trade: Trade) -> Tuple[Optional[float], Optional[float]]:
         if trade.side == "long":
-            if price <= trade.entry_price * (1 - self.stop_loss_pct / 100):
-                self._add_log(
-                    f"Stop loss triggered for {self.contract.symbol} {self.tf}"
-                )
-                self._close_position(trade)
-            elif price >= trade.entry_price * (1 + self.take_profit_pct / 100):
-                self._add_log(
-                    f"Take profit triggered for {self.contract.symbol} {self.tf}"
-                )
-                self._close_position(trade)
-        elif trade.side == "short":
-            if price >= trade.entry_price * (1 + self.stop_loss_pct / 100):
-                self._add_log(
-                    f"Stop loss triggered for {self.contract.symbol} {self.tf}"
-                )
-                self._close_position(trade)
-            elif price <= trade.entry_price * (1 - self.take_profit_pct / 100):
-                self._add_log(
-                    f"Take profit triggered for {self.contract.symbol} {self.tf}"
+            stop_loss = trade.entry_price * (1 - self.stop_loss_pct / 100)
+            take_profit = trade.entry_price * (1 + self.take_profit_pct / 100)
+        else:
+            stop_loss = trade.entry_price * (1 + self.stop_loss_pct / 100)
+            take_profit = trade.entry_price * (1 - self.take_profit_pct / 100)
+        return stop_loss, take_profit
+
+
+class RuleStrategy(Strategy):
+    def __init__(
+        self,
+        client,
+        contract: Contract,
+        exchange: str,
+        timeframe: str,
+        other_params: Dict,
+    ):
+        """
+        Strategy defined by a buy rule and a sell rule, see rules.Rule, e.g.
+        buy_rule: "rsi(14) < 30 and macd(12, 26, 9).line > macd.signal"
+        The other parameters can be used by name in the rules.
+        """
+        super().__init__(client, contract, exchange, timeframe, "Rules")
+
+        # Indicators updated incrementally and shared with the rules of the other strategies on the series
+        self._graph = live_graph(self.series_id)
+
+        self.params = other_params
+        self._load_params(other_params)
+
+    def _load_params(self, params: Dict):
+        # Compiled first, an invalid rule leaves the strategy unchanged
+        buy_rule = Rule(params["buy_rule"], params) if params.get("buy_rule") else None
+        sell_rule = (
+            Rule(params["sell_rule"], params) if params.get("sell_rule") else None
+        )
+
+        for rule in [buy_rule, sell_rule]:
+            if rule is not None:
+                self._graph.require(rule.indicators)
+
+        self._buy_rule = buy_rule
+        self._sell_rule = sell_rule
+        self.stop_loss_pct = params.get("stop_loss_pct", 1.0)  # Default to 1%
+        self.take_profit_pct = params.get("take_profit_pct", 2.0)  # Default to 2%
+        self.balance_pct = params["balance_pct"]
+
+    def get_trade_size(self, price: float) -> float:
+        """
+        Compute the trade size for the Rules strategy.
+        :param price: The current price of the asset
+        :return: The computed trade size
+        """
+        balance = self.client.get_balances()
+        if balance is not None:
+            if self.contract.quote_asset in balance:
+                balance = (
+                    balance[self.contract.quote_asset].wallet_balance
+                    if self.client.futures
+                    else balance[self.contract.quote_asset].free
                 )
-                self._close_position(trade)
+            else:
+                return None
+        else:
+            return None
 
-    def _close_position(self, trade: Trade):
-        order_side = "SELL" if trade.side == "long" else "BUY"
-        if not self.client.futures:
-            current_balances = self.client.get_balances()
-            if current_balances is not None:
-                if (
-                    order_side == "SELL"
-                    and self.contract.base_asset in current_balances
-                ):
-                    trade.quantity = min(
-                        current_balances[self.contract.base_asset].free, trade.quantity
-                    )
-        order_status = self.client.place_order(
-            self.contract, "MARKET", trade.quantity, order_side
+        trade_size = (balance * self.balance_pct / 100) / price
+        trade_size = round(
+            round(trade_size / self.contract.lot_size) * self.contract.lot_size, 8
         )
-        if order_status is not None:
-            self._add_log(
-                f"Exit order on {self.contract.symbol} {self.tf} placed successfully"
-            )
-            trade.status = "closed"
-            self.ongoing_position = False
+        return trade_size
+
+    def _check_signal(self) -> int:
+        with self._graph.lock:
+            self._graph.update(self.candles)
+            source = LiveSource(self.candles, self._graph)
+
+            if self._buy_rule is not None and self._buy_rule.evaluate(source):
+                return 1
+            if self._sell_rule is not None and self._sell_rule.evaluate(source):
+                return -1
+        return 0
+
+    def _open_position(self, signal_result: int):
+        trade_size = self.client.get_trade_size(self, self.candles[-1].close)
+        if trade_size is None:
+            return
+        stop_loss = (
+            self.candles[-1].close * (1 - self.stop_loss_pct / 100)
+            if signal_result == 1
+            else self.candles[-1].close * (1 + self.stop_loss_pct / 100)
+        )
+        take_profit = (
+            self.candles[-1].close * (1 + self.take_profit_pct / 100)
+            if signal_result == 1
+            else self.candles[-1].close * (1 - self.take_profit_pct / 100)
+        )
+        super()._open_position(signal_result, trade_size, stop_loss, take_profit)
+
+    def _exit_levels(self, trade: Trade) -> Tuple[Optional[float], Optional[float]]:
+        if trade.side == "long":
+            stop_loss = trade.entry_price * (1 - self.stop_loss_pct / 100)
+            take_profit = trade.entry_price * (1 + self.take_profit_pct / 100)
+        else:
+            stop_loss = trade.entry_price * (1 + self.stop_loss_pct / 100)
+            take_profit = trade.entry_price * (1 - self.take_profit_pct / 100)
+        return stop_loss, take_profit
@@ -0,0 +1,174 @@
+"""
+Equivalence of the NumPy indicators with the pandas expressions they replaced.
+Run from the repository root: python -m pytest tests
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators
+
+SEEDS = range(10)
+LENGTH = 1000
+
+
+def random_walk(seed: int, length: int = LENGTH) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return 30000 * np.exp(np.cumsum(rng.normal(0, 0.002, length)))
+
+
+def random_walks(rows: int, length: int = LENGTH) -> np.ndarray:
+    return np.stack([random_walk(seed, length) for seed in range(rows)])
+
+
+# The pandas versions, as they were in indicators.py
+
+
+def pandas_ema(closes: pd.Series, span: int) -> pd.Series:
+    return closes.ewm(span=span).mean()
+
+
+def pandas_rsi(closes: pd.Series, length: int) -> pd.Series:
+    delta = closes.diff()
+    up = delta.clip(lower=0)
+    down = delta.clip(upper=0).abs()
+    avg_gain = up.ewm(com=(length - 1), min_periods=length).mean()
+    avg_loss = down.ewm(com=(length - 1), min_periods=length).mean()
+    rs = avg_gain / avg_loss
+    return (100 - 100 / (1 + rs)).round(2)
+
+
+def pandas_macd(
+    closes: pd.Series, ema_fast: int, ema_slow: int, ema_signal: int
+) -> tuple:
+    macd_line = pandas_ema(closes, ema_fast) - pandas_ema(closes, ema_slow)
+    macd_signal = macd_line.ewm(span=ema_signal).mean()
+    return macd_line, macd_signal
+
+
+def assert_rsi_equal(result: np.ndarray, expected: np.ndarray):
+    # Both are rounded to 2 decimals, a last bit of difference can round a value to the next cent
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+    valid = ~np.isnan(expected)
+    np.testing.assert_allclose(result[valid], expected[valid], rtol=0, atol=0.0100001)
+    assert np.mean(result[valid] != expected[valid]) < 0.01
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("span", [1, 2, 3, 5, 9, 12, 26, 50, 200, 500])
+def test_ema(seed: int, span: int):
+    closes = random_walk(seed)
+    expected = pandas_ema(pd.Series(closes), span).to_numpy()
+    np.testing.assert_allclose(indicators.ema(closes, span), expected, rtol=1e-9)
+
+
+def test_ema_longer_than_a_block():
+    # Several blocks of the cumulative sums for a short span
+    closes = random_walk(0, 20_000)
+    expected = pandas_ema(pd.Series(closes), 2).to_numpy()
+    np.testing.assert_allclose(indicators.ema(closes, 2), expected, rtol=1e-9)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("length", [2, 5, 14, 30])
+def test_rsi(seed: int, length: int):
+    closes = random_walk(seed)
+    expected = pandas_rsi(pd.Series(closes), length).to_numpy()
+    assert_rsi_equal(indicators.rsi(closes, length), expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("params", [(12, 26, 9), (5, 35, 5), (3, 10, 16)])
+def test_macd(seed: int, params: tuple):
+    closes = random_walk(seed)
+    line, signal = indicators.macd(closes, *params)
+    expected_line, expected_signal = pandas_macd(pd.Series(closes), *params)
+    np.testing.assert_allclose(line, expected_line.to_numpy(), rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(signal, expected_signal.to_numpy(), rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("missing", [0.0, 0.3, 0.9])
+def test_ffill(seed: int, missing: float):
+    values = random_walk(seed)
+    values[np.random.default_rng(seed).random(LENGTH) < missing] = np.nan
+    expected = pd.Series(values).ffill().to_numpy()
+    np.testing.assert_array_equal(indicators.ffill(values), expected)
+
+
+def test_ffill_leading_nan():
+    values = np.array([np.nan, np.nan, 1.0, np.nan, 2.0, np.nan])
+    expected = pd.Series(values).ffill().to_numpy()
+    np.testing.assert_array_equal(indicators.ffill(values), expected)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("window", [1, 2, 20, 100])
+def test_rolling_mean(seed: int, window: int):
+    volumes = np.random.default_rng(seed).gamma(2.0, 10.0, LENGTH)
+    expected = pd.Series(volumes).rolling(window).mean().to_numpy()
+    np.testing.assert_allclose(
+        indicators.rolling_mean(volumes, window), expected, rtol=1e-9
+    )
+
+
+# Batched across symbols: each row of a 2-D call matches pandas on that row
+
+
+def test_ema_batched():
+    closes = random_walks(5)
+    result = indicators.ema(closes, 26)
+    for row in range(len(closes)):
+        expected = pandas_ema(pd.Series(closes[row]), 26).to_numpy()
+        np.testing.assert_allclose(result[row], expected, rtol=1e-9)
+
+
+def test_rsi_batched():
+    closes = random_walks(5)
+    result = indicators.rsi(closes, 14)
+    for row in range(len(closes)):
+        expected = pandas_rsi(pd.Series(closes[row]), 14).to_numpy()
+        assert_rsi_equal(result[row], expected)
+
+
+def test_macd_batched():
+    closes = random_walks(5)
+    line, signal = indicators.macd(closes, 12, 26, 9)
+    for row in range(len(closes)):
+        expected_line, expected_signal = pandas_macd(pd.Series(closes[row]), 12, 26, 9)
+        np.testing.assert_allclose(
+            line[row], expected_line.to_numpy(), rtol=1e-9, atol=1e-9
+        )
+        np.testing.assert_allclose(
+            signal[row], expected_signal.to_numpy(), rtol=1e-9, atol=1e-9
+        )
+
+
+def test_ffill_batched():
+    values = random_walks(5)
+    values[np.random.default_rng(0).random(values.shape) < 0.5] = np.nan
+    result = indicators.ffill(values)
+    for row in range(len(values)):
+        expected = pd.Series(values[row]).ffill().to_numpy()
+        np.testing.assert_array_equal(result[row], expected)
+
+
+def test_rolling_mean_batched():
+    volumes = np.random.default_rng(0).gamma(2.0, 10.0, (5, LENGTH))
+    result = indicators.rolling_mean(volumes, 20)
+    for row in range(len(volumes)):
+        expected = pd.Series(volumes[row]).rolling(20).mean().to_numpy()
+        np.testing.assert_allclose(result[row], expected, rtol=1e-9)
+
+
+def test_last_closed():
+    closes = random_walks(3)
+    expected = [
+        pandas_rsi(pd.Series(closes[row]), 14).to_numpy()[-2] for row in range(3)
+    ]
+    result = indicators.last_closed("rsi", closes, 14)
+    np.testing.assert_allclose(result, expected, rtol=0, atol=0.0100001)
+    assert indicators.last_closed("rsi", closes[0], 14) == pytest.approx(
+        expected[0], abs=0.0100001
+    )
@@ -0,0 +1,134 @@
+import typing
+import heapq
+import itertools
+import threading
+
+from models import *
+
+
+class Trigger:
+    __slots__ = ("trade", "kind", "price", "active")
+
+    def __init__(self, trade: Trade, kind: str, price: float):
+        self.trade = trade
+        self.kind = kind  # "stop_loss" or "take_profit"
+        self.price = price
+        self.active = True
+
+
+class TriggerIndex:
+    def __init__(self):
+        """
+        Stop loss and take profit prices of the open trades of a symbol, sorted so that each tick only compares
+        the price with the nearest trigger on each side: O(1) when nothing fires, O(log n) per trigger fired.
+        _above holds the triggers that fire when the price rises to them (long take profit, short stop loss),
+        _below the ones that fire when the price falls to them (long stop loss, short take profit).
+        """
+
+        self._above: typing.List[typing.Tuple[float, int, Trigger]] = []
+        self._below: typing.List[typing.Tuple[float, int, Trigger]] = []
+        self._by_trade: typing.Dict[int, typing.List[Trigger]] = dict()
+
+        self._seq = (
+            itertools.count()
+        )  # Tie-breaker, the Trigger objects are not comparable
+        self._inactive = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._above) + len(self._below) - self._inactive
+
+    def add(
+        self,
+        trade: Trade,
+        stop_loss: typing.Optional[float],
+        take_profit: typing.Optional[float],
+    ):
+        """
+        Index the exit prices of a trade, replacing the ones previously indexed for it.
+        :param trade: An open trade with a known side
+        :param stop_loss: None for no stop loss
+        :param take_profit: None for no take profit
+        :return:
+        """
+
+        self.remove(trade)
+
+        with self._lock:
+            triggers = []
+
+            for kind, price in (("stop_loss", stop_loss), ("take_profit", take_profit)):
+                if price is None:
+                    continue
+
+                trigger = Trigger(trade, kind, price)
+                triggers.append(trigger)
+
+                rises_to = (trade.side == "long") == (kind == "take_profit")
+                if rises_to:
+                    heapq.heappush(self._above, (price, next(self._seq), trigger))
+                else:
+                    heapq.heappush(self._below, (-price, next(self._seq), trigger))
+
+            if triggers:
+                self._by_trade[id(trade)] = triggers
+
+    def remove(self, trade: Trade):
+        """
+        Deactivate the triggers of a trade. They are dropped from the heaps lazily, when they reach the top
+        or when too many of them accumulate.
+        :param trade:
+        :return:
+        """
+
+        with self._lock:
+            self._deactivate(trade)
+
+    def _deactivate(self, trade: Trade):
+        for trigger in self._by_trade.pop(id(trade), []):
+            if trigger.active:
+                trigger.active = False
+                self._inactive += 1
+
+        if self._inactive > 64 and self._inactive > len(self) // 2:
+            self._above = [t for t in self._above if t[2].active]
+            self._below = [t for t in self._below if t[2].active]
+            heapq.heapify(self._above)
+            heapq.heapify(self._below)
+            self._inactive = 0
+
+    def check(self, price: float) -> typing.List[Trigger]:
+        """
+        Pop the triggers crossed by the price. Once a trigger fires, the other trigger of the same trade is
+        deactivated: a trade exits only once.
+        :param price: Last trade price
+        :return: The fired triggers
+        """
+
+        fired = []
+
+        # Unlocked peek: the common case (nothing crossed) costs two comparisons.
+        # Local references because a compaction may swap the lists from another thread.
+        above, below = self._above, self._below
+        if not ((above and price >= above[0][0]) or (below and price <= -below[0][0])):
+            return fired
+
+        with self._lock:
+            while self._above and price >= self._above[0][0]:
+                trigger = heapq.heappop(self._above)[2]
+                self._fire(trigger, fired)
+
+            while self._below and price <= -self._below[0][0]:
+                trigger = heapq.heappop(self._below)[2]
+                self._fire(trigger, fired)
+
+        return fired
+
+    def _fire(self, trigger: Trigger, fired: typing.List[Trigger]):
+        if not trigger.active:
+            self._inactive -= 1
+            return
+
+        trigger.active = False
+        fired.append(trigger)
+        self._deactivate(trigger.trade)
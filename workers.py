@@ -0,0 +1,350 @@
+import logging
+import typing
+import time
+import queue
+import threading
+import multiprocessing
+
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from models import *
+
+if typing.TYPE_CHECKING:
+    from strategies import Strategy
+
+logger = logging.getLogger()
+
+
+class SharedMarketData:
+    HEADER = 3  # Sequence number, number of candles, last price
+
+    def __init__(self, slots: int, max_candles: int, name: typing.Optional[str] = None):
+        """
+        Candle arrays of several series in one shared memory block, one slot per series, written by the main
+        process and read by the workers without copying them through a pipe.
+        Each slot starts with a sequence number used as a seqlock: it is odd while the slot is being written, so
+        a reader retries until it reads the same even number before and after copying the slot.
+        :param slots: Maximum number of series
+        :param max_candles: The most recent candles of a series kept in its slot
+        :param name: Name of an existing block to attach to, None to create it
+        """
+
+        self.slots = slots
+        self.max_candles = max_candles
+
+        width = self.HEADER + 6 * max_candles
+        size = slots * width * 8
+
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+
+        self.name = self._shm.name
+        self._array = np.ndarray((slots, width), dtype=np.float64, buffer=self._shm.buf)
+
+        if self._owner:
+            self._array[:, : self.HEADER] = 0
+
+    def publish(self, slot: int, candles: typing.List[Candle]) -> int:
+        """
+        :param slot:
+        :param candles: Only the last max_candles are published
+        :return: The new sequence number of the slot
+        """
+
+        candles = candles[-self.max_candles :]
+        n = len(candles)
+        data = np.array(
+            [[c.timestamp, c.open, c.high, c.low, c.close, c.volume] for c in candles]
+        ).T
+
+        row = self._array[slot]
+        seq = int(row[0]) + 1
+
+        row[0] = seq  # Odd: being written
+        row[1] = n
+        row[2] = candles[-1].close
+        row[self.HEADER :].reshape(6, self.max_candles)[:, :n] = data
+        row[0] = seq + 1
+
+        return seq + 1
+
+    def read(self, slot: int) -> typing.Tuple[int, np.ndarray, float]:
+        """
+        :param slot:
+        :return: (sequence number, candle array of shape (6, n), last price)
+        """
+
+        row = self._array[slot]
+
+        while True:
+            seq = int(row[0])
+            if seq % 2 == 1:
+                time.sleep(0)
+                continue
+
+            n = int(row[1])
+            last_price = float(row[2])
+            data = row[self.HEADER :].reshape(6, self.max_candles)[:, :n].copy()
+
+            if int(row[0]) == seq:
+                return seq, data, last_price
+
+    def close(self):
+        self._array = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _worker_main(
+    market_name: str,
+    slots: int,
+    max_candles: int,
+    inbox: multiprocessing.Queue,
+    outbox: multiprocessing.Queue,
+):
+    """
+    Loop of a worker process: keeps a replica of each of its strategies and evaluates their signals on the
+    candles published in shared memory. The replicas have no client, they never place orders themselves.
+    """
+
+    market = SharedMarketData(slots, max_candles, market_name)
+    replicas: typing.Dict[int, "Strategy"] = dict()
+    candles_cache: typing.Dict[int, typing.Tuple[int, typing.List[Candle]]] = dict()
+
+    while True:
+        message = inbox.get()
+
+        if message[0] == "stop":
+            break
+
+        if message[0] == "add":
+            _, key, strategy_class, contract, exchange, timeframe, params = message
+            try:
+                replicas[key] = strategy_class(
+                    None, contract, exchange, timeframe, params
+                )
+            except Exception as e:
+                outbox.put(("log", key, f"Worker error while adding the strategy: {e}"))
+
+        elif message[0] == "remove":
+            replicas.pop(message[1], None)
+
+        elif message[0] == "evaluate":
+            _, key, slot, boundary = message
+            replica = replicas.get(key)
+            if replica is None:
+                continue
+
+            seq, data, _ = market.read(slot)
+
+            # The strategies of a series share the same Candle objects for a given sequence number
+            cached = candles_cache.get(slot)
+            if cached is None or cached[0] != seq:
+                candles = [
+                    Candle(list(data[:, i]), replica.tf, "binance_futures")
+                    for i in range(data.shape[1])
+                ]
+                candles_cache[slot] = (seq, candles)
+            replica.candles = candles_cache[slot][1]
+
+            try:
+                signal_result = replica._check_signal()
+            except Exception as e:
+                outbox.put(("log", key, f"Worker error while checking the signal: {e}"))
+                continue
+
+            outbox.put(("signal", key, boundary, signal_result))
+
+    market.close()
+
+
+class StrategyWorkerPool:
+    def __init__(
+        self,
+        strategies: typing.Dict[int, "Strategy"],
+        workers: int = 2,
+        slots: int = 64,
+        max_candles: int = 2000,
+        max_order_workers: int = 8,
+    ):
+        """
+        Evaluate the signals of the strategies in worker processes, so that the indicator computations run on
+        several cores instead of competing for the GIL with the interface and the websocket.
+        The main process keeps building the candles and managing the positions. When a candle closes, the candles
+        of the series are published once into shared memory and the workers owning a strategy of the series are
+        asked to evaluate it; the signals come back over a queue and the orders are placed by the main process.
+        All the strategies of a series are evaluated by the same worker, to share its indicator cache.
+        Same interface as evaluator.CandleCloseEvaluator, see BinanceClient.set_strategy_workers().
+        :param strategies: The active strategies of the client
+        :param workers: Number of worker processes
+        :param slots: Maximum number of series (symbol and timeframe) evaluated by the workers
+        :param max_candles: Candles published per series
+        :param max_order_workers: Number of orders placed at the same time
+        """
+
+        self.strategies = strategies
+        self.workers = workers
+
+        self.evaluations = 0
+        self.results = 0
+        self.signals = 0
+
+        self._market = SharedMarketData(slots, max_candles)
+        self._slots: typing.Dict[typing.Tuple, int] = dict()
+        self._published: typing.Dict[int, int] = dict()  # slot -> boundary published
+        self._known: typing.Dict[int, "Strategy"] = dict()  # key -> strategy
+        self._sent_params: typing.Dict[int, typing.Dict] = (
+            dict()
+        )  # key -> params of the replica
+        self._lock = threading.Lock()
+        self._orders = ThreadPoolExecutor(
+            max_order_workers, thread_name_prefix="orders"
+        )
+
+        # Spawned rather than forked from a process running Tk and the websocket threads
+        context = multiprocessing.get_context("spawn")
+        self._outbox = context.Queue()
+        self._inboxes = []
+        self._processes = []
+
+        for _ in range(workers):
+            inbox = context.Queue()
+            process = context.Process(
+                target=_worker_main,
+                args=(self._market.name, slots, max_candles, inbox, self._outbox),
+                daemon=True,
+            )
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+
+        self._running = True
+        self._listener = threading.Thread(target=self._listen, daemon=True)
+        self._listener.start()
+
+    def submit(self, strategy: "Strategy"):
+        """
+        Called instead of strategy.check_trade("new_candle") when a candle of the strategy closes.
+        :param strategy:
+        :return:
+        """
+
+        if strategy.ongoing_position:
+            return
+
+        boundary = strategy.candles[-1].timestamp
+        key = id(strategy)
+
+        with self._lock:
+            slot = self._slots.get(strategy.series_id)
+            if slot is None:
+                if len(self._slots) == self._market.slots:
+                    logger.error(
+                        "No shared memory slot left for %s, evaluated in process",
+                        strategy.series_id,
+                    )
+                    strategy.check_trade("new_candle")
+                    return
+                slot = len(self._slots)
+                self._slots[strategy.series_id] = slot
+
+            if self._published.get(slot) != boundary:
+                # Once per series and candle, the last candle is the one just opened
+                self._market.publish(slot, strategy.candles)
+                self._published[slot] = boundary
+
+            inbox = self._inboxes[slot % self.workers]
+
+            # New strategy, or parameters changed by Strategy.update_params(): the replica is replaced
+            if (
+                self._known.get(key) is not strategy
+                or self._sent_params.get(key) != strategy.params
+            ):
+                self._known[key] = strategy
+                self._sent_params[key] = dict(strategy.params)
+                inbox.put(
+                    (
+                        "add",
+                        key,
+                        type(strategy),
+                        strategy.contract,
+                        strategy.exchange,
+                        strategy.tf,
+                        strategy.params,
+                    )
+                )
+
+        inbox.put(("evaluate", key, slot, boundary))
+        self.evaluations += 1
+
+    def remove(self, strategy: "Strategy"):
+        key = id(strategy)
+
+        with self._lock:
+            self._sent_params.pop(key, None)
+            if self._known.pop(key, None) is None:
+                return
+            slot = self._slots.get(strategy.series_id)
+
+        if slot is not None:
+            self._inboxes[slot % self.workers].put(("remove", key))
+
+    def _listen(self):
+        while self._running:
+            try:
+                message = self._outbox.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            strategy = self._known.get(message[1])
+            if strategy is None:
+                continue
+
+            if message[0] == "log":
+                strategy._add_log(message[2])
+
+            elif message[0] == "signal":
+                _, _, boundary, signal_result = message
+                self.results += 1
+                strategy.record_signal()
+
+                # Dropped if the strategy moved to another candle or opened a position meanwhile
+                if signal_result not in [-1, 1] or strategy.ongoing_position:
+                    continue
+                if strategy.candles[-1].timestamp != boundary:
+                    continue
+
+                self.signals += 1
+                self._orders.submit(self._open_position, strategy, signal_result)
+
+    @staticmethod
+    def _open_position(strategy: "Strategy", signal_result: int):
+        try:
+            strategy._open_position(signal_result)
+        except Exception as e:
+            logger.error(
+                "Error while opening a position for %s %s: %s",
+                strategy.strat_name,
+                strategy.contract.symbol,
+                e,
+            )
+
+    def stop(self):
+        self._running = False
+
+        for inbox in self._inboxes:
+            inbox.put(("stop",))
+        for process in self._processes:
+            process.join(timeout=5)
+
+        self._listener.join()
+        self._orders.shutdown(wait=False)
+        self._market.close()